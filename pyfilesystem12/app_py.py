@@ -1,9 +1,53 @@
-from flask import Flask, request, make_response
-from python_filesystem.filesystem import FileSystem, DELIMITER
+import atexit
+import json
+import os
+import queue
+import threading
+from flask import Flask, Response, request, make_response
+from python_filesystem.filesystem import FileSystem, DELIMITER, MAX_BUF_FILE_SIZE, NODE_TYPES, NODE_TYPE_NAMES, JSON_PAGE_SIZE, WATCH_QUEUE_SIZE
 from python_filesystem.filesystem import BinaryFile, LogFile, BufferFile
 
 
-fs = FileSystem()
+BUFFER_MAX_WAIT = 30
+STREAM_CHUNK_SIZE = 64 * 1024
+# Deepest subtree GET / exports with ?depth=, every level is paged by limit
+EXPORT_MAX_DEPTH = 8
+# Seconds between keepalive comments on an idle /watch stream
+WATCH_KEEPALIVE = 15
+# Content type of GET /export by ?compression=
+EXPORT_MIMETYPES = {None: "application/x-tar", "gz": "application/gzip", "xz": "application/x-xz"}
+# Operation name -> argument names accepted by /batch, see FileSystem.transaction
+BATCH_OPERATIONS = {
+    "mkdir": ("path", "name"),
+    "mkbin": ("path", "name", "information"),
+    "mklog": ("path", "name", "information"),
+    "mkbuf": ("path", "name", "capacity", "mode"),
+    "append": ("path", "information"),
+    "push": ("path", "information"),
+    "move": ("src", "dest"),
+    "delete": ("path",),
+}
+
+# Bytes the resident tree may use, the rest is spilled to PYFS_SPILL_DIR (or the data dir)
+memory_budget = int(os.environ["PYFS_MEMORY_BUDGET"]) if os.environ.get("PYFS_MEMORY_BUDGET") else None
+
+if os.environ.get("PYFS_DATA_DIR"):
+    # Snapshot + journal persistence, see FileSystem.open
+    fs = FileSystem.open(os.environ["PYFS_DATA_DIR"], fsync=os.environ.get("PYFS_FSYNC", "batch"),
+                         memory_budget=memory_budget, spill_dir=os.environ.get("PYFS_SPILL_DIR"))
+    atexit.register(fs.close)
+else:
+    fs = FileSystem(blob_dir=os.environ.get("PYFS_BLOB_DIR"), memory_budget=memory_budget,
+                    spill_dir=os.environ.get("PYFS_SPILL_DIR"))
+
+if os.environ.get("PYFS_METRICS"):
+    # Share of calls whose path is sampled for /metrics/slowest, 0 only counts
+    fs.enable_metrics(sample_rate=float(os.environ["PYFS_METRICS"]))
+
+if os.environ.get("PYFS_TIER_AFTER"):
+    # Seconds without a read after which content is compressed, see FileSystem.enable_tiering
+    fs.enable_tiering(cold_after=float(os.environ["PYFS_TIER_AFTER"]))
+
 app = Flask(__name__)
 app.config["FILESYSTEM_OBJ"] = fs
 
@@ -16,12 +60,24 @@ def index():
         # Getting file information as json
         path = request.args.get("path", '.')
 
+        # Directory childs are paged (?limit=&cursor=, cursor is the next_cursor
+        # of the previous page), ?depth= nests subdirectories
+        limit = request.args.get("limit", JSON_PAGE_SIZE, type=int)
+        cursor = request.args.get("cursor")
+        depth = min(request.args.get("depth", 0, type=int), EXPORT_MAX_DEPTH)
+
+        if limit < 0 or depth < 0:
+            return make_response({"status": "error", "message": "limit and depth can't be negative"}, 400)
+
         try:
             node_to_response = app_fs.get_node(path)
         except ValueError:
             return make_response({"status": "error", "message": "Wrong path"}, 404)
 
-        return node_to_response.to_json()
+        try:
+            return node_to_response.to_json(limit, cursor, depth)
+        except ValueError as e:
+            return make_response({"status": "error", "message": str(e)}, 400)
 
     elif request.method == "PUT":
         # Move command
@@ -93,15 +149,45 @@ def binaryfile():
         if not isinstance(binary_file, BinaryFile):
             return make_response({"status": "error", "message": "File is not BinaryFile"}, 400)
 
-        return binary_file.read()
+        # Streamed in chunks straight from the stored content, honouring Range
+        length = len(binary_file)
+        start, stop = 0, length
+        status = 200
+
+        if request.range is not None:
+            byte_range = request.range.range_for_length(length)
+
+            if byte_range is None:
+                return make_response({"status": "error", "message": "Range not satisfiable"}, 416)
+
+            start, stop = byte_range
+            status = 206
+
+        def stream():
+            view = binary_file.view(start, stop - start)
+
+            for offset in range(0, len(view), STREAM_CHUNK_SIZE):
+                yield bytes(view[offset:offset + STREAM_CHUNK_SIZE])
+
+        response = Response(stream(), status, mimetype="text/plain" if binary_file.text else "application/octet-stream")
+        response.headers["Accept-Ranges"] = "bytes"
+        response.headers["Content-Length"] = str(stop - start)
+
+        if status == 206:
+            response.headers["Content-Range"] = f"bytes {start}-{stop - 1}/{length}"
+
+        return response
 
 
     elif request.method == "POST":
-        # Creating binary file
+        # Creating binary file, information can also be uploaded as a file
         path = request.form.get("path")
         name = request.form.get("name")
         information = request.form.get("information")
 
+        if information is None and "information" in request.files:
+            information = request.files["information"].read()
+
         if not path or not name:
             return make_response({"status": "error", "message": "Arguments path and name are required"}, 400)
 
@@ -132,7 +218,16 @@ def logtextfile():
         if not isinstance(log_file, LogFile):
             return make_response({"status": "error", "message": "File is not BinaryFile"}, 400)
 
-        return log_file.read()
+        # Ranged (offset/length) and tail (lines) reads
+        lines = request.args.get("lines", type=int)
+
+        if lines is not None:
+            return log_file.tail(lines)
+
+        offset = request.args.get("offset", 0, type=int)
+        length = request.args.get("length", type=int)
+
+        return log_file.read(offset, length)
 
     elif request.method == "PUT":
         path = request.form.get("path")
@@ -146,9 +241,12 @@ def logtextfile():
         if not isinstance(log_file, LogFile):
             return make_response({"status": "error", "message": "File is not BinaryFile"}, 400)
 
-        log_file.append(information)
+        try:
+            size = log_file.append(information)
+        except ValueError as e:
+            return make_response({"status": "error", "message": str(e)}, 400)
 
-        return log_file.read()
+        return make_response({"status": "ok", "size": size}, 200)
 
     elif request.method == "POST":
         path = request.form.get("path")
@@ -181,14 +279,24 @@ def bufferfile():
         if not isinstance(buffer_file, BufferFile):
             return make_response({"status": "error", "message": "File is not BufferFile"}, 400)
 
+        # Long-poll: ?wait=seconds holds the request until data arrives
+        wait = min(request.args.get("wait", 0, type=float), BUFFER_MAX_WAIT)
+
+        # Batch pop: ?count=N returns up to N items as json
+        count = request.args.get("count", type=int)
+
+        if count is not None:
+            return make_response({"items": buffer_file.pop_many(count, timeout=wait)}, 200)
+
         try:
-            return buffer_file.pop()
+            return buffer_file.pop(timeout=wait)
         except ValueError as e:
             return make_response({"status": "error", "message": str(e)}, 400)
     
     elif request.method == "PUT":
         path = request.form.get("path")
-        information = request.form.get("information")
+        # information can be repeated to push a batch
+        information = request.form.getlist("information")
 
         if not path or not information:
             return make_response({"status": "error", "message": "Arguments path and information are required"}, 400)
@@ -198,24 +306,268 @@ def bufferfile():
         if not isinstance(buffer_file, BufferFile):
             return make_response({"status": "error", "message": "File is not BufferFile"}, 400)
 
-        buffer_file.push(information)
+        try:
+            buffer_file.push_many(information)
+        except ValueError as e:
+            return make_response({"status": "error", "message": str(e)}, 400)
 
         return buffer_file.to_json()
 
     elif request.method == "POST":
         path = request.form.get("path")
         name = request.form.get("name")
+        capacity = request.form.get("capacity", MAX_BUF_FILE_SIZE, type=int)
+        mode = request.form.get("mode", "lifo")
 
         if not path or not name:
             return make_response({"status": "error", "message": "Arguments path and name are required"}, 400)
 
         try:
-            created_file = app_fs.create_buffer(path, name)
+            created_file = app_fs.create_buffer(path, name, capacity, mode)
         except ValueError as e:
             return make_response({"status": "erorr", "message": str(e)}, 400)
 
         return make_response(created_file.to_json(), 200)
 
 
+@app.route("/tree", methods=["GET"])
+def tree():
+    # Streams the listing while walking, one line (or json object) per node
+    app_fs = app.config["FILESYSTEM_OBJ"]
+
+    path = request.args.get("path", ".")
+    max_depth = request.args.get("depth", type=int)
+    output = request.args.get("format", "text")
+    types = request.args.get("type")
+
+    try:
+        if types:
+            types = tuple(NODE_TYPES[t] for t in types.split(","))
+
+        nodes = app_fs.walk(path, max_depth=max_depth, types=types or None)
+    except KeyError:
+        return make_response({"status": "error", "message": f"type must be one of {', '.join(NODE_TYPES)}"}, 400)
+    except ValueError as e:
+        return make_response({"status": "error", "message": str(e)}, 400)
+
+    def stream():
+        chunk = []
+        size = 0
+
+        for depth, node in nodes:
+            if output == "jsonl":
+                line = json.dumps({"depth": depth, "name": node.name, "type": NODE_TYPE_NAMES[type(node)]}) + "\n"
+            else:
+                line = "   "*depth + node.name + "\n"
+
+            chunk.append(line)
+            size += len(line)
+
+            if size >= STREAM_CHUNK_SIZE:
+                yield "".join(chunk)
+                chunk = []
+                size = 0
+
+        yield "".join(chunk)
+
+    return Response(stream(), mimetype="application/x-ndjson" if output == "jsonl" else "text/plain")
+
+
+def run_batch(app_fs: FileSystem, operations: list[dict]) -> dict:
+    # Ordered list of operations applied all-or-nothing: the first failure
+    # rolls back everything applied before it
+    results = []
+
+    try:
+        with app_fs.transaction() as transaction:
+            for op in operations:
+                name = op.get("op")
+
+                if name not in BATCH_OPERATIONS:
+                    raise ValueError(f"op must be one of {', '.join(BATCH_OPERATIONS)}")
+
+                args = {arg: op[arg] for arg in BATCH_OPERATIONS[name] if arg in op}
+
+                if name == "push" and not isinstance(args.get("information"), list):
+                    args["information"] = [args.get("information")]
+
+                result = getattr(transaction, name)(**args)
+
+                if isinstance(result, int):
+                    results.append({"status": "ok", "size" if name == "append" else "count": result})
+                else:
+                    results.append({"status": "ok", "path": result.full_path()})
+    except (ValueError, TypeError) as e:
+        # TypeError comes from missing or unexpected arguments of an operation
+        failed = len(results)
+        results = [{"status": "rolled_back"} for _ in results]
+        results.append({"status": "error", "message": str(e)})
+        results += [{"status": "skipped"} for _ in operations[failed + 1:]]
+
+        return {"status": "error", "message": str(e), "index": failed, "results": results}
+
+    return {"status": "ok", "results": results}
+
+
+@app.route("/batch", methods=["POST"])
+def batch():
+    app_fs = app.config["FILESYSTEM_OBJ"]
+    operations = request.get_json(silent=True)
+
+    if not isinstance(operations, list) or not all(isinstance(op, dict) for op in operations):
+        return make_response({"status": "error", "message": "Body must be a json list of operations"}, 400)
+
+    result = run_batch(app_fs, operations)
+
+    return make_response(result, 200 if result["status"] == "ok" else 400)
+
+
+def run_import(app_fs: FileSystem, archive, path: str, name: str | None, progress=None) -> dict:
+    try:
+        node = app_fs.import_tar(archive, path, name, progress=progress)
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
+
+    nodes, size = node.usage()
+
+    return {"status": "ok", "path": node.full_path(), "nodes": nodes, "size": size}
+
+
+@app.route("/import", methods=["POST"])
+def import_archive():
+    # Extracts the tar archive sent as the body (or uploaded as "archive") below
+    # ?path=, see FileSystem.import_tar. With ?progress=1 the answer is json lines,
+    # {"files", "size"} while the archive is read and the result last
+    app_fs = app.config["FILESYSTEM_OBJ"]
+
+    path = request.args.get("path", ".")
+    name = request.args.get("name")
+    archive = request.files["archive"].stream if "archive" in request.files else request.stream
+
+    if request.args.get("progress") != "1":
+        result = run_import(app_fs, archive, path, name)
+
+        return make_response(result, 200 if result["status"] == "ok" else 400)
+
+    events = queue.Queue()
+
+    def progress(files: int, size: int) -> None:
+        events.put({"files": files, "size": size})
+
+    threading.Thread(target=lambda: events.put(run_import(app_fs, archive, path, name, progress)), daemon=True).start()
+
+    def stream():
+        while True:
+            event = events.get()
+            yield json.dumps(event) + "\n"
+
+            if "status" in event:
+                return
+
+    return Response(stream(), mimetype="application/x-ndjson")
+
+
+@app.route("/export", methods=["GET"])
+def export_archive():
+    # Streams ?path= as a tar archive, ?compression= gz or xz, see FileSystem.export_tar
+    app_fs = app.config["FILESYSTEM_OBJ"]
+
+    path = request.args.get("path", ".")
+    compression = request.args.get("compression") or None
+
+    try:
+        chunks = app_fs.export_tar(path, compression)
+    except ValueError as e:
+        return make_response({"status": "error", "message": str(e)}, 400)
+
+    return Response(chunks, mimetype=EXPORT_MIMETYPES[compression])
+
+
+@app.route("/search", methods=["GET"])
+def search():
+    # Answered from the name/type index, not by walking the tree
+    app_fs = app.config["FILESYSTEM_OBJ"]
+
+    pattern = request.args.get("pattern", "*")
+    path = request.args.get("path", "~")
+    limit = request.args.get("limit", type=int)
+    types = request.args.get("type")
+
+    try:
+        if types:
+            types = tuple(NODE_TYPES[t] for t in types.split(","))
+
+        nodes = app_fs.find(pattern, path, types=types or None, limit=limit)
+    except KeyError:
+        return make_response({"status": "error", "message": f"type must be one of {', '.join(NODE_TYPES)}"}, 400)
+    except ValueError as e:
+        return make_response({"status": "error", "message": str(e)}, 400)
+
+    return make_response({"results": [node.full_path() for node in nodes]}, 200)
+
+
+@app.route("/stats", methods=["GET"])
+def stats():
+    app_fs = app.config["FILESYSTEM_OBJ"]
+
+    return make_response({"content": app_fs.content_store.stats()}, 200)
+
+
+def sse_event(event: dict) -> str:
+    return f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+
+
+@app.route("/watch", methods=["GET"])
+def watch():
+    # Server-Sent Events for changes below ?path=, ?recursive=0 only reports
+    # its direct childs and ?size= bounds the queue (see FileSystem.watch)
+    app_fs = app.config["FILESYSTEM_OBJ"]
+
+    path = request.args.get("path", "~")
+    recursive = request.args.get("recursive", "1") != "0"
+    size = min(request.args.get("size", WATCH_QUEUE_SIZE, type=int), WATCH_QUEUE_SIZE)
+
+    try:
+        watcher = app_fs.watch(path, recursive, size)
+    except ValueError as e:
+        return make_response({"status": "error", "message": str(e)}, 400)
+
+    def stream():
+        # The watcher is closed when the client goes away and the next write fails
+        with watcher:
+            yield f": watching {watcher.path}\n\n"
+
+            while not watcher.closed:
+                event = watcher.get(timeout=WATCH_KEEPALIVE)
+                yield ": keepalive\n\n" if event is None else sse_event(event)
+
+    # Also closed when the response is dropped before the stream starts
+    response = Response(stream(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+    response.call_on_close(watcher.close)
+
+    return response
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    # Prometheus text format, counting starts with FileSystem.enable_metrics
+    app_fs = app.config["FILESYSTEM_OBJ"]
+
+    if app_fs.metrics is None:
+        return make_response({"status": "error", "message": "Metrics are disabled"}, 404)
+
+    return Response(app_fs.metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/metrics/slowest", methods=["GET"])
+def slowest():
+    app_fs = app.config["FILESYSTEM_OBJ"]
+
+    if app_fs.metrics is None:
+        return make_response({"status": "error", "message": "Metrics are disabled"}, 404)
+
+    return make_response({"calls": app_fs.metrics.slowest()}, 200)
+
+
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,511 @@
+import asyncio
+import io
+import json
+from quart import Quart, Response, request, make_response
+from python_filesystem.filesystem import DELIMITER, MAX_BUF_FILE_SIZE, NODE_TYPES, NODE_TYPE_NAMES, JSON_PAGE_SIZE, WATCH_QUEUE_SIZE
+from python_filesystem.filesystem import BinaryFile, LogFile, BufferFile
+from app import fs, run_batch, run_import, sse_event, BUFFER_MAX_WAIT, STREAM_CHUNK_SIZE, EXPORT_MAX_DEPTH, WATCH_KEEPALIVE
+from app import EXPORT_MIMETYPES
+
+
+# asyncio variant of app_py.py: same routes and json over the same FileSystem.
+# Anything that can wait on a lock or walk the tree runs in the default
+# executor (path lookups and json included, a checkpoint or a transaction
+# holds the barrier), buffer long-polls park on the event loop instead of a thread.
+# Run with: hypercorn asgi:app
+app = Quart(__name__)
+app.config["FILESYSTEM_OBJ"] = fs
+
+blocking = asyncio.to_thread
+
+
+@app.route("/", methods=["GET", "PUT", "DELETE"])
+async def index():
+    app_fs = app.config["FILESYSTEM_OBJ"]
+
+    if request.method == "GET":
+        path = request.args.get("path", '.')
+
+        # Directory childs are paged (?limit=&cursor=, cursor is the next_cursor
+        # of the previous page), ?depth= nests subdirectories
+        limit = request.args.get("limit", JSON_PAGE_SIZE, type=int)
+        cursor = request.args.get("cursor")
+        depth = min(request.args.get("depth", 0, type=int), EXPORT_MAX_DEPTH)
+
+        if limit < 0 or depth < 0:
+            return await make_response({"status": "error", "message": "limit and depth can't be negative"}, 400)
+
+        try:
+            node_to_response = await blocking(app_fs.get_node, path)
+        except ValueError:
+            return await make_response({"status": "error", "message": "Wrong path"}, 404)
+
+        try:
+            return await blocking(node_to_response.to_json, limit, cursor, depth)
+        except ValueError as e:
+            return await make_response({"status": "error", "message": str(e)}, 400)
+
+    elif request.method == "PUT":
+        form = await request.form
+        src = form.get("src")
+        dest = form.get("dest")
+
+        if not src or not dest:
+            return await make_response({"status": "error", "message": "You need to specify src and dest to move elements!"}, 400)
+
+        src_folder_path = src[:src.rindex(DELIMITER)]
+        src_filename = src[src.rindex(DELIMITER)+1:]
+
+        try:
+            src_folder = await blocking(app_fs.get_node, src_folder_path)
+            move_result = await blocking(src_folder.move, src_filename, dest)
+        except ValueError as e:
+            return await make_response({"status": "error", "message": str(e)}, 400)
+
+        return await blocking(move_result.to_json)
+
+    elif request.method == "DELETE":
+        path = (await request.form).get("path")
+
+        if path is None:
+            return await make_response({"status": "error", "message": "Argument path is required!"}, 400)
+
+        try:
+            target_node = await blocking(app_fs.get_node, path)
+            return await blocking(lambda: target_node.delete().to_json())
+        except ValueError as e:
+            return await make_response({"status": "error", "message": str(e)}, 400)
+
+
+@app.route("/directory", methods=["POST"])
+async def directory():
+    app_fs = app.config["FILESYSTEM_OBJ"]
+
+    form = await request.form
+    path = form.get("path")
+    name = form.get("name")
+
+    if not path or not name:
+        return await make_response({"status": "error", "message": "args path and name are required"}, 400)
+
+    try:
+        created_dir = await blocking(app_fs.create_directory, path, name)
+    except ValueError as e:
+        return await make_response({"status": "erorr", "message": str(e)}, 400)
+
+    return await make_response(created_dir.to_json(), 200)
+
+
+@app.route("/binaryfile", methods=["GET", "POST"])
+async def binaryfile():
+    app_fs = app.config["FILESYSTEM_OBJ"]
+
+    if request.method == "GET":
+        path = request.args.get("path")
+
+        if not path:
+            return await make_response({"status": "error", "message": "Argument path is required"}, 400)
+
+        binary_file = await blocking(app_fs.get_node, path)
+
+        if not isinstance(binary_file, BinaryFile):
+            return await make_response({"status": "error", "message": "File is not BinaryFile"}, 400)
+
+        length = len(binary_file)
+        start, stop = 0, length
+        status = 200
+
+        if request.range is not None:
+            byte_range = request.range.range_for_length(length)
+
+            if byte_range is None:
+                return await make_response({"status": "error", "message": "Range not satisfiable"}, 416)
+
+            start, stop = byte_range
+            status = 206
+
+        async def stream():
+            view = await blocking(binary_file.view, start, stop - start)
+
+            for offset in range(0, len(view), STREAM_CHUNK_SIZE):
+                yield bytes(view[offset:offset + STREAM_CHUNK_SIZE])
+
+        response = Response(stream(), status, mimetype="text/plain" if binary_file.text else "application/octet-stream")
+        response.headers["Accept-Ranges"] = "bytes"
+        response.headers["Content-Length"] = str(stop - start)
+
+        if status == 206:
+            response.headers["Content-Range"] = f"bytes {start}-{stop - 1}/{length}"
+
+        return response
+
+    elif request.method == "POST":
+        form = await request.form
+        path = form.get("path")
+        name = form.get("name")
+        information = form.get("information")
+
+        if information is None:
+            files = await request.files
+
+            if "information" in files:
+                information = files["information"].read()
+
+        if not path or not name:
+            return await make_response({"status": "error", "message": "Arguments path and name are required"}, 400)
+
+        if not information:
+            return await make_response({"status": "error", "message": "Argument information is required"}, 400)
+
+        try:
+            created_file = await blocking(app_fs.create_binary_file, path, name, information)
+        except ValueError as e:
+            return await make_response({"status": "erorr", "message": str(e)}, 400)
+
+        return await make_response(created_file.to_json(), 200)
+
+
+@app.route("/logtextfile", methods=["GET", "POST", "PUT"])
+async def logtextfile():
+    app_fs = app.config["FILESYSTEM_OBJ"]
+
+    if request.method == "GET":
+        path = request.args.get("path")
+
+        if not path:
+            return await make_response({"status": "error", "message": "Argument path is required"}, 400)
+
+        log_file = await blocking(app_fs.get_node, path)
+
+        if not isinstance(log_file, LogFile):
+            return await make_response({"status": "error", "message": "File is not BinaryFile"}, 400)
+
+        lines = request.args.get("lines", type=int)
+
+        if lines is not None:
+            return await blocking(log_file.tail, lines)
+
+        offset = request.args.get("offset", 0, type=int)
+        length = request.args.get("length", type=int)
+
+        return await blocking(log_file.read, offset, length)
+
+    elif request.method == "PUT":
+        form = await request.form
+        path = form.get("path")
+        information = form.get("information")
+
+        if not path or not information:
+            return await make_response({"status": "error", "message": "Arguments path and information is required"}, 400)
+
+        log_file = await blocking(app_fs.get_node, path)
+
+        if not isinstance(log_file, LogFile):
+            return await make_response({"status": "error", "message": "File is not BinaryFile"}, 400)
+
+        try:
+            size = await blocking(log_file.append, information)
+        except ValueError as e:
+            return await make_response({"status": "error", "message": str(e)}, 400)
+
+        return await make_response({"status": "ok", "size": size}, 200)
+
+    elif request.method == "POST":
+        form = await request.form
+        path = form.get("path")
+        name = form.get("name")
+        information = form.get("information")
+
+        if not path or not name:
+            return await make_response({"status": "error", "message": "Arguments path and name are required"}, 400)
+
+        try:
+            created_file = await blocking(app_fs.create_log_file, path, name, information)
+        except ValueError as e:
+            return await make_response({"status": "erorr", "message": str(e)}, 400)
+
+        return await make_response(created_file.to_json(), 200)
+
+
+@app.route("/bufferfile", methods=["GET", "PUT", "POST"])
+async def bufferfile():
+    app_fs = app.config["FILESYSTEM_OBJ"]
+
+    if request.method == "GET":
+        path = request.args.get("path")
+
+        if not path:
+            return await make_response({"status": "error", "message": "Argument path is required"}, 400)
+
+        buffer_file = await blocking(app_fs.get_node, path)
+
+        if not isinstance(buffer_file, BufferFile):
+            return await make_response({"status": "error", "message": "File is not BufferFile"}, 400)
+
+        # Long-polls wait on the loop (BufferFile.apop), not in a worker thread
+        wait = min(request.args.get("wait", 0, type=float), BUFFER_MAX_WAIT)
+        count = request.args.get("count", type=int)
+
+        if count is not None:
+            items = []
+
+            if count > 0 and wait:
+                try:
+                    items.append(await buffer_file.apop(timeout=wait))
+                except ValueError:
+                    pass
+
+            items += await blocking(buffer_file.pop_many, count - len(items))
+
+            return await make_response({"items": items}, 200)
+
+        try:
+            return await buffer_file.apop(timeout=wait)
+        except ValueError as e:
+            return await make_response({"status": "error", "message": str(e)}, 400)
+
+    elif request.method == "PUT":
+        form = await request.form
+        path = form.get("path")
+        information = form.getlist("information")
+
+        if not path or not information:
+            return await make_response({"status": "error", "message": "Arguments path and information are required"}, 400)
+
+        buffer_file = await blocking(app_fs.get_node, path)
+
+        if not isinstance(buffer_file, BufferFile):
+            return await make_response({"status": "error", "message": "File is not BufferFile"}, 400)
+
+        try:
+            await blocking(buffer_file.push_many, information)
+        except ValueError as e:
+            return await make_response({"status": "error", "message": str(e)}, 400)
+
+        return await blocking(buffer_file.to_json)
+
+    elif request.method == "POST":
+        form = await request.form
+        path = form.get("path")
+        name = form.get("name")
+        capacity = form.get("capacity", MAX_BUF_FILE_SIZE, type=int)
+        mode = form.get("mode", "lifo")
+
+        if not path or not name:
+            return await make_response({"status": "error", "message": "Arguments path and name are required"}, 400)
+
+        try:
+            created_file = await blocking(app_fs.create_buffer, path, name, capacity, mode)
+        except ValueError as e:
+            return await make_response({"status": "erorr", "message": str(e)}, 400)
+
+        return await make_response(created_file.to_json(), 200)
+
+
+@app.route("/tree", methods=["GET"])
+async def tree():
+    # Walked in the executor a chunk at a time, so a huge tree never blocks the loop
+    app_fs = app.config["FILESYSTEM_OBJ"]
+
+    path = request.args.get("path", ".")
+    max_depth = request.args.get("depth", type=int)
+    output = request.args.get("format", "text")
+    types = request.args.get("type")
+
+    try:
+        if types:
+            types = tuple(NODE_TYPES[t] for t in types.split(","))
+
+        nodes = app_fs.walk(path, max_depth=max_depth, types=types or None)
+    except KeyError:
+        return await make_response({"status": "error", "message": f"type must be one of {', '.join(NODE_TYPES)}"}, 400)
+    except ValueError as e:
+        return await make_response({"status": "error", "message": str(e)}, 400)
+
+    def next_chunk() -> str:
+        chunk = []
+        size = 0
+
+        for depth, node in nodes:
+            if output == "jsonl":
+                line = json.dumps({"depth": depth, "name": node.name, "type": NODE_TYPE_NAMES[type(node)]}) + "\n"
+            else:
+                line = "   "*depth + node.name + "\n"
+
+            chunk.append(line)
+            size += len(line)
+
+            if size >= STREAM_CHUNK_SIZE:
+                break
+
+        return "".join(chunk)
+
+    async def stream():
+        while chunk := await blocking(next_chunk):
+            yield chunk
+
+    return Response(stream(), mimetype="application/x-ndjson" if output == "jsonl" else "text/plain")
+
+
+@app.route("/batch", methods=["POST"])
+async def batch():
+    app_fs = app.config["FILESYSTEM_OBJ"]
+    operations = await request.get_json(silent=True)
+
+    if not isinstance(operations, list) or not all(isinstance(op, dict) for op in operations):
+        return await make_response({"status": "error", "message": "Body must be a json list of operations"}, 400)
+
+    # The transaction is bound to the executor thread that runs it
+    result = await blocking(run_batch, app_fs, operations)
+
+    return await make_response(result, 200 if result["status"] == "ok" else 400)
+
+
+@app.route("/import", methods=["POST"])
+async def import_archive():
+    # The archive is received whole (up to MAX_CONTENT_LENGTH) and extracted in the executor
+    app_fs = app.config["FILESYSTEM_OBJ"]
+
+    path = request.args.get("path", ".")
+    name = request.args.get("name")
+    files = await request.files
+    archive = files["archive"].stream if "archive" in files else io.BytesIO(await request.get_data())
+
+    if request.args.get("progress") != "1":
+        result = await blocking(run_import, app_fs, archive, path, name)
+
+        return await make_response(result, 200 if result["status"] == "ok" else 400)
+
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+
+    def progress(files: int, size: int) -> None:
+        loop.call_soon_threadsafe(events.put_nowait, {"files": files, "size": size})
+
+    def run() -> None:
+        result = run_import(app_fs, archive, path, name, progress)
+        loop.call_soon_threadsafe(events.put_nowait, result)
+
+    task = asyncio.ensure_future(blocking(run))
+
+    async def stream():
+        while True:
+            event = await events.get()
+            yield json.dumps(event) + "\n"
+
+            if "status" in event:
+                await task
+                return
+
+    return Response(stream(), mimetype="application/x-ndjson")
+
+
+@app.route("/export", methods=["GET"])
+async def export_archive():
+    app_fs = app.config["FILESYSTEM_OBJ"]
+
+    path = request.args.get("path", ".")
+    compression = request.args.get("compression") or None
+
+    try:
+        chunks = await blocking(app_fs.export_tar, path, compression)
+    except ValueError as e:
+        return await make_response({"status": "error", "message": str(e)}, 400)
+
+    async def stream():
+        # Built in the executor a chunk at a time
+        while chunk := await blocking(next, chunks, b""):
+            yield chunk
+
+    return Response(stream(), mimetype=EXPORT_MIMETYPES[compression])
+
+
+@app.route("/search", methods=["GET"])
+async def search():
+    app_fs = app.config["FILESYSTEM_OBJ"]
+
+    pattern = request.args.get("pattern", "*")
+    path = request.args.get("path", "~")
+    limit = request.args.get("limit", type=int)
+    types = request.args.get("type")
+
+    try:
+        if types:
+            types = tuple(NODE_TYPES[t] for t in types.split(","))
+
+        nodes = await blocking(app_fs.find, pattern, path, types=types or None, limit=limit)
+    except KeyError:
+        return await make_response({"status": "error", "message": f"type must be one of {', '.join(NODE_TYPES)}"}, 400)
+    except ValueError as e:
+        return await make_response({"status": "error", "message": str(e)}, 400)
+
+    return await make_response({"results": [node.full_path() for node in nodes]}, 200)
+
+
+@app.route("/stats", methods=["GET"])
+async def stats():
+    app_fs = app.config["FILESYSTEM_OBJ"]
+
+    return await make_response({"content": app_fs.content_store.stats()}, 200)
+
+
+@app.route("/watch", methods=["GET"])
+async def watch():
+    # Streams park on the loop (Watcher.aget), an idle client holds no thread
+    app_fs = app.config["FILESYSTEM_OBJ"]
+
+    path = request.args.get("path", "~")
+    recursive = request.args.get("recursive", "1") != "0"
+    size = min(request.args.get("size", WATCH_QUEUE_SIZE, type=int), WATCH_QUEUE_SIZE)
+
+    if size < 1:
+        return await make_response({"status": "error", "message": "Watch queue size must be positive"}, 400)
+
+    try:
+        await blocking(app_fs.get_node, path)
+    except ValueError as e:
+        return await make_response({"status": "error", "message": str(e)}, 400)
+
+    async def stream():
+        # Registered once the stream runs, a response that is never sent leaves nothing behind
+        try:
+            watcher = await blocking(app_fs.watch, path, recursive, size)
+        except ValueError as e:
+            yield f": {e}\n\n"
+            return
+
+        with watcher:
+            yield f": watching {watcher.path}\n\n"
+
+            while not watcher.closed:
+                event = await watcher.aget(timeout=WATCH_KEEPALIVE)
+                yield ": keepalive\n\n" if event is None else sse_event(event)
+
+    response = Response(stream(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+    response.timeout = None
+
+    return response
+
+
+@app.route("/metrics", methods=["GET"])
+async def metrics():
+    app_fs = app.config["FILESYSTEM_OBJ"]
+
+    if app_fs.metrics is None:
+        return await make_response({"status": "error", "message": "Metrics are disabled"}, 404)
+
+    return Response(app_fs.metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/metrics/slowest", methods=["GET"])
+async def slowest():
+    app_fs = app.config["FILESYSTEM_OBJ"]
+
+    if app_fs.metrics is None:
+        return await make_response({"status": "error", "message": "Metrics are disabled"}, 404)
+
+    return await make_response({"calls": app_fs.metrics.slowest()}, 200)
+
+
+if __name__ == "__main__":
+    app.run()
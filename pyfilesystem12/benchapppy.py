@@ -0,0 +1,178 @@
+from app import app
+from python_filesystem.filesystem import FileSystem
+from contextlib import contextmanager
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+
+def timed(fn, *args) -> float:
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def bench_batch(creates: int, batch_size: int = 1_000) -> dict[str, float]:
+    '''Total time (s) of `creates` BinaryFile creations, one request each and through /batch'''
+    result = {}
+
+    for label in ["individual", "batched"]:
+        app.config.update({"TESTING": True, "FILESYSTEM_OBJ": FileSystem(dir_max_elems=None)})
+        client = app.test_client()
+
+        def individual():
+            for i in range(creates):
+                client.post("/binaryfile", data={"path": ".", "name": f"f{i}", "information": "payload"})
+
+        def batched():
+            for start in range(0, creates, batch_size):
+                client.post("/batch", json=[
+                    {"op": "mkbin", "path": ".", "name": f"f{i}", "information": "payload"}
+                    for i in range(start, min(creates, start + batch_size))
+                ])
+
+        result[label] = timed(individual if label == "individual" else batched)
+
+    return result
+
+
+SERVERS = {
+    "flask": [sys.executable, "-m", "flask", "--app", "app", "run", "--with-threads"],
+    "asgi": [sys.executable, "-m", "hypercorn", "asgi:app", "--backlog", "2048"],
+}
+
+
+@contextmanager
+def serve(name: str, port: int):
+    '''Runs one of SERVERS on `port` in a subprocess until the block exits'''
+    command = SERVERS[name] + (["--port", str(port)] if name == "flask" else ["--bind", f"127.0.0.1:{port}"])
+    server = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    try:
+        for _ in range(100):
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.terminate()
+        server.wait()
+
+
+async def fetch(port: int, target: str, connection: list) -> None:
+    # One HTTP/1.1 GET on a kept-alive connection, reopened when the server closes it
+    if not connection:
+        connection[:] = await asyncio.open_connection("127.0.0.1", port)
+
+    reader, writer = connection
+    writer.write(f"GET {target} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+    headers = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").lower()
+    length = 0
+
+    for line in headers.split("\r\n"):
+        if line.startswith("content-length:"):
+            length = int(line[15:])
+
+    await reader.readexactly(length)
+
+    if "connection: close" in headers or headers.startswith("http/1.0"):
+        writer.close()
+        connection.clear()
+
+
+async def load(port: int, clients: int, requests: int, holders: int) -> tuple[float, list[float]]:
+    '''Wall time and per-request latencies of `clients` concurrent clients, while
+    `holders` more clients keep long-polls open on an empty BufferFile'''
+    latencies = []
+    done = asyncio.Event()
+
+    async def client():
+        connection = []
+
+        for _ in range(requests):
+            start = time.perf_counter()
+            await fetch(port, "/logtextfile?path=./bench.log&lines=10", connection)
+            latencies.append(time.perf_counter() - start)
+
+        if connection:
+            connection[1].close()
+
+    async def holder():
+        connection = []
+
+        while not done.is_set():
+            await fetch(port, "/bufferfile?path=./bench.buf&count=1&wait=1", connection)
+
+        if connection:
+            connection[1].close()
+
+    holding = [asyncio.create_task(holder()) for _ in range(holders)]
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await asyncio.gather(*holding, return_exceptions=True)
+
+    return elapsed, latencies
+
+
+def bench_load(clients: int, requests: int = 20, holders: int = 100) -> dict[str, dict[str, float]]:
+    '''Requests/s and p99 latency (ms) of log tail reads for the Flask and the ASGI server'''
+    result = {}
+
+    for port, name in enumerate(SERVERS, start=18000):
+        with serve(name, port) as url:
+            seed = json.dumps([
+                {"op": "mklog", "path": ".", "name": "bench.log", "information": "request served\n" * 1000},
+                {"op": "mkbuf", "path": ".", "name": "bench.buf"},
+            ]).encode()
+            urllib.request.urlopen(urllib.request.Request(f"{url}/batch", seed, {"Content-Type": "application/json"}))
+
+            elapsed, latencies = asyncio.run(load(port, clients, requests, holders))
+            latencies.sort()
+
+            result[name] = {
+                "rps": len(latencies) / elapsed,
+                "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1e3,
+            }
+
+    return result
+
+
+def main_batch(creates: int = 10_000) -> None:
+    result = bench_batch(creates)
+
+    print(f"{creates} creates, individual requests: {result['individual']:.2f} s")
+    print(f"{creates} creates, /batch of 1000: {result['batched']:.2f} s ({result['individual'] / result['batched']:.1f}x)")
+
+
+def main_load(clients: int = 1_000) -> None:
+    result = bench_load(clients)
+
+    print(f"{clients} clients, 100 long-polls held open")
+    for name, stats in result.items():
+        print(f"{name}: {stats['rps']:,.0f} requests/s, p99 {stats['p99_ms']:.1f} ms")
+
+
+BENCHMARKS = {
+    "batch": main_batch,
+    "load": main_load,
+}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:2] or list(BENCHMARKS)
+    size = [int(sys.argv[2])] if len(sys.argv) > 2 else []
+
+    for name in names:
+        print(f"== {name} ==")
+        BENCHMARKS[name](*size)
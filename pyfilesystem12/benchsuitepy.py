@@ -0,0 +1,313 @@
+from app import app
+from python_filesystem.filesystem import FileSystem, Directory, BinaryFile
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+
+# Offline regression suite over the core and the HTTP API. Every metric is a
+# cost (time per operation), so higher than the baseline is always worse.
+#   python -m benchsuitepy --save                 write bench_baseline.json
+#   python -m benchsuitepy                        compare against it, exit 1 on a regression
+#   python -m benchsuitepy --quick --only resolve,http_get
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+THRESHOLD = 0.25
+REPEAT = 3
+
+
+def timed(fn, *args) -> float:
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def wide_tree(fs: FileSystem, size: int) -> Directory:
+    '''One directory holding `size` BinaryFiles'''
+    wide = fs.root.create_directory("wide")
+
+    for i in range(size):
+        wide.create_binary_file(f"f{i}", "")
+
+    return wide
+
+
+def deep_tree(fs: FileSystem, depth: int) -> Directory:
+    '''A chain of `depth` directories, returns the deepest'''
+    directory = fs.root
+
+    for i in range(depth):
+        directory = directory.create_directory(f"d{i}")
+
+    return directory
+
+
+def balanced_tree(fs: FileSystem, nodes: int, fanout: int = 10) -> Directory:
+    '''Breadth-first tree of `nodes` directories and BinaryFile leaves under ~/balanced'''
+    top = fs.root.create_directory("balanced")
+    level = [top]
+    created = 0
+
+    while created < nodes:
+        next_level = []
+
+        for directory in level:
+            for i in range(fanout):
+                if created >= nodes:
+                    break
+
+                if created + len(level) * fanout < nodes:
+                    next_level.append(directory.create_directory(f"d{i}"))
+                else:
+                    directory.create_binary_file(f"f{i}", "")
+
+                created += 1
+
+        level = next_level
+
+    return top
+
+
+def case_resolve(scale: float) -> dict[str, float]:
+    lookups = int(100_000 * scale)
+    result = {}
+
+    for label, cache_size in [("uncached_ns", 0), ("cached_ns", 4096)]:
+        fs = FileSystem(dir_max_elems=None, path_cache_size=cache_size)
+        deep_tree(fs, 32)
+        path = "./" + "/".join(f"d{i}" for i in range(32))
+
+        def lookup():
+            for _ in range(lookups):
+                fs.get_node(path)
+
+        result[label] = timed(lookup) / lookups * 1e9
+
+    return result
+
+
+def case_wide(scale: float) -> dict[str, float]:
+    size = int(100_000 * scale)
+    fs = FileSystem(dir_max_elems=None)
+    other = fs.root.create_directory("other")
+    names = [f"f{i}" for i in range(size)]
+
+    create_time = timed(wide_tree, fs, size)
+    wide = fs.get_node("./wide")
+
+    def move():
+        for name in names[::2]:
+            wide.move(name, "~/other")
+
+    def delete():
+        for name in names[1::2]:
+            wide.get_child(name).delete()
+
+    return {
+        "create_ns": create_time / size * 1e9,
+        "move_ns": timed(move) / len(names[::2]) * 1e9,
+        "delete_ns": timed(delete) / len(names[1::2]) * 1e9,
+        "lookup_ns": timed(lambda: [other.get_child(name) for name in names[::2]]) / len(names[::2]) * 1e9,
+    }
+
+
+def case_balanced(scale: float) -> dict[str, float]:
+    nodes = int(100_000 * scale)
+    fs = FileSystem(dir_max_elems=None)
+    create_time = timed(balanced_tree, fs, nodes)
+    fs.root.create_directory("dest")
+
+    return {
+        "create_ns": create_time / nodes * 1e9,
+        "walk_ns": timed(lambda: sum(1 for _ in fs.walk())) / nodes * 1e9,
+        "find_us": timed(fs.find, "f9*", "~", (BinaryFile,)) * 1e6,
+        "subtree_move_us": timed(fs.root.move, "balanced", "~/dest") * 1e6,
+    }
+
+
+def case_log(scale: float) -> dict[str, float]:
+    appends = int(100_000 * scale)
+    fs = FileSystem()
+    log_file = fs.create_log_file(".", "bench.log")
+
+    def append():
+        for _ in range(appends):
+            log_file.append("2024-01-01 00:00:00 INFO request served in 12ms\n")
+
+    return {
+        "append_ns": timed(append) / appends * 1e9,
+        "tail_us": timed(log_file.tail, 100) * 1e6,
+    }
+
+
+def case_buffer(scale: float) -> dict[str, float]:
+    ops = int(100_000 * scale)
+    fs = FileSystem()
+    result = {}
+
+    for mode in ["lifo", "fifo"]:
+        buffer_file = fs.create_buffer(".", f"bench.{mode}", 64, mode)
+
+        def push_pop():
+            for i in range(ops):
+                buffer_file.push(i)
+                buffer_file.pop()
+
+        result[f"{mode}_push_pop_ns"] = timed(push_pop) / ops * 1e9
+
+    return result
+
+
+def http_client(fs: FileSystem):
+    app.config.update({"TESTING": True, "FILESYSTEM_OBJ": fs})
+    return app.test_client()
+
+
+def case_http_get(scale: float) -> dict[str, float]:
+    requests = int(2_000 * scale)
+    fs = FileSystem(dir_max_elems=None)
+    balanced_tree(fs, 1_000)
+    client = http_client(fs)
+
+    def get():
+        for _ in range(requests):
+            client.get("/", query_string={"path": "./balanced/d0/d0"})
+
+    return {"request_us": timed(get) / requests * 1e6}
+
+
+def case_http_write(scale: float) -> dict[str, float]:
+    requests = int(2_000 * scale)
+    fs = FileSystem(dir_max_elems=None)
+    client = http_client(fs)
+    client.post("/logtextfile", data={"path": ".", "name": "bench.log"})
+    client.post("/bufferfile", data={"path": ".", "name": "bench.buf", "capacity": 16})
+
+    def create():
+        for i in range(requests):
+            client.post("/binaryfile", data={"path": ".", "name": f"f{i}", "information": "payload"})
+
+    def append():
+        for _ in range(requests):
+            client.put("/logtextfile", data={"path": "./bench.log", "information": "request served\n"})
+
+    def push_pop():
+        for i in range(requests):
+            client.put("/bufferfile", data={"path": "./bench.buf", "information": str(i)})
+            client.get("/bufferfile", query_string={"path": "./bench.buf"})
+
+    def batch():
+        client.post("/batch", json=[
+            {"op": "mkdir", "path": ".", "name": f"b{i}"} for i in range(requests)
+        ])
+
+    return {
+        "create_us": timed(create) / requests * 1e6,
+        "append_us": timed(append) / requests * 1e6,
+        "push_pop_us": timed(push_pop) / requests * 1e6,
+        "batch_op_us": timed(batch) / requests * 1e6,
+    }
+
+
+CASES = {
+    "resolve": case_resolve,
+    "wide": case_wide,
+    "balanced": case_balanced,
+    "log": case_log,
+    "buffer": case_buffer,
+    "http_get": case_http_get,
+    "http_write": case_http_write,
+}
+
+
+def run(names: list[str], scale: float, repeat: int) -> dict[str, dict[str, float]]:
+    # Best of `repeat` runs per metric, the minimum is the least noisy estimate
+    results = {}
+
+    for name in names:
+        runs = [CASES[name](scale) for _ in range(repeat)]
+        results[name] = {metric: min(r[metric] for r in runs) for metric in runs[0]}
+
+    return results
+
+
+def compare(results: dict[str, dict[str, float]], baseline: dict[str, dict[str, float]],
+            threshold: float) -> list[tuple[str, float, float, float]]:
+    '''(case.metric, baseline, current, ratio) of every metric slower than baseline by more than threshold'''
+    regressions = []
+
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            previous = baseline.get(name, {}).get(metric)
+
+            if previous and value / previous > 1 + threshold:
+                regressions.append((f"{name}.{metric}", previous, value, value / previous))
+
+    return regressions
+
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(prog="benchsuitepy", description="Offline benchmark suite with a saved baseline")
+    parser.add_argument("--only", help="comma separated cases: " + ", ".join(CASES))
+    parser.add_argument("--baseline", default=BASELINE, help="baseline json to compare against")
+    parser.add_argument("--output", help="also write the results json here")
+    parser.add_argument("--save", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="allowed slowdown, 0.25 is 25%%")
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--quick", action="store_true", help="a tenth of the default sizes")
+    args = parser.parse_args(argv)
+
+    names = args.only.split(",") if args.only else list(CASES)
+    unknown = [name for name in names if name not in CASES]
+
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(unknown)}")
+
+    scale = 0.1 if args.quick else 1.0
+    results = run(names, scale, args.repeat)
+    document = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "scale": scale,
+        "results": results,
+    }
+
+    baseline = None
+
+    if not args.save and os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+        if baseline.get("scale") != scale:
+            print(f"baseline was taken at scale {baseline.get('scale')}, not comparing")
+            baseline = None
+
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            line = f"{name + '.' + metric:<32} {value:>12.1f}"
+
+            if baseline and metric in baseline["results"].get(name, {}):
+                line += f"   {value / baseline['results'][name][metric]:>6.2f}x baseline"
+
+            print(line)
+
+    for path in [args.output, args.baseline if args.save else None]:
+        if path:
+            with open(path, "w") as file:
+                json.dump(document, file, indent=2)
+
+    if baseline is None:
+        return 0
+
+    regressions = compare(results, baseline["results"], args.threshold)
+
+    for metric, previous, value, ratio in regressions:
+        print(f"REGRESSION {metric}: {previous:.1f} -> {value:.1f} ({ratio:.2f}x)")
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
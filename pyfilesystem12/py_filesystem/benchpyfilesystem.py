@@ -0,0 +1,672 @@
+from filesystem import FileSystem, ShardedFileSystem, BinaryFile
+import ctypes
+import gc
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+
+def timed(fn, *args) -> float:
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def bench_wide_directory(size: int) -> dict[str, float]:
+    '''Per-operation cost (ns) of create/lookup/move/delete in a directory with `size` childs'''
+    fs = FileSystem(dir_max_elems=None)
+    wide = fs.root.create_directory("wide")
+    other = fs.root.create_directory("other")
+    names = [f"f{i}" for i in range(size)]
+    step = max(2, size // 1000)
+    sample = names[::step]
+    to_delete = names[1::step]
+
+    def create():
+        for name in names:
+            wide.create_binary_file(name, "")
+
+    def lookup():
+        for name in sample:
+            wide.get_child(name)
+
+    def move():
+        for name in sample:
+            wide.move(name, "~/other")
+
+    def delete():
+        for name in to_delete:
+            wide.get_child(name).delete()
+
+    return {
+        "create": timed(create) / size * 1e9,
+        "lookup": timed(lookup) / len(sample) * 1e9,
+        "move": timed(move) / len(sample) * 1e9,
+        "delete": timed(delete) / len(to_delete) * 1e9,
+    }
+
+
+def build_tree(fs: FileSystem, nodes: int, fanout: int) -> int:
+    '''Breadth-first tree of directories with BinaryFile leaves, returns number of created nodes'''
+    level = [fs.root]
+    created = 0
+
+    while created < nodes:
+        next_level = []
+
+        for directory in level:
+            for i in range(fanout):
+                if created >= nodes:
+                    break
+
+                if created + len(level) * fanout < nodes:
+                    next_level.append(directory.create_directory(f"d{i}"))
+                else:
+                    directory.create_binary_file(f"f{i}", "")
+
+                created += 1
+
+        level = next_level
+
+    return created
+
+
+def bench_tree_memory(nodes: int, fanout: int = 100, depth: int = 2_000) -> dict[str, float]:
+    '''Bytes per node of a balanced tree, of a deep chain, and cost of moving a whole subtree'''
+    tracemalloc.start()
+
+    fs = FileSystem(dir_max_elems=None)
+    created = build_tree(fs, nodes, fanout)
+    balanced = tracemalloc.get_traced_memory()[0]
+
+    chain = FileSystem(dir_max_elems=None)
+    directory = chain.root
+    for i in range(depth):
+        directory = directory.create_directory(f"d{i}")
+    deep = tracemalloc.get_traced_memory()[0] - balanced
+
+    tracemalloc.stop()
+
+    fs.root.create_directory("dest")
+    move_time = timed(fs.root.move, "d0", "~/dest")
+
+    return {
+        "nodes": created,
+        "balanced_bytes_per_node": balanced / created,
+        "deep_bytes_per_node": deep / depth,
+        "subtree_move_us": move_time * 1e6,
+    }
+
+
+def bench_resolve(depth: int, lookups: int = 100_000) -> dict[str, float]:
+    '''Per-lookup cost (ns) of get_node on a `depth` long path, with and without the path cache'''
+    result = {}
+
+    for label, cache_size in [("uncached", 0), ("cached", 4096)]:
+        fs = FileSystem(dir_max_elems=None, path_cache_size=cache_size)
+        directory = fs.root
+        for i in range(depth):
+            directory = directory.create_directory(f"dir_{i}")
+
+        path = "./" + "/".join(f"dir_{i}" for i in range(depth))
+
+        def lookup():
+            for _ in range(lookups):
+                fs.get_node(path)
+
+        result[label] = timed(lookup) / lookups * 1e9
+
+    return result
+
+
+class StrLogFile():
+    '''Previous LogFile storage, a single str grown with +='''
+    def __init__(self):
+        self.information = ""
+
+    def append(self, information: str) -> None:
+        self.information += information
+
+
+def bench_log_append(appends: int) -> dict[str, float]:
+    '''Total time (s) of `appends` log lines for the old str storage and the chunked LogFile'''
+    fs = FileSystem()
+    log_file = fs.create_log_file(".", "bench.log")
+    old_log_file = StrLogFile()
+    line = "2024-01-01 00:00:00 INFO request served in 12ms\n"
+
+    def append(target):
+        for _ in range(appends):
+            target.append(line)
+
+    return {
+        "str": timed(append, old_log_file),
+        "chunked": timed(append, log_file),
+        "tail": timed(log_file.tail, 100),
+    }
+
+
+def bench_journal(ops: int) -> dict[str, float]:
+    '''Journaled log appends per second for every fsync policy'''
+    result = {}
+
+    for fsync in ["never", "batch", "always"]:
+        data_dir = tempfile.mkdtemp()
+        fs = FileSystem.open(data_dir, fsync=fsync, snapshot_every=None)
+        log_file = fs.create_log_file(".", "bench.log")
+        count = ops if fsync != "always" else max(1, ops // 20)
+
+        def append():
+            for _ in range(count):
+                log_file.append("request served\n")
+            fs.close()
+
+        result[fsync] = count / timed(append)
+        shutil.rmtree(data_dir)
+
+    return result
+
+
+def bench_recovery(nodes: int, tail: int = 10_000) -> dict[str, float]:
+    '''Snapshot size and time to reopen a `nodes` tree from snapshot plus a `tail` operations journal'''
+    data_dir = tempfile.mkdtemp()
+    fs = FileSystem.open(data_dir, fsync="never", snapshot_every=None, dir_max_elems=None)
+    build_tree(fs, nodes, 100)
+
+    checkpoint_time = timed(fs.checkpoint)
+    log_file = fs.create_log_file(".", "tail.log")
+    for _ in range(tail):
+        log_file.append("x")
+    fs.close()
+
+    snapshot_size = sum(os.path.getsize(os.path.join(data_dir, f)) for f in os.listdir(data_dir) if f.startswith("snapshot."))
+
+    start = time.perf_counter()
+    recovered = FileSystem.open(data_dir, snapshot_every=None, dir_max_elems=None)
+    recovery_time = time.perf_counter() - start
+    recovered.close()
+
+    shutil.rmtree(data_dir)
+
+    return {
+        "checkpoint_s": checkpoint_time,
+        "snapshot_mb": snapshot_size / 1e6,
+        "recovery_s": recovery_time,
+    }
+
+
+def bench_find(nodes: int, queries: int = 1_000) -> dict[str, float]:
+    '''Per-query cost (us) of a prefix glob answered by the index and by walking the whole tree'''
+    fs = FileSystem(dir_max_elems=None)
+    build_tree(fs, nodes, 100)
+
+    def indexed():
+        for _ in range(queries):
+            fs.find("f99*", types=(BinaryFile,))
+
+    def walked():
+        [n for _, n in fs.walk(types=(BinaryFile,)) if n.name.startswith("f99")]
+
+    return {
+        "matches": len(fs.find("f99*", types=(BinaryFile,))),
+        "index_us": timed(indexed) / queries * 1e6,
+        "walk_us": timed(walked) * 1e6,
+    }
+
+
+def bench_json(size: int, pages: int = 1_000) -> dict[str, float]:
+    '''Cost (us) of serializing the first page of a `size` childs directory, cold and cached'''
+    fs = FileSystem(dir_max_elems=None)
+    wide = fs.root.create_directory("wide")
+
+    for i in range(size):
+        wide.create_binary_file(f"f{i}", "")
+
+    def cached():
+        cursor = None
+
+        for _ in range(pages):
+            cursor = wide.to_json(limit=10, cursor=cursor).get("next_cursor")
+
+    return {
+        "cold_us": timed(wide.to_json) * 1e6,
+        "cached_us": timed(cached) / pages * 1e6,
+        "childs": len(wide.to_json()["childs"]),
+    }
+
+
+def bench_clone(nodes: int) -> dict[str, float]:
+    '''Cost (us) of clone, copy and snapshot of a `nodes` subtree, and of the first write after a clone'''
+    fs = FileSystem(dir_max_elems=None)
+    source = fs.root.create_directory("source")
+    fs.root.create_directory("dest")
+    fs.root.create_directory("copies")
+
+    level = [source]
+    created = 0
+    while created < nodes:
+        directory = level.pop(0)
+        for i in range(100):
+            level.append(directory.create_directory(f"d{i}"))
+            created += 1
+
+    clone_time = timed(source.clone, "~/dest")
+    write_time = timed(source.create_directory, "new")
+    snapshot_time = timed(fs.snapshot)
+    copy_time = timed(fs.root.copy, "source", "~/copies")
+
+    return {
+        "clone_us": clone_time * 1e6,
+        "first_write_us": write_time * 1e6,
+        "snapshot_us": snapshot_time * 1e6,
+        "copy_us": copy_time * 1e6,
+    }
+
+
+def bench_metrics(ops: int) -> dict[str, dict[str, float]]:
+    '''Per-call cost (ns) of get_node and LogFile.append without metrics, with metrics and with every call sampled'''
+    result = {}
+    fs = FileSystem(dir_max_elems=None)
+    directory = fs.root
+    for i in range(5):
+        directory = directory.create_directory(f"dir_{i}")
+    path = "./" + "/".join(f"dir_{i}" for i in range(5))
+
+    def lookup():
+        for _ in range(ops):
+            fs.get_node(path)
+
+    def append(log_file):
+        for _ in range(ops):
+            log_file.append("request served\n")
+
+    for label, sample_rate in [("disabled", None), ("enabled", 0.0), ("sampled", 1.0)]:
+        if sample_rate is None:
+            fs.disable_metrics()
+        else:
+            fs.enable_metrics(sample_rate)
+
+        result[label] = {
+            "get_node": timed(lookup) / ops * 1e9,
+            "append": timed(append, directory.create_log_file(f"{label}.log")) / ops * 1e9,
+        }
+
+    return result
+
+
+def shard_client(addresses: list[str], authkey: bytes, client: int, ops: int) -> None:
+    # Mixed workload on the client's own top-level directories
+    router = ShardedFileSystem(addresses, authkey)
+    names = [f"c{client}_{i}" for i in range(8)]
+
+    for name in names:
+        router.create_directory("~", name)
+        router.create_log_file(f"~/{name}", "app.log")
+        router.create_buffer(f"~/{name}", "queue", 100, "fifo")
+
+    for i in range(ops):
+        name = names[i // 6 % len(names)]
+        op = i % 6
+
+        if op == 0:
+            router.append(f"~/{name}/app.log", "request served\n")
+        elif op == 1:
+            router.get_node(f"~/{name}")
+        elif op == 2:
+            router.push(f"~/{name}/queue", i)
+        elif op == 3:
+            router.pop(f"~/{name}/queue")
+        elif op == 4:
+            router.create_directory(f"~/{name}", f"d{i}")
+        else:
+            router.move(f"~/{name}/d{i - 1}", f"~/{names[(i // 6 + 1) % len(names)]}")
+
+    router.close()
+
+
+def bench_shard(ops: int, clients: int = 8) -> dict[int, float]:
+    '''Operations per second of `clients` client processes on 1, 2, 4 and 8 shard workers'''
+    result = {}
+    context = multiprocessing.get_context("spawn")
+
+    for workers in [1, 2, 4, 8]:
+        with ShardedFileSystem.start(workers, dir_max_elems=None) as router:
+            processes = [context.Process(target=shard_client, args=(router.addresses, router.authkey, c, ops))
+                         for c in range(clients)]
+
+            def run():
+                for process in processes:
+                    process.start()
+                for process in processes:
+                    process.join()
+
+            result[workers] = clients * ops / timed(run)
+
+    return result
+
+
+def resident_memory() -> int:
+    # Current RSS in bytes, freed heap pages are handed back first
+    gc.collect()
+
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+    with open("/proc/self/statm") as file:
+        return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def log_line(rng: random.Random, i: int) -> str:
+    return (f"2024-03-{1 + i // 86_400 % 28:02d} {i // 3600 % 24:02d}:{i // 60 % 60:02d}:{i % 60:02d} "
+            f"{rng.choice(['INFO', 'INFO', 'INFO', 'WARN', 'ERROR'])} 10.0.{rng.randrange(256)}.{rng.randrange(256)} "
+            f"{rng.choice(['GET', 'GET', 'POST', 'PUT'])} /api/v1/{rng.choice(['users', 'orders', 'items'])}/{rng.randrange(100_000)} "
+            f"{rng.choice([200, 200, 200, 201, 404, 500])} {rng.randrange(1, 900)}ms req={rng.getrandbits(64):016x}\n")
+
+
+def bench_tier(files: int, codec: str, file_size: int = 1_000_000, reads: int = 2_000) -> dict[str, dict[str, float]]:
+    '''Resident memory (MB) and latency (us) of 4 KB log reads and tails on a
+    log-heavy tree, before compress_cold and after it with every read missing
+    the decompressed cache or hitting it'''
+    rng = random.Random(1)
+    start = resident_memory()
+    fs = FileSystem(dir_max_elems=None)
+    logs = []
+
+    for i in range(files):
+        directory = fs.root.create_directory(f"service{i}")
+        log_file = directory.create_log_file("app.log")
+        line = 0
+
+        while log_file.size < file_size:
+            log_file.append(log_line(rng, line))
+            line += 1
+
+        directory.create_binary_file("config.json", str({f"key{k}": f"value {k}" for k in range(200)}))
+        logs.append(log_file)
+
+    offsets = [(rng.choice(logs), rng.randrange(file_size - 4096)) for _ in range(reads)]
+
+    def read_ranges():
+        for log_file, offset in offsets:
+            log_file.read(offset, 4096)
+
+    def state() -> dict[str, float]:
+        return {
+            "rss_mb": (resident_memory() - start) / 1e6,
+            "read_us": timed(read_ranges) / reads * 1e6,
+            "tail_us": timed(lambda: [log_file.tail(100) for log_file in logs]) / files * 1e6,
+        }
+
+    result = {"uncompressed": state()}
+    compress_time = timed(fs.compress_cold, 0, codec)
+
+    fs.content_store.cache_size = 0
+    result["cache miss"] = state()
+    result["cache miss"]["compress_s"] = compress_time
+
+    fs.content_store.cache_size = files * file_size * 2
+    read_ranges()
+    result["cache hit"] = state()
+
+    return result
+
+
+def spill_run(dirs: int, memory_budget: int | None, files: int, payload: str, reads: int) -> dict[str, float]:
+    rng = random.Random(2)
+    spill_dir = tempfile.mkdtemp()
+    start = resident_memory()
+    fs = FileSystem(dir_max_elems=None, memory_budget=memory_budget, spill_dir=spill_dir)
+    build_start = time.perf_counter()
+
+    for i in range(dirs):
+        directory = fs.root.create_directory(f"d{i}")
+
+        for j in range(files):
+            # Distinct content, so nothing is deduplicated
+            directory.create_binary_file(f"f{j}", f"{i} {j} {payload}")
+
+        directory.create_log_file("app.log", payload * files)
+
+        # What the background pass does every SPILL_INTERVAL, run inline
+        # so the result doesn't depend on timing
+        if memory_budget is not None and fs.memory_usage() > memory_budget:
+            fs.evict()
+
+    result = {"build_s": time.perf_counter() - build_start, "rss_mb": (resident_memory() - start) / 1e6}
+    paths = [f"./d{rng.randrange(dirs)}/f{rng.randrange(files)}" for _ in range(reads)]
+    result["read_us"] = timed(lambda: [fs.get_node(path).read() for path in paths]) / reads * 1e6
+
+    if memory_budget is not None:
+        fs.evict()
+        spilled = [path for path in paths if fs.root.get_child(path.split("/")[1]).lazy]
+        result["fault_in_us"] = timed(lambda: [fs.get_node(path).read() for path in spilled]) / len(spilled) * 1e6
+        fs.evict()
+        result["rss_after_reads_mb"] = (resident_memory() - start) / 1e6
+        result["spill_file_mb"] = fs.content_store.stats()["spilled_size"] / 1e6
+
+    fs.close()
+    shutil.rmtree(spill_dir)
+
+    return result
+
+
+def bench_spill(dirs: int, budget: int, files: int = 50, file_size: int = 4096,
+                reads: int = 2_000) -> dict[str, dict[str, float]]:
+    '''Resident memory (MB) of a tree of `dirs` directories of `files` BinaryFiles
+    and a LogFile, without a budget and with one, and read latency (us) of
+    random files and of files whose directory was spilled'''
+    rng = random.Random(1)
+    payload = "".join(log_line(rng, i) for i in range(file_size // 100))[:file_size]
+
+    return {
+        "no budget": spill_run(dirs, None, files, payload, reads),
+        "budget": spill_run(dirs, budget, files, payload, reads),
+    }
+
+
+def bench_bulk(files: int, fanout: int = 1_000, file_size: int = 100) -> dict[str, float]:
+    '''Seconds to load a host tree of `files` files in directories of `fanout`
+    one create call per node and with import_path, to export it with export_tar
+    and to read the archive back with import_tar. Peak traced memory (MB) of
+    the export against the archive size'''
+    host_dir = tempfile.mkdtemp()
+    payload = b"x" * file_size
+
+    for i in range(0, files, fanout):
+        os.mkdir(os.path.join(host_dir, f"d{i // fanout}"))
+
+        for j in range(i, min(files, i + fanout)):
+            with open(os.path.join(host_dir, f"d{i // fanout}", f"f{j}"), "wb") as file:
+                file.write(payload)
+
+    def per_node():
+        fs = FileSystem(dir_max_elems=None)
+        top = fs.root.create_directory("tree")
+
+        for name in sorted(os.listdir(host_dir)):
+            directory = top.create_directory(name)
+
+            for entry in sorted(os.scandir(os.path.join(host_dir, name)), key=lambda entry: entry.name):
+                with open(entry.path, "rb") as file:
+                    directory.create_binary_file(entry.name, file.read())
+
+    result = {"per_node_s": timed(per_node)}
+    fs = FileSystem(dir_max_elems=None)
+    result["import_path_s"] = timed(fs.import_path, host_dir, ".", "tree")
+    archive = os.path.join(host_dir, "tree.tar")
+
+    def export():
+        with open(archive, "wb") as file:
+            for chunk in fs.export_tar("./tree"):
+                file.write(chunk)
+
+    result["export_tar_s"] = timed(export)
+    result["archive_mb"] = os.path.getsize(archive) / 1e6
+
+    tracemalloc.start()
+    export()
+    result["export_peak_mb"] = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+
+    result["import_tar_s"] = timed(FileSystem(dir_max_elems=None).import_tar, archive)
+    shutil.rmtree(host_dir)
+
+    return result
+
+
+def main_bulk(files: int = 100_000) -> None:
+    result = bench_bulk(files)
+
+    print(f"{files} host files of 100 bytes in directories of 1000")
+    print(f"create call per node: {result['per_node_s']:.2f} s ({files / result['per_node_s']:,.0f} files/s)")
+    print(f"import_path:          {result['import_path_s']:.2f} s ({files / result['import_path_s']:,.0f} files/s)")
+    print(f"export_tar:           {result['export_tar_s']:.2f} s, {result['archive_mb']:.0f} MB archive, "
+          f"peak {result['export_peak_mb']:.1f} MB traced")
+    print(f"import_tar:           {result['import_tar_s']:.2f} s ({files / result['import_tar_s']:,.0f} files/s)")
+
+
+def main_spill(dirs: int = 500) -> None:
+    budget = 16_000_000
+    result = bench_spill(dirs, budget)
+    unbounded, bounded = result["no budget"], result["budget"]
+
+    print(f"{dirs} directories of 50 x 4 KB files and a 200 KB log, budget {budget / 1e6:.0f} MB")
+    print(f"no budget: RSS {unbounded['rss_mb']:.0f} MB, built in {unbounded['build_s']:.1f} s, "
+          f"random reads {unbounded['read_us']:.1f} us")
+    print(f"budget:    RSS {bounded['rss_mb']:.0f} MB, built in {bounded['build_s']:.1f} s, "
+          f"random reads {bounded['read_us']:.1f} us, spill file {bounded['spill_file_mb']:.0f} MB")
+    print(f"           first read below a spilled directory {bounded['fault_in_us']:.0f} us, "
+          f"RSS after reads and evict {bounded['rss_after_reads_mb']:.0f} MB")
+
+
+def main_tier(files: int = 50) -> None:
+    for codec in ["zlib", "lzma"]:
+        result = bench_tier(files, codec)
+
+        print(f"{codec}: {files} log files of 1 MB, compressed in {result['cache miss']['compress_s']:.1f} s")
+        print(f"{'':>14} {'RSS MB':>8} {'read us':>9} {'tail us':>9}")
+        for label, stats in result.items():
+            print(f"{label:>14} {stats['rss_mb']:>8.1f} {stats['read_us']:>9.1f} {stats['tail_us']:>9.1f}")
+
+
+def main_wide(max_size: int = 1_000_000) -> None:
+    size = 1_000
+
+    print(f"{'childs':>10} {'create ns':>10} {'lookup ns':>10} {'move ns':>10} {'delete ns':>10}")
+    while size <= max_size:
+        result = bench_wide_directory(size)
+        print(f"{size:>10} {result['create']:>10.0f} {result['lookup']:>10.0f} {result['move']:>10.0f} {result['delete']:>10.0f}")
+        size *= 10
+
+
+def main_memory(nodes: int = 1_000_000) -> None:
+    result = bench_tree_memory(nodes)
+
+    print(f"nodes: {result['nodes']}")
+    print(f"balanced tree: {result['balanced_bytes_per_node']:.0f} B/node")
+    print(f"deep chain: {result['deep_bytes_per_node']:.0f} B/node")
+    print(f"move of a {result['nodes'] // 100}-node subtree: {result['subtree_move_us']:.1f} us")
+
+
+def main_resolve(max_depth: int = 200) -> None:
+    depth = 1
+
+    print(f"{'depth':>10} {'uncached ns':>12} {'cached ns':>12}")
+    while depth <= max_depth:
+        result = bench_resolve(depth)
+        print(f"{depth:>10} {result['uncached']:>12.0f} {result['cached']:>12.0f}")
+        depth *= 4
+
+
+def main_log(appends: int = 100_000) -> None:
+    result = bench_log_append(appends)
+
+    print(f"{appends} appends, str: {result['str']:.3f} s")
+    print(f"{appends} appends, chunked: {result['chunked']:.3f} s")
+    print(f"last 100 lines: {result['tail'] * 1e6:.1f} us")
+
+
+def main_journal(ops: int = 100_000) -> None:
+    result = bench_journal(ops)
+
+    for fsync, rate in result.items():
+        print(f"fsync={fsync}: {rate:,.0f} ops/s")
+
+
+def main_recovery(nodes: int = 1_000_000) -> None:
+    result = bench_recovery(nodes)
+
+    print(f"snapshot of {nodes} nodes: {result['snapshot_mb']:.1f} MB in {result['checkpoint_s']:.2f} s")
+    print(f"recovery (snapshot + 10000 journal records): {result['recovery_s']:.2f} s")
+
+
+def main_find(nodes: int = 1_000_000) -> None:
+    result = bench_find(nodes)
+
+    print(f"find f99* in {nodes} nodes ({result['matches']} matches)")
+    print(f"index: {result['index_us']:.1f} us, walk: {result['walk_us']:.1f} us")
+
+
+def main_json(size: int = 1_000_000) -> None:
+    result = bench_json(size)
+
+    print(f"to_json of a {size} childs directory returns {result['childs']} childs")
+    print(f"cold: {result['cold_us']:.0f} us, cached page: {result['cached_us']:.1f} us")
+
+
+def main_clone(nodes: int = 100_000) -> None:
+    result = bench_clone(nodes)
+
+    print(f"subtree of {nodes} directories")
+    print(f"clone: {result['clone_us']:.1f} us, snapshot: {result['snapshot_us']:.1f} us, copy: {result['copy_us']:,.0f} us")
+    print(f"first write to the source after a clone: {result['first_write_us']:.1f} us")
+
+
+def main_metrics(ops: int = 200_000) -> None:
+    result = bench_metrics(ops)
+
+    print(f"{'metrics':>10} {'get_node ns':>12} {'append ns':>12}")
+    for label, costs in result.items():
+        print(f"{label:>10} {costs['get_node']:>12.0f} {costs['append']:>12.0f}")
+
+
+def main_shard(ops: int = 20_000) -> None:
+    result = bench_shard(ops)
+
+    print(f"8 clients, {ops} mixed operations each, {os.cpu_count()} CPUs")
+    for workers, rate in result.items():
+        print(f"{workers} workers: {rate:,.0f} ops/s")
+
+
+BENCHMARKS = {
+    "wide": main_wide,
+    "memory": main_memory,
+    "resolve": main_resolve,
+    "log": main_log,
+    "journal": main_journal,
+    "recovery": main_recovery,
+    "find": main_find,
+    "json": main_json,
+    "clone": main_clone,
+    "shard": main_shard,
+    "metrics": main_metrics,
+    "tier": main_tier,
+    "spill": main_spill,
+    "bulk": main_bulk,
+}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:2] or list(BENCHMARKS)
+    size = [int(sys.argv[2])] if len(sys.argv) > 2 else []
+
+    for name in names:
+        print(f"== {name} ==")
+        BENCHMARKS[name](*size)
@@ -1,142 +1,357 @@
+import argparse
+import os
+import re
+import sys
+import time
+from typing import Callable, Iterable
 from filesystem import *
 
-fs = FileSystem()
+# python fsinterfacepy.py [data_dir]                    interactive, the demo tree without data_dir
+# python fsinterfacepy.py [data_dir] -s jobs.txt        one command per line, no prompts
+# generate_jobs | python fsinterfacepy.py --bench       stdin that is not a terminal is a script too
+# Words are split like shlex.split does (POSIX quotes and backslashes) with
+# regexes, shlex itself costs more than most commands. As in shlex, and unlike
+# sh, a backslash in double quotes only escapes " and \, so "\$" stays as is
+WORD = re.compile(r"""(?:[^\s'"\\]+|'[^']*'|"(?:[^"\\]|\\.)*"|\\.)+""", re.S)
+QUOTED = re.compile(r"""'([^']*)'|"((?:[^"\\]|\\.)*)"|\\(.)""", re.S)
+QUOTING = re.compile(r"[\"'\\]")
+ESCAPED = re.compile(r'\\(["\\])')
 
-fs.create_directory(".", "Directory_1")
-fs.create_directory("./Directory_1", "Directory_11")
-fs.create_directory("./Directory_1/Directory_11", "Nested_Dir")
-fs.create_directory("./Directory_1", "Directory_12")
+# Command name -> (function, usage, description, min args, max args or None)
+COMMANDS: dict[str, tuple[Callable[[FileSystem, list[str]], None], str, str, int, int | None]] = {}
 
-fs.create_directory(".", "Directory_2")
-fs.create_binary_file("./Directory_2", "Binary1", "Here you can save information")
-fs.create_binary_file("./Directory_2", "Binary2", "Random string of text")
 
-fs.create_directory(".", "Directory_3")
-fs.create_buffer("./Directory_3", "Buffer1")
-fs.create_log_file("./Directory_3", "Log1", "")
-fs.get_node("./Directory_3/Log1").append("1 - Hello")
-fs.get_node("./Directory_3/Log1").append("\n2 - World")
+def command(usage: str, description: str, min_args: int = 0, max_args: int | None = 0):
+    def register(function: Callable[[FileSystem, list[str]], None]):
+        COMMANDS[usage.split(" ")[0]] = (function, usage, description, min_args, max_args)
+        return function
 
-print("Enter [help] to display list of commands")
-while True:
-    command = input(f"{DELIMITER.join([d.name for d in fs.cwd.path] + [fs.cwd.name])} > ").split(" ")
+    return register
 
-    try:
-        if command[0] == "help":
-            print("""Command list:
-    help - display this message
-    cd [path] - change current working directory
-    ls - list current directory files
-    tree - print tree of current working directory
 
-    move [source] [destination] - move file or folder from source to destination
-    del [path] - delete file or folder
-    read [path] - read binary file or logfile
+def unquote(match: re.Match) -> str:
+    if match.group(1) is not None:
+        return match.group(1)
+
+    if match.group(2) is not None:
+        return ESCAPED.sub(r"\1", match.group(2))
+
+    return match.group(3)
+
+
+def parse(line: str) -> list[str]:
+    if not QUOTING.search(line):
+        return line.split()
+
+    words = []
+    end = 0
+
+    for match in WORD.finditer(line):
+        start = match.start()
+
+        # Anything skipped between words is an unmatched quote or a trailing backslash
+        if start != end and not line[end:start].isspace():
+            raise ValueError("No closing quotation")
+
+        word = match.group()
+        words.append(QUOTED.sub(unquote, word) if QUOTING.search(word) else word)
+        end = match.end()
+
+    if end != len(line) and not line[end:].isspace():
+        raise ValueError("No closing quotation")
+
+    return words
+
+
+def run_command(fs: FileSystem, args: list[str]) -> None:
+    entry = COMMANDS.get(args[0])
+
+    if entry is None:
+        raise ValueError("Wrong command. Type [help] to get list of commands")
+
+    function, usage, _, min_args, max_args = entry
+
+    if len(args) - 1 < min_args or (max_args is not None and len(args) - 1 > max_args):
+        raise ValueError(f"Wrong command pattern: {usage}")
+
+    function(fs, args[1:])
+
+
+def run_script(fs: FileSystem, lines: Iterable[str], keep_going: bool = False) -> tuple[int, int]:
+    # (commands run, failed commands). Blank lines and # comments are skipped,
+    # the first failure stops the script unless keep_going
+    commands = failures = 0
+
+    for number, line in enumerate(lines, start=1):
+        # Before parsing, a comment may hold an unmatched quote
+        if line.lstrip().startswith("#"):
+            continue
+
+        try:
+            args = parse(line)
+
+            if not args:
+                continue
+
+            commands += 1
+            run_command(fs, args)
+        except (ValueError, OSError) as e:
+            failures += 1
+            print(f"line {number}: ERROR: {e}", file=sys.stderr)
+
+            if not keep_going:
+                break
+
+    return commands, failures
+
+
+@command("help", "display this message")
+def help_command(fs: FileSystem, args: list[str]) -> None:
+    print("Command list:")
+
+    for _, usage, description, _, _ in COMMANDS.values():
+        print(f"    {usage} - {description}")
+
+
+@command("cd [path]", "change current working directory", 1, 1)
+def cd_command(fs: FileSystem, args: list[str]) -> None:
+    fs.change_working_directory(args[0])
+
+
+@command("ls", "list current directory files")
+def ls_command(fs: FileSystem, args: list[str]) -> None:
+    fs.print_cwd()
+
+
+@command("tree [path] [depth]", "print tree of current working directory or path, optionally limited in depth", 0, 2)
+def tree_command(fs: FileSystem, args: list[str]) -> None:
+    path = args[0] if args else "."
+    max_depth = int(args[1]) if len(args) > 1 else None
+
+    for line in fs.iter_tree(path, max_depth=max_depth):
+        print(line)
+
+
+@command("find [pattern] [type]", "find nodes below current working directory by name glob (err*) and type "
+         "(directory, binary, logfile, buffer)", 0, 2)
+def find_command(fs: FileSystem, args: list[str]) -> None:
+    pattern = args[0] if args else "*"
+    types = None
+
+    if len(args) > 1:
+        if args[1] not in NODE_TYPES:
+            raise ValueError(f"Type must be one of {', '.join(NODE_TYPES)}")
+
+        types = (NODE_TYPES[args[1]],)
+
+    for node in fs.find(pattern, types=types):
+        print(node.full_path())
 
-    makedir [name] - make a directory
-    makebin [name] [information] - make a binary file
 
-    makelog [name] [information] - make a log file
-    addlog [path_to_logfile] [information] - add information to a log file
+@command("du [path]", "number of nodes and bytes of a subtree", 0, 1)
+def du_command(fs: FileSystem, args: list[str]) -> None:
+    usage = fs.du(args[0] if args else ".")
+    print(f"{usage['nodes']} nodes, {usage['size']} bytes  {usage['path']}")
 
-    makebuf [name] - make a buffer file
-    pushbuf [path_to_buffile] [information] - push information to a buffer file
-    popbuf [path_to_buffile] - pop information from a buffer file
-    """)
 
-        if command[0] == "cd":
-            fs.change_working_directory(command[1])
+@command("quota [path] [max_nodes] [max_size]", "limit nodes and bytes below a directory, - for no limit", 3, 3)
+def quota_command(fs: FileSystem, args: list[str]) -> None:
+    directory = fs.get_node(args[0])
 
-        elif command[0] == "ls":
-            fs.print_cwd()
+    if not isinstance(directory, Directory):
+        raise ValueError("Destination is not a directory")
 
-        elif command[0] == "tree":
-            fs.print_elements()
+    limits = [None if limit == "-" else int(limit) for limit in args[1:]]
+    directory.set_quota(*limits)
 
-        elif command[0] == "del":
-            if len(command) != 2:
-                raise ValueError("Wrong command pattern: del [path]")
-            
-            file = fs.get_node(command[1])
-            file.delete()
 
-        elif command[0] == "move":
-            if len(command) != 3:
-                raise ValueError("Wrong command pattern: move [source] [destination]")
-            
-            source = fs.get_node(command[1])
-            source.path[-1].move(source.name, command[2])
-            
-        elif command[0] == "read":
-            if len(command) != 2:
-                raise ValueError("Wrong command pattern: read [path]")
+@command("import [host_path] [name]", "copy a host directory or tar archive into the current working directory", 1, 2)
+def import_command(fs: FileSystem, args: list[str]) -> None:
+    def progress(files, size):
+        print(f"\r{files} files, {size} bytes", end="", flush=True)
 
-            file = fs.get_node(command[1])
+    name = args[1] if len(args) > 1 else None
 
-            if not isinstance(file, (LogFile, BufferFile, BinaryFile)):
-                raise ValueError("Can't read that file")
-            
-            print(file.read())
+    if os.path.isdir(args[0]):
+        node = fs.import_path(args[0], ".", name, progress=progress)
+    else:
+        node = fs.import_tar(args[0], ".", name, progress=progress)
 
-        elif command[0] == "makedir":
-            if len(command) != 2:
-                raise ValueError("Wrong command pattern: makedir [name]")
+    print(f"\nimported {node.full_path()}")
 
-            fs.cwd.create_directory(command[1])
 
-        elif command[0] == "makebin":
-            if len(command) < 3:
-                raise ValueError("Wrong command pattern: makebin [name] [information]")
+@command("export [path] [host_file]", "write a subtree as a tar archive, compressed for .gz and .xz", 2, 2)
+def export_command(fs: FileSystem, args: list[str]) -> None:
+    compression = next((c for c in TAR_COMPRESSIONS if args[1].endswith("." + c)), None)
+    chunks = fs.export_tar(args[0], compression)
+    written = 0
 
-            fs.cwd.create_binary_file(command[1], ' '.join(command[2:]))
+    with open(args[1], "wb") as file:
+        for chunk in chunks:
+            file.write(chunk)
+            written += len(chunk)
+            print(f"\r{written} bytes", end="", flush=True)
 
-        elif command[0] == "makelog":
-            if len(command) < 2:
-                raise ValueError("Wrong command pattern: makelog [name] [information]")
+    print()
 
-            fs.cwd.create_log_file(command[1], ' '.join(command[2:]))
 
-        elif command[0] == "addlog":
-            if len(command) < 3:
-                raise ValueError("Wrong command pattern: addlog [path_to_logfile] [information]")
+@command("move [source] [destination]", "move file or folder from source to destination", 2, 2)
+def move_command(fs: FileSystem, args: list[str]) -> None:
+    source = fs.get_node(args[0])
 
-            logfile = fs.get_node(command[1])
+    if source.parent is None:
+        raise ValueError("Can't move root directory")
 
-            if not isinstance(logfile, LogFile):
-                raise ValueError("Can't find LogFile")
-            
-            logfile.append(' '.join(command[2:]))
+    source.parent.move(source.name, args[1])
 
-        elif command[0] == "makebuf":
-            if len(command) != 2:
-                raise ValueError("Wrong command pattern: makebuf [name]")
 
-            fs.cwd.create_buffer(command[1])
+@command("del [path]", "delete file or folder", 1, 1)
+def del_command(fs: FileSystem, args: list[str]) -> None:
+    fs.get_node(args[0]).delete()
 
-        elif command[0] == "pushbuf":
-            if len(command) < 3:
-                raise ValueError("Wrong command pattern: pushbuf [path_to_buffile] [information]")
 
-            buffer_file = fs.get_node(command[1])
+@command("read [path]", "read binary file, logfile or the items of a buffer file", 1, 1)
+def read_command(fs: FileSystem, args: list[str]) -> None:
+    file = fs.get_node(args[0])
 
-            if not isinstance(buffer_file, BufferFile):
-                raise ValueError("Can't find BufferFile")
+    # Listed oldest first, without popping
+    if isinstance(file, BufferFile):
+        print(file.items)
+        return
+
+    if not isinstance(file, (LogFile, BinaryFile)):
+        raise ValueError("Can't read that file")
+
+    print(file.read())
+
+
+@command("makedir [name]", "make a directory", 1, 1)
+def makedir_command(fs: FileSystem, args: list[str]) -> None:
+    fs.cwd.create_directory(args[0])
+
+
+@command("makebin [name] [information]", "make a binary file", 2, None)
+def makebin_command(fs: FileSystem, args: list[str]) -> None:
+    fs.cwd.create_binary_file(args[0], ' '.join(args[1:]))
+
+
+@command("makelog [name] [information]", "make a log file", 1, None)
+def makelog_command(fs: FileSystem, args: list[str]) -> None:
+    fs.cwd.create_log_file(args[0], ' '.join(args[1:]))
+
+
+@command("addlog [path_to_logfile] [information]", "add information to a log file", 2, None)
+def addlog_command(fs: FileSystem, args: list[str]) -> None:
+    logfile = fs.get_node(args[0])
+
+    if not isinstance(logfile, LogFile):
+        raise ValueError("Can't find LogFile")
+
+    logfile.append(' '.join(args[1:]))
+
+
+@command("makebuf [name]", "make a buffer file", 1, 1)
+def makebuf_command(fs: FileSystem, args: list[str]) -> None:
+    fs.cwd.create_buffer(args[0])
+
+
+@command("pushbuf [path_to_buffile] [information]", "push information to a buffer file", 2, None)
+def pushbuf_command(fs: FileSystem, args: list[str]) -> None:
+    buffer_file = fs.get_node(args[0])
+
+    if not isinstance(buffer_file, BufferFile):
+        raise ValueError("Can't find BufferFile")
+
+    buffer_file.push(' '.join(args[1:]))
+
+
+@command("popbuf [path_to_buffile]", "pop information from a buffer file", 1, 1)
+def popbuf_command(fs: FileSystem, args: list[str]) -> None:
+    buffer_file = fs.get_node(args[0])
+
+    if not isinstance(buffer_file, BufferFile):
+        raise ValueError("Can't find BufferFile")
+
+    print(buffer_file.pop())
+
+
+def build_demo_tree(fs: FileSystem) -> None:
+    fs.create_directory(".", "Directory_1")
+    fs.create_directory("./Directory_1", "Directory_11")
+    fs.create_directory("./Directory_1/Directory_11", "Nested_Dir")
+    fs.create_directory("./Directory_1", "Directory_12")
+
+    fs.create_directory(".", "Directory_2")
+    fs.create_binary_file("./Directory_2", "Binary1", "Here you can save information")
+    fs.create_binary_file("./Directory_2", "Binary2", "Random string of text")
+
+    fs.create_directory(".", "Directory_3")
+    fs.create_buffer("./Directory_3", "Buffer1")
+    fs.create_log_file("./Directory_3", "Log1", "")
+    fs.get_node("./Directory_3/Log1").append("1 - Hello")
+    fs.get_node("./Directory_3/Log1").append("\n2 - World")
+
+
+def interactive(fs: FileSystem) -> None:
+    print("Enter [help] to display list of commands")
+
+    while True:
+        try:
+            line = input(f"{DELIMITER.join([d.name for d in fs.cwd.path] + [fs.cwd.name])} > ")
+        except EOFError:
+            print()
+            return
+
+        try:
+            args = parse(line)
+
+            if args:
+                run_command(fs, args)
+        except (ValueError, OSError) as e:
+            print("ERROR: " + str(e))
+
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(prog="fsinterfacepy", description="Shell over a FileSystem, interactive or running a script")
+    parser.add_argument("data_dir", nargs="?", help="keep the tree in this directory between runs")
+    parser.add_argument("-s", "--script", help="run the commands of this file, - for stdin")
+    parser.add_argument("--keep-going", action="store_true", help="continue a script after a failed command")
+    parser.add_argument("--bench", action="store_true", help="report the commands per second of a script")
+    parser.add_argument("--dir-max-elems", type=int, help="nodes per directory, 0 for no limit "
+                        f"(default {DIR_MAX_ELEMS}, or the limit data_dir was written with)")
+    args = parser.parse_args(argv)
+
+    script = args.script
+
+    if script is None and not sys.stdin.isatty():
+        script = "-"
+
+    if script is None and args.bench:
+        parser.error("--bench needs a script")
+
+    limits = {} if args.dir_max_elems is None else {"dir_max_elems": args.dir_max_elems or None}
+    fs = FileSystem.open(args.data_dir, **limits) if args.data_dir else FileSystem(**limits)
+
+    try:
+        if script is None:
+            if not args.data_dir:
+                build_demo_tree(fs)
 
-            buffer_file.push(' '.join(command[2:]))
+            interactive(fs)
+            return 0
 
-        elif command[0] == "popbuf":
-            if len(command) != 2:
-                raise ValueError("Wrong command pattern: popbuf [path_to_buffile]")
+        with (open(script) if script != "-" else open(sys.stdin.fileno(), closefd=False)) as lines:
+            start = time.perf_counter()
+            commands, failures = run_script(fs, lines, args.keep_going)
+            elapsed = time.perf_counter() - start
 
-            buffer_file = fs.get_node(command[1])
-            
-            if not isinstance(buffer_file, BufferFile):
-                raise ValueError("Can't find BufferFile")
+        if args.bench:
+            print(f"{commands} commands in {elapsed:.3f} s, {commands / max(elapsed, 1e-9):,.0f} commands/s", file=sys.stderr)
 
-            print(buffer_file.pop())
+        return 1 if failures else 0
+    finally:
+        fs.close()
 
-        else:
-            print("Wrong command. Type [help] to get list of commands")
 
-    except ValueError as e:
-        print("ERROR: " + str(e))
\ No newline at end of file
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,250 +1,4160 @@
 from __future__ import annotations
-from typing import Any
+import asyncio
+import hashlib
+import heapq
+import json
+import lzma
+import mmap
+import multiprocessing
+import os
+import pickle
+import random
+import struct
+import tarfile
+import threading
+import time
+import warnings
+import weakref
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from fnmatch import fnmatchcase
+from functools import lru_cache, wraps
+from itertools import count
+from multiprocessing.connection import Client, Connection, Listener
+from typing import Any, Callable, Iterable, Iterator, Sequence
 
 
 DIR_MAX_ELEMS = 10
 MAX_BUF_FILE_SIZE = 15
+PATH_CACHE_SIZE = 4096
+JSON_CACHE_SIZE = 4096
+JSON_PAGE_SIZE = 1000
+LOG_CHUNK_SIZE = 64 * 1024
+BUFFER_MODES = ("lifo", "fifo")
+JOURNAL_FSYNC_POLICIES = ("always", "batch", "never")
+JOURNAL_FSYNC_BATCH = 256
+JOURNAL_FSYNC_INTERVAL = 0.05
+SNAPSHOT_EVERY = 100_000
+SNAPSHOT_BATCH = 10_000
+BLOB_INLINE_LIMIT = 4096
+BLOB_SEGMENT_SIZE = 64 * 1024 * 1024
+INDEX_CHUNK_SIZE = 512
+GLOB_CHARS = "*?["
+# Upper bounds of the Metrics histograms, in seconds, path tokens and queued items
+METRICS_LATENCY_BUCKETS = (1e-6, 5e-6, 1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+METRICS_DEPTH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+METRICS_QUEUE_BUCKETS = (0, 1, 10, 100, 1_000, 10_000)
+METRICS_SLOWEST = 20
+# Events a Watcher queues before signaling an overflow
+WATCH_QUEUE_SIZE = 1024
+# Cold content compression, see FileSystem.compress_cold
+TIER_CODECS = ("zlib", "lzma")
+TIER_COLD_AFTER = 300.0
+TIER_INTERVAL = 60.0
+TIER_MIN_SIZE = 1024
+TIER_CACHE_SIZE = 16 * 1024 * 1024
+# Memory budget, see FileSystem.evict. A resident node is estimated at
+# SPILL_NODE_SIZE bytes on top of its content
+SPILL_NODE_SIZE = 1024
+SPILL_INTERVAL = 1.0
+# Bulk import from the host, see FileSystem.import_path. Files are read by
+# IMPORT_WORKERS threads, IMPORT_BATCH per task and per progress call
+IMPORT_WORKERS = 8
+IMPORT_BATCH = 256
+IMPORT_READ_SIZE = 64 * 1024
+TAR_COMPRESSIONS = ("gz", "xz")
+TAR_CHUNK_SIZE = 64 * 1024
+# Plain ustar header, see tar_header
+TAR_HEADER = struct.Struct("100s8s8s8s12s12s8sc100s6s2s32s32s8s8s155s12s")
 DELIMITER = '/'
 
 
-class FileSystem():
+@lru_cache(maxsize=PATH_CACHE_SIZE)
+def compile_path(path: str) -> tuple[str, ...]:
+    # Tokenize once: drop empty and "." parts, "~" restarts from the root
+    tokens = []
+
+    for token in path.split(DELIMITER):
+        if token == "~":
+            tokens = ["~"]
+        elif token and token != ".":
+            tokens.append(token)
+
+    return tuple(tokens)
+
+
+class LockSide():
+    # Context manager of one side of an RWLock, cheaper than a generator one
+    # on the paths every mutation takes
+    __slots__ = ("acquire", "release")
+
+    def __init__(self, acquire: Callable[[], None], release: Callable[[], None]):
+        self.acquire = acquire
+        self.release = release
+
+    def __enter__(self) -> None:
+        self.acquire()
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
+
+
+class RWLock():
+    # Many readers or one writer, waiting writers block new readers
+    __slots__ = ("cond", "readers", "writer", "waiting_writers", "reading", "writing")
+
     def __init__(self):
-        self.root = Directory(self, path=[], name="~")
-        self.cwd = self.root
+        self.cond = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writer = False
+        self.waiting_writers = 0
+        self.reading = LockSide(self.acquire_read, self.release_read)
+        self.writing = LockSide(self.acquire_write, self.release_write)
+
+    def acquire_read(self) -> None:
+        with self.cond:
+            while self.writer or self.waiting_writers:
+                self.cond.wait()
+
+            self.readers += 1
+
+    def release_read(self) -> None:
+        with self.cond:
+            self.readers -= 1
+
+            if not self.readers:
+                self.cond.notify_all()
+
+    def acquire_write(self) -> None:
+        with self.cond:
+            self.waiting_writers += 1
+
+            while self.writer or self.readers:
+                self.cond.wait()
+
+            self.waiting_writers -= 1
+            self.writer = True
+
+    def release_write(self) -> None:
+        with self.cond:
+            self.writer = False
+            self.cond.notify_all()
+
+    def read(self) -> LockSide:
+        return self.reading
+
+    def write(self) -> LockSide:
+        return self.writing
+
+
+@contextmanager
+def write_locked(*directories: Directory):
+    # Always lock in the same (id) order so concurrent moves can't deadlock
+    ordered = sorted(set(directories), key=id)
+
+    for directory in ordered:
+        directory.lock.acquire_write()
+    try:
+        yield
+    finally:
+        for directory in reversed(ordered):
+            directory.lock.release_write()
+
+
+class Journal():
+    # Append-only log of framed records: length, crc32, pickled operation
+    HEADER = struct.Struct("<II")
+
+    def __init__(self, path: str, fsync: str = "batch", fsync_batch: int = JOURNAL_FSYNC_BATCH,
+                 fsync_interval: float = JOURNAL_FSYNC_INTERVAL):
+        if fsync not in JOURNAL_FSYNC_POLICIES:
+            raise ValueError(f"Journal fsync policy must be one of {', '.join(JOURNAL_FSYNC_POLICIES)}")
+
+        self.path = path
+        self.file = open(path, "ab")
+        self.fsync = fsync
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+        self.lock = threading.Lock()
+        # Encoded records not written yet, concurrent writers share one write/fsync
+        self.buffer: list[bytes] = []
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+        self.records = 0
+
+    def append(self, record: tuple) -> None:
+        payload = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        frame = self.HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+        with self.lock:
+            self.buffer.append(frame)
+            self.unsynced += 1
+            self.records += 1
+
+            if self.fsync == "always":
+                self.sync_locked()
+            elif self.fsync == "batch":
+                if self.unsynced >= self.fsync_batch or time.monotonic() - self.last_sync >= self.fsync_interval:
+                    self.sync_locked()
+            elif len(self.buffer) >= self.fsync_batch:
+                self.write_locked()
+
+    def write_locked(self) -> None:
+        self.file.write(b"".join(self.buffer))
+        self.buffer.clear()
+
+    def sync_locked(self) -> None:
+        self.write_locked()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def sync(self) -> None:
+        with self.lock:
+            if self.unsynced:
+                self.sync_locked()
+
+    def close(self) -> None:
+        with self.lock:
+            self.sync_locked()
+            self.file.close()
+
+    @classmethod
+    def read(cls, path: str) -> Iterator[tuple]:
+        with open(path, "rb") as file:
+            data = file.read()
+
+        offset = 0
+
+        while offset + cls.HEADER.size <= len(data):
+            length, crc = cls.HEADER.unpack_from(data, offset)
+            start = offset + cls.HEADER.size
+            payload = data[start:start + length]
+
+            # Torn write at the tail, everything before it is valid
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+
+            yield pickle.loads(payload)
+            offset = start + length
+
+
+class BlobStore():
+    # Append-only memory-mapped segment files holding large BinaryFile content.
+    # Content is rebuilt from snapshot/journal, so old segments are dropped on start
+    def __init__(self, directory: str, segment_size: int = BLOB_SEGMENT_SIZE):
+        os.makedirs(directory, exist_ok=True)
+
+        for name in os.listdir(directory):
+            if name.startswith("blobs."):
+                os.remove(os.path.join(directory, name))
+
+        self.directory = directory
+        self.segment_size = segment_size
+        self.segments: list[mmap.mmap] = []
+        self.position = 0
+        self.lock = threading.Lock()
+
+    def store(self, data: bytes) -> memoryview:
+        with self.lock:
+            if not self.segments or self.position + len(data) > len(self.segments[-1]):
+                self.add_segment(max(self.segment_size, len(data)))
+
+            segment = self.segments[-1]
+            start = self.position
+            segment[start:start + len(data)] = data
+            self.position += len(data)
+
+        return memoryview(segment)[start:start + len(data)].toreadonly()
+
+    def add_segment(self, size: int) -> None:
+        # Caller holds self.lock
+        path = os.path.join(self.directory, f"blobs.{len(self.segments):06d}")
+
+        with open(path, "w+b") as file:
+            file.truncate(size)
+            self.segments.append(mmap.mmap(file.fileno(), size))
+
+        self.position = 0
+
+
+class SpillStore():
+    # Append-only file holding evicted subtrees and content, see FileSystem.evict.
+    # Space is not reclaimed, the file is dropped on start like the blob segments
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+
+        for name in os.listdir(directory):
+            if name.startswith("spill."):
+                os.remove(os.path.join(directory, name))
+
+        self.file = open(os.path.join(directory, "spill.000000"), "w+b")
+        self.position = 0
+        self.lock = threading.Lock()
+
+    def write(self, data: bytes) -> int:
+        with self.lock:
+            offset = self.position
+            os.pwrite(self.file.fileno(), data, offset)
+            self.position += len(data)
+
+        return offset
+
+    def read(self, offset: int, length: int) -> bytes:
+        return os.pread(self.file.fileno(), length, offset)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class Spilled():
+    # Content written to the SpillStore. It isn't reference counted, and len()
+    # is the length of the original like for Compressed
+    __slots__ = ("offset", "stored", "length", "text", "codec")
+
+    def __init__(self, offset: int, stored: int, length: int, text: bool, codec: str | None):
+        self.offset = offset
+        self.stored = stored
+        self.length = length
+        self.text = text
+        self.codec = codec
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __reduce__(self):
+        return Spilled, (self.offset, self.stored, self.length, self.text, self.codec)
+
+
+def decompress(codec: str | None, data: bytes) -> bytes:
+    if codec == "zlib":
+        return zlib.decompress(data)
+
+    return lzma.decompress(data) if codec == "lzma" else data
+
+
+class Compressed():
+    # Cold content, see FileSystem.compress_cold. len() is the length of the
+    # original (characters when text) so counters and log offsets don't move
+    __slots__ = ("payload", "length", "codec", "text")
+
+    def __init__(self, content: bytes | str, codec: str):
+        self.text = isinstance(content, str)
+        self.length = len(content)
+        self.codec = codec
+        data = content.encode() if self.text else content
+        self.payload = zlib.compress(data) if codec == "zlib" else lzma.compress(data)
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __hash__(self) -> int:
+        return hash(self.payload)
+
+    def __eq__(self, other) -> bool:
+        return (isinstance(other, Compressed) and self.codec == other.codec and self.text == other.text
+                and self.payload == other.payload)
+
+    def decompress(self) -> bytes | str:
+        data = decompress(self.codec, self.payload)
+
+        return data.decode() if self.text else data
+
+
+class ContentStore():
+    # Reference counted BinaryFile contents and sealed LogFile chunks. Entries
+    # are keyed by the content itself, so lookups use the builtin hash and
+    # identical payloads share the first stored object
+    def __init__(self, blob_store: BlobStore | None = None, cache_size: int = TIER_CACHE_SIZE,
+                 spill_store: SpillStore | None = None):
+        self.blob_store = blob_store
+        self.spill_store = spill_store
+        # content -> [content, references], plus its Spilled copy once spill wrote one
+        self.refs: dict[bytes | memoryview | str | Compressed, list] = {}
+        self.lock = threading.Lock()
+        self.logical_size = 0
+        self.stored_size = 0
+        self.compressed_size = 0
+        # Stored content on the heap, blob segments and spilled content don't count
+        self.resident_size = 0
+        # Decompressed form of recently read Compressed entries, LRU bounded
+        # by cache_size bytes (characters for log chunks)
+        self.cache: OrderedDict[Compressed, bytes | str] = OrderedDict()
+        self.cache_size = cache_size
+        self.cached_size = 0
+
+    def acquire(self, content: bytes | memoryview | str | Compressed | Spilled) -> bytes | memoryview | str | Compressed | Spilled:
+        with self.lock:
+            self.logical_size += len(content)
+
+            if type(content) is Spilled:
+                return content
+
+            entry = self.refs.get(content)
+
+            if entry is not None:
+                entry[1] += 1
+                return entry[0]
+
+            if self.blob_store is not None and isinstance(content, bytes) and len(content) > BLOB_INLINE_LIMIT:
+                content = self.blob_store.store(content)
+
+            self.refs[content] = [content, 1]
+
+            if type(content) is Compressed:
+                self.stored_size += len(content.payload)
+                self.compressed_size += len(content.payload)
+                self.resident_size += len(content.payload)
+            else:
+                self.stored_size += len(content)
+                self.resident_size += 0 if type(content) is memoryview else len(content)
+
+            return content
+
+    def release(self, content: bytes | memoryview | str | Compressed | Spilled) -> None:
+        with self.lock:
+            self.logical_size -= len(content)
+
+            if type(content) is Spilled:
+                return
+
+            entry = self.refs[content]
+            entry[1] -= 1
+
+            if entry[1] == 0:
+                del self.refs[content]
+
+                if type(content) is Compressed:
+                    self.stored_size -= len(content.payload)
+                    self.compressed_size -= len(content.payload)
+                    self.resident_size -= len(content.payload)
+                    self.cached_size -= len(self.cache.pop(content, ""))
+                else:
+                    self.stored_size -= len(content)
+                    self.resident_size -= 0 if type(content) is memoryview else len(content)
+
+    def pack(self, content: bytes | memoryview | str | Compressed, codec: str) -> Compressed | None:
+        # Compressed form of content, None when it isn't worth it. Blob store
+        # content is already outside the heap and is left alone
+        if type(content) not in (bytes, str) or len(content) < TIER_MIN_SIZE:
+            return None
+
+        compressed = Compressed(content, codec)
+
+        return compressed if len(compressed.payload) < len(content) else None
+
+    def replace(self, content: bytes | memoryview | str | Compressed,
+                compressed: Compressed | Spilled) -> Compressed | Spilled:
+        # Moves one reference from content to its compressed or spilled form
+        compressed = self.acquire(compressed)
+        self.release(content)
+
+        return compressed
+
+    def spill(self, content: bytes | memoryview | str | Compressed) -> Spilled:
+        # Disk copy of content, written once however many nodes share it.
+        # Compressed content is written compressed
+        with self.lock:
+            entry = self.refs.get(content)
+
+            if entry is not None and len(entry) > 2:
+                return entry[2]
+
+        if type(content) is Compressed:
+            data, codec, text = content.payload, content.codec, content.text
+        else:
+            data, codec, text = content.encode() if type(content) is str else bytes(content), None, type(content) is str
+
+        spilled = Spilled(self.spill_store.write(data), len(data), len(content), text, codec)
+
+        with self.lock:
+            entry = self.refs.get(content)
+
+            if entry is not None and len(entry) == 2:
+                entry.append(spilled)
+
+        return spilled
+
+    def expand(self, content: Compressed | Spilled) -> bytes | str:
+        with self.lock:
+            data = self.cache.get(content)
+
+            if data is not None:
+                self.cache.move_to_end(content)
+                return data
+
+        if type(content) is Spilled:
+            data = decompress(content.codec, self.spill_store.read(content.offset, content.stored))
+            data = data.decode() if content.text else data
+        else:
+            data = content.decompress()
+
+        with self.lock:
+            # Entries released meanwhile are not cached, spilled ones never are released
+            if (len(data) <= self.cache_size and content not in self.cache
+                    and (type(content) is Spilled or content in self.refs)):
+                self.cache[content] = data
+                self.cached_size += len(data)
+
+                while self.cached_size > self.cache_size:
+                    self.cached_size -= len(self.cache.popitem(last=False)[1])
+
+        return data
+
+    def trim(self, size: int) -> None:
+        # Drops the least recently read payloads until the cache holds at most size
+        with self.lock:
+            while self.cache and self.cached_size > size:
+                self.cached_size -= len(self.cache.popitem(last=False)[1])
+
+    def stats(self) -> dict[str, int | float]:
+        # Sizes are bytes for BinaryFile content and characters for log chunks,
+        # compressed entries count their compressed bytes as stored
+        with self.lock:
+            return {
+                "entries": len(self.refs),
+                "logical_size": self.logical_size,
+                "stored_size": self.stored_size,
+                "saved_size": self.logical_size - self.stored_size,
+                "dedup_ratio": self.logical_size / self.stored_size if self.stored_size else 1.0,
+                "compressed_size": self.compressed_size,
+                "cached_size": self.cached_size,
+                "resident_size": self.resident_size,
+                "spilled_size": self.spill_store.position if self.spill_store is not None else 0,
+            }
+
+
+class Histogram():
+    # Prometheus style histogram, counts are per bucket and summed on render
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name: str, labels: str = "") -> list[str]:
+        lines = []
+        cumulative = 0
+
+        for bound, bucket in zip(self.bounds + ("+Inf",), self.counts):
+            cumulative += bucket
+            lines.append(f'{name}_bucket{{{labels}le="{bound}"}} {cumulative}')
+
+        labels = "{" + labels.rstrip(",") + "}" if labels else ""
+        lines.append(f"{name}_sum{labels} {self.sum}")
+        lines.append(f"{name}_count{labels} {self.count}")
+
+        return lines
+
+
+class Metrics():
+    # Per-operation counters and latency histograms, see FileSystem.enable_metrics.
+    # A sample_rate share of the calls also keeps its path, and the slowest
+    # of those sampled calls are kept in a min-heap
+    def __init__(self, sample_rate: float = 0.0, slowest: int = METRICS_SLOWEST):
+        self.lock = threading.Lock()
+        self.sample_rate = sample_rate
+        self.slowest_size = slowest
+        self.calls: dict[str, int] = {}
+        self.errors: dict[str, int] = {}
+        self.latency: dict[str, Histogram] = {}
+        self.path_depth = Histogram(METRICS_DEPTH_BUCKETS)
+        self.buffer_depth = Histogram(METRICS_QUEUE_BUCKETS)
+        self.log_appended = 0
+        self.slow_calls: list[tuple[float, int, str, str]] = []
+        self.samples = count()
+
+    def observe(self, operation: str, seconds: float, failed: bool, path: str | None) -> None:
+        with self.lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+
+            if failed:
+                self.errors[operation] = self.errors.get(operation, 0) + 1
+
+            histogram = self.latency.get(operation)
+
+            if histogram is None:
+                histogram = self.latency[operation] = Histogram(METRICS_LATENCY_BUCKETS)
+
+            histogram.observe(seconds)
+
+            if path is not None:
+                # The sample counter breaks ties, so paths are never compared
+                entry = (seconds, next(self.samples), operation, path)
+
+                if len(self.slow_calls) < self.slowest_size:
+                    heapq.heappush(self.slow_calls, entry)
+                elif seconds > self.slow_calls[0][0]:
+                    heapq.heapreplace(self.slow_calls, entry)
+
+    def observe_depth(self, depth: int) -> None:
+        with self.lock:
+            self.path_depth.observe(depth)
+
+    def observe_buffer(self, items: int) -> None:
+        with self.lock:
+            self.buffer_depth.observe(items)
+
+    def observe_append(self, size: int) -> None:
+        with self.lock:
+            self.log_appended += size
+
+    def slowest(self) -> list[dict[str, Any]]:
+        # Slowest sampled calls first
+        with self.lock:
+            calls = sorted(self.slow_calls, reverse=True)
+
+        return [{"operation": operation, "path": path, "seconds": seconds} for seconds, _, operation, path in calls]
+
+    def render(self) -> str:
+        # Prometheus text exposition format
+        with self.lock:
+            lines = ["# TYPE pyfs_operations_total counter"]
+            lines += [f'pyfs_operations_total{{op="{op}"}} {n}' for op, n in sorted(self.calls.items())]
+            lines.append("# TYPE pyfs_operation_errors_total counter")
+            lines += [f'pyfs_operation_errors_total{{op="{op}"}} {n}' for op, n in sorted(self.errors.items())]
+            lines.append("# TYPE pyfs_operation_seconds histogram")
+
+            for op, histogram in sorted(self.latency.items()):
+                lines += histogram.render("pyfs_operation_seconds", f'op="{op}",')
+
+            lines.append("# TYPE pyfs_path_depth histogram")
+            lines += self.path_depth.render("pyfs_path_depth")
+            lines.append("# TYPE pyfs_buffer_depth histogram")
+            lines += self.buffer_depth.render("pyfs_buffer_depth")
+            lines.append("# TYPE pyfs_log_appended_characters_total counter")
+            lines.append(f"pyfs_log_appended_characters_total {self.log_appended}")
+
+        return "\n".join(lines) + "\n"
+
+
+def metrics_of(owner: FileSystem | Node) -> Metrics | None:
+    if isinstance(owner, FileSystem):
+        return owner.metrics
+
+    directory = owner if isinstance(owner, Directory) else owner.parent
+
+    return directory.fs.metrics if directory is not None else None
+
+
+def instrumented(method: Callable, operation: str) -> Callable:
+    # Counts and times method into the Metrics of the filesystem it runs on.
+    # Paths are sampled before the call, a delete still knows where its node was
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        metrics = metrics_of(self)
+
+        if metrics is None:
+            return method(self, *args, **kwargs)
+
+        sampled = metrics.sample_rate and random.random() < metrics.sample_rate
+        path = None
+
+        if operation == "get_node":
+            # The path may be passed by keyword
+            requested = args[0] if args else kwargs["path"]
+            metrics.observe_depth(len(compile_path(requested)))
+            path = requested if sampled else None
+        elif sampled:
+            path = self.full_path()
+
+        failed = True
+        start = time.perf_counter()
+
+        try:
+            result = method(self, *args, **kwargs)
+            failed = False
+        finally:
+            metrics.observe(operation, time.perf_counter() - start, failed, path)
+
+        if operation == "append":
+            metrics.observe_append(len(args[0] if args else kwargs["information"]))
+        elif isinstance(self, BufferFile):
+            metrics.observe_buffer(self.count)
+
+        return result
+
+    return wrapper
+
+
+def set_instrumentation(fs: FileSystem, enabled: bool) -> None:
+    # FileSystem methods are wrapped on the instance, so a filesystem without
+    # metrics runs the plain methods. Node methods are wrapped once for all,
+    # see INSTRUMENTED_METHODS, and only count for a filesystem with metrics
+    for cls, name, operation in INSTRUMENTED_METHODS:
+        if cls is not FileSystem:
+            continue
+
+        if enabled:
+            setattr(fs, name, instrumented(cls.__dict__[name], operation).__get__(fs))
+        else:
+            fs.__dict__.pop(name, None)
+
+
+class SortedNames():
+    # Distinct names in order, kept in chunks of about INDEX_CHUNK_SIZE
+    # so an insert shifts one chunk instead of the whole list
+    def __init__(self):
+        self.chunks: list[list[str]] = []
+        self.maxes: list[str] = []
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def add(self, name: str) -> None:
+        self.size += 1
+
+        if not self.chunks:
+            self.chunks.append([name])
+            self.maxes.append(name)
+            return
+
+        i = min(bisect_left(self.maxes, name), len(self.maxes) - 1)
+        chunk = self.chunks[i]
+        insort(chunk, name)
+        self.maxes[i] = chunk[-1]
+
+        if len(chunk) > 2 * INDEX_CHUNK_SIZE:
+            self.chunks[i:i + 1] = [chunk[:INDEX_CHUNK_SIZE], chunk[INDEX_CHUNK_SIZE:]]
+            self.maxes[i:i + 1] = [chunk[INDEX_CHUNK_SIZE - 1], chunk[-1]]
+
+    def remove(self, name: str) -> None:
+        i = bisect_left(self.maxes, name)
+        chunk = self.chunks[i]
+        del chunk[bisect_left(chunk, name)]
+        self.size -= 1
+
+        if chunk:
+            self.maxes[i] = chunk[-1]
+        else:
+            del self.chunks[i]
+            del self.maxes[i]
+
+    def prefixed(self, prefix: str) -> Iterator[str]:
+        i = bisect_left(self.maxes, prefix)
+
+        for chunk in self.chunks[i:]:
+            for name in chunk[bisect_left(chunk, prefix):]:
+                if not name.startswith(prefix):
+                    return
+                yield name
+
+
+class NodeIndex():
+    # Secondary index over node names and types, maintained by create/copy/delete.
+    # Ancestry isn't stored: a candidate is checked by walking its parents,
+    # so a move never has to touch the index
+    def __init__(self, fs: FileSystem):
+        self.fs = fs
+        self.lock = threading.Lock()
+        self.by_name: dict[str, set[Node]] = {}
+        self.by_type: dict[type, set[Node]] = {}
+        self.names = SortedNames()
+
+    def __len__(self) -> int:
+        with self.lock:
+            return sum(len(nodes) for nodes in self.by_type.values())
+
+    def add(self, node: Node) -> None:
+        with self.lock:
+            self.insert(node)
+
+    def remove(self, node: Node) -> None:
+        with self.lock:
+            self.discard(node)
+
+    def add_tree(self, node: Node) -> None:
+        nodes = self.subtree(node)
+
+        with self.lock:
+            for descendant in nodes:
+                self.insert(descendant)
+
+    def remove_tree(self, node: Node) -> None:
+        nodes = self.subtree(node)
+
+        with self.lock:
+            for descendant in nodes:
+                self.discard(descendant)
+
+    def subtree(self, node: Node) -> list[Node]:
+        # Collected before taking the index lock: creators hold a directory
+        # lock while they add, so reading childs under it could deadlock
+        nodes = []
+        stack = [node]
+
+        while stack:
+            node = stack.pop()
+            nodes.append(node)
+
+            # Childs of a clone are indexed when it materializes
+            if isinstance(node, Directory) and not node.lazy:
+                stack.extend(node.childs)
+
+        return nodes
+
+    def insert(self, node: Node) -> None:
+        nodes = self.by_name.get(node.name)
+
+        if nodes is None:
+            nodes = self.by_name[node.name] = set()
+            self.names.add(node.name)
+
+        nodes.add(node)
+        self.by_type.setdefault(type(node), set()).add(node)
+
+    def discard(self, node: Node) -> None:
+        nodes = self.by_name.get(node.name)
+
+        if nodes is None or node not in nodes:
+            return
+
+        nodes.remove(node)
+        self.by_type[type(node)].discard(node)
+
+        if not nodes:
+            del self.by_name[node.name]
+            self.names.remove(node.name)
+
+    def find(self, pattern: str = "*", types: tuple[type, ...] | None = None,
+             within: Directory | None = None, limit: int | None = None) -> list[Node]:
+        # Only names sharing the literal prefix of the glob are scanned;
+        # a bare "*" with types scans the (smaller) per-type sets instead
+        within = within or self.fs.root
+        prefix = pattern
+        self.fs.materialize_all()
+
+        # Spilled subtrees aren't indexed: only the ones holding a match are
+        # faulted in, the others stay on disk, see Directory.spilled_match
+        with self.fs.spill_lock:
+            spilled = list(self.fs.spilled_dirs)
+
+        for directory in spilled:
+            if self.reachable(directory, within) and directory.spilled_match(pattern, types):
+                directory.fault_in()
+
+        for i, char in enumerate(pattern):
+            if char in GLOB_CHARS:
+                prefix = pattern[:i]
+                break
+
+        with self.lock:
+            if prefix == pattern:
+                candidates = [sorted(self.by_name.get(pattern, ()), key=Node.full_path)]
+            elif not prefix and types:
+                candidates = [sorted((node for t in types for node in self.by_type.get(t, ())), key=lambda n: n.name)]
+            else:
+                candidates = (sorted(self.by_name[name], key=Node.full_path) for name in list(self.names.prefixed(prefix)))
+
+            result = []
+
+            for nodes in candidates:
+                for node in nodes:
+                    if types and not isinstance(node, types):
+                        continue
+
+                    if not fnmatchcase(node.name, pattern) or not self.reachable(node, within):
+                        continue
+
+                    result.append(node)
+
+                    if limit is not None and len(result) >= limit:
+                        return result
+
+        return result
+
+    def reachable(self, node: Node, within: Directory) -> bool:
+        # True if node is still attached below within, O(depth)
+        while node is not within:
+            parent = node.parent
+
+            if parent is None or parent.entries.get(node.name) is not node:
+                return False
+
+            node = parent
+
+        return True
+
+
+class LazyEntries():
+    # Entries of a directory clone that was neither read nor written yet,
+    # any use copies one level from the source, see Directory.clone
+    __slots__ = ("owner", "source")
+
+    def __init__(self, owner: Directory, source: Directory):
+        self.owner = owner
+        self.source = source
+
+    def get(self, name: str, default: Node | None = None) -> Node | None:
+        return self.owner.materialize().get(name, default)
+
+    def values(self):
+        return self.owner.materialize().values()
+
+    def pop(self, name: str) -> Node:
+        return self.owner.materialize().pop(name)
+
+    def __getitem__(self, name: str) -> Node:
+        return self.owner.materialize()[name]
+
+    def __setitem__(self, name: str, node: Node) -> None:
+        self.owner.materialize()[name] = node
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.owner.materialize()
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.owner.materialize())
+
+    def __len__(self) -> int:
+        return len(self.owner.materialize())
+
+
+class SpilledEntries():
+    # Entries of a directory written out by Directory.spill, any use brings
+    # the subtree back, see Directory.fault_in. Directories below the spilled
+    # one get a stub pointing at it, so a reference kept to one still works
+    __slots__ = ("owner", "top", "offset", "length", "nodes", "live")
+
+    def __init__(self, owner: Directory, top: Directory, offset: int = 0, length: int = 0, nodes: int = 0,
+                 live: list[weakref.ref] | None = None):
+        self.owner = owner
+        self.top = top
+        self.offset = offset
+        self.length = length
+        self.nodes = nodes
+        # Weak references to the spilled nodes in record order, the ones
+        # still alive when faulting in are reused
+        self.live = live
+
+    def get(self, name: str, default: Node | None = None) -> Node | None:
+        return self.owner.materialize().get(name, default)
+
+    def values(self):
+        return self.owner.materialize().values()
+
+    def pop(self, name: str) -> Node:
+        return self.owner.materialize().pop(name)
+
+    def __getitem__(self, name: str) -> Node:
+        return self.owner.materialize()[name]
+
+    def __setitem__(self, name: str, node: Node) -> None:
+        self.owner.materialize()[name] = node
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.owner.materialize()
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.owner.materialize())
+
+    def __len__(self) -> int:
+        return len(self.owner.materialize())
+
+
+class Transaction():
+    # Operations applied all-or-nothing, see FileSystem.transaction.
+    # Every applied operation leaves an undo step, run in reverse on failure
+    def __init__(self, fs: FileSystem):
+        self.fs = fs
+        self.records: list[tuple] = []
+        self.undo: list[Callable[[], Any]] = []
+        self.deleted: list[Node] = []
+        # Paths resolved by this batch, dropped whenever a node leaves a directory
+        self.cache: dict[str, Node] = {}
+        self.generation = fs.generation
+
+    def resolve(self, path: str) -> Node:
+        if self.generation != self.fs.generation:
+            self.cache.clear()
+            self.generation = self.fs.generation
+
+        node = self.cache.get(path)
+
+        if node is None:
+            node = self.cache[path] = self.fs.get_node(path)
+
+        return node
+
+    def directory(self, path: str) -> Directory:
+        directory = self.resolve(path)
+
+        if not isinstance(directory, Directory):
+            raise ValueError("Destination is not a directory")
+
+        return directory
+
+    def mkdir(self, path: str, name: str) -> Directory:
+        return self.created(self.directory(path).create_directory(name))
+
+    def mkbin(self, path: str, name: str, information: str | bytes) -> BinaryFile:
+        return self.created(self.directory(path).create_binary_file(name, information))
+
+    def mklog(self, path: str, name: str, information: str = None) -> LogFile:
+        return self.created(self.directory(path).create_log_file(name, information))
+
+    def mkbuf(self, path: str, name: str, capacity: int = MAX_BUF_FILE_SIZE, mode: str = "lifo") -> BufferFile:
+        return self.created(self.directory(path).create_buffer(name, capacity, mode))
+
+    def created(self, node: Node) -> Node:
+        self.undo.append(node.delete)
+        return node
+
+    def append(self, path: str, information: str) -> int:
+        log_file = self.resolve(path)
+
+        if not isinstance(log_file, LogFile):
+            raise ValueError("Can't find LogFile")
+
+        size = log_file.append(information)
+        self.undo.append(lambda: log_file.truncate(size - len(information)))
+
+        return size
+
+    def push(self, path: str, information: list[Any]) -> int:
+        buffer_file = self.resolve(path)
+
+        if not isinstance(buffer_file, BufferFile):
+            raise ValueError("Can't find BufferFile")
+
+        count = buffer_file.push_many(information)
+        self.undo.append(lambda: buffer_file.drop(len(information)))
+
+        return count
+
+    def move(self, src: str, dest: str) -> Node:
+        node = self.resolve(src)
+        source_dir = node.parent
+
+        if source_dir is None:
+            raise ValueError("Can't move root directory")
+
+        position = source_dir.position(node.name)
+        source_dir.move(node.name, dest)
+
+        def undo():
+            node.parent.move(node.name, source_dir.full_path())
+            source_dir.reorder(node.name, position)
+
+        self.undo.append(undo)
+
+        return node
+
+    def delete(self, path: str) -> Node:
+        # Detached only, content is released once the batch commits
+        node = self.resolve(path)
+        position = node.parent.position(node.name) if node.parent is not None else 0
+        parent = node.detach()
+        self.deleted.append(node)
+        self.undo.append(lambda: parent.attach(node, position))
+
+        return node
+
+    def commit(self) -> None:
+        if self.records:
+            self.fs.record("batch", self.records)
+
+        for node in self.deleted:
+            node.release()
+
+    def rollback(self) -> None:
+        # Undo steps are journaled like any operation, their records are dropped with the batch
+        for undo in reversed(self.undo):
+            undo()
+
+        self.undo.clear()
+        self.records.clear()
+
+
+class FileSystem():
+    def __init__(self, dir_max_elems: int | None = DIR_MAX_ELEMS, path_cache_size: int = PATH_CACHE_SIZE,
+                 blob_dir: str | None = None, json_cache_size: int = JSON_CACHE_SIZE,
+                 memory_budget: int | None = None, spill_dir: str | None = None):
+        if memory_budget is not None and not spill_dir:
+            raise ValueError("A memory budget needs a spill_dir")
+
+        # None disables the per-directory limit
+        self.dir_max_elems = dir_max_elems
+        # BinaryFile content above BLOB_INLINE_LIMIT goes to mmap segments when set
+        self.blob_store = BlobStore(blob_dir) if blob_dir else None
+        self.spill_store = SpillStore(spill_dir) if spill_dir else None
+        self.content_store = ContentStore(self.blob_store, spill_store=self.spill_store)
+        # Ticks once per SPILL_INTERVAL while a memory budget is set, nodes
+        # remember the tick they were last used in, see evict
+        self.clock = 0
+        self.root = Directory(self, parent=None, name="~")
+        self.cwd = self.root
+        self.index = NodeIndex(self)
+
+        # Bumped whenever a node leaves a directory, which is the only
+        # change that can invalidate an already resolved path.
+        # next() on itertools.count is atomic, so concurrent bumps never collide
+        self.generations = count(1)
+        self.generation = 0
+        self.path_cache_size = path_cache_size
+        self.path_cache: OrderedDict[tuple[Directory, str], tuple[Node, int]] = OrderedDict()
+        # node -> (generation, name/type/path fragment, child names), see Node.json_fragment.
+        # Directories drop their entry whenever a child is added or removed
+        self.json_cache_size = json_cache_size
+        self.json_cache: OrderedDict[Node, tuple[int, dict[str, Any], tuple[str, ...] | None]] = OrderedDict()
+        # Lock order, outermost first; a thread holding one of these only takes
+        # locks further down the list:
+        #   barrier, see below
+        #   clone_lock, spill_lock (lazy directories are materialized before
+        #     their lock is taken)
+        #   Directory.lock, several of them in id order, see write_locked
+        #   the content lock of a file (LogFile.lock, BufferFile.lock)
+        #   usage_lock, then counter_locks
+        #   leaf locks: journal, watch_lock, index, content and blob stores
+        # A BufferFile waiting for room or items holds only its own lock, see
+        # BufferFile.ready.
+        # Mutations hold the barrier shared while they apply and journal, a
+        # snapshot, an eviction, a transaction or a directory move holds it
+        # exclusively. A directory move changes the paths below it, so no
+        # record with an old path can reach the journal after the move's
+        # record, and two crossing moves can't build a cycle.
+        # Persistence, see FileSystem.open
+        self.journal: Journal | None = None
+        self.barrier = RWLock()
+        self.data_dir: str | None = None
+        self.segment = 0
+        self.snapshot_every: int | None = None
+        self.snapshot_requested = threading.Event()
+        self.persistence_thread: threading.Thread | None = None
+        self.closed = False
+        # Journal records open couldn't replay, their node was gone when they ran
+        self.dropped_records = 0
+        # Holds the Transaction running on the current thread
+        self.local = threading.local()
+
+        # Copy-on-write clones, see Directory.clone. pending_clones counts clones
+        # that still read a directory of this filesystem, lazy_dirs holds the
+        # clones owned by this filesystem that weren't materialized yet
+        self.clone_lock = threading.RLock()
+        self.pending_clones = 0
+        self.lazy_dirs: set[Directory] = set()
+        # The filesystem a snapshot was taken from
+        self.source: FileSystem | None = None
+        # See enable_metrics, None while disabled
+        self.metrics: Metrics | None = None
+        # Replaced, never mutated, so record() can read it without the lock
+        self.watchers: tuple[Watcher, ...] = ()
+        # Rolled-up Directory counters, see Directory.charge: usage_lock makes a
+        # quota check and its update one step, counter_locks are striped by
+        # directory so writers elsewhere in the tree don't wait on each other
+        self.usage_lock = threading.RLock()
+        self.counter_locks = tuple(threading.Lock() for _ in range(64))
+        self.watch_lock = threading.Lock()
+        # See enable_tiering, set while the background pass runs
+        self.tiering_stop: threading.Event | None = None
+        self.tiering_thread: threading.Thread | None = None
+
+        # Estimated bytes the resident tree may use, see evict. Mutations hold
+        # the barrier shared, so nothing changes under a spill
+        self.memory_budget = memory_budget
+        self.spill_lock = threading.RLock()
+        self.spilled_nodes = 0
+        # Tops of the spilled subtrees, kept apart from lazy_dirs so that
+        # materialize_all doesn't bring them back
+        self.spilled_dirs: set[Directory] = set()
+        self.spill_stop = threading.Event()
+        self.spill_thread: threading.Thread | None = None
+
+        if memory_budget is not None:
+            self.spill_thread = threading.Thread(target=self.spill_worker, daemon=True)
+            self.spill_thread.start()
+
+    def change_working_directory(self, path):
+        dest = self.get_node(path)
+        
+        if not isinstance(dest, Directory):
+            raise ValueError("Destination is not a directory")
+
+        self.cwd = dest
+
+    def print_cwd(self):
+        for c in self.cwd.iter_childs():
+            print(c)
+
+    def string_to_path(self, string: str) -> list[Node]:
+        dest = self.get_node(string)
+
+        if not isinstance(dest, Directory):
+            raise ValueError("Destination is not a directory")
+
+        path = dest.path + [dest]
+
+        if self.cwd in path:
+            return path[path.index(self.cwd):]
+
+        return path
+
+    def path_to_string(self, path: list[Node]) -> str:
+        return DELIMITER.join([n.name for n in path])
+
+    def enable_metrics(self, sample_rate: float = 0.0, slowest: int = METRICS_SLOWEST) -> Metrics:
+        # Starts counting from zero, sample_rate is the share of calls whose path
+        # is kept for Metrics.slowest
+        if not 0 <= sample_rate <= 1:
+            raise ValueError("sample_rate must be between 0 and 1")
+
+        self.metrics = Metrics(sample_rate, slowest)
+        set_instrumentation(self, True)
+
+        return self.metrics
+
+    def disable_metrics(self) -> None:
+        self.metrics = None
+        set_instrumentation(self, False)
+
+    def compress_cold(self, cold_after: float = TIER_COLD_AFTER, codec: str = "zlib") -> int:
+        # Compresses BinaryFile content and sealed LogFile chunks that weren't
+        # read for cold_after seconds, returns how many payloads it compressed.
+        # Lazy clones are skipped, their content belongs to the source
+        if codec not in TIER_CODECS:
+            raise ValueError(f"Codec must be one of {', '.join(TIER_CODECS)}")
+
+        cutoff = time.monotonic() - cold_after
+        compressed = 0
+
+        for _, node in self.root.walk(types=(BinaryFile, LogFile),
+                                      prune=lambda node: isinstance(node, Directory) and node.lazy):
+            compressed += node.compress_cold(cutoff, codec)
+
+        return compressed
+
+    def enable_tiering(self, cold_after: float = TIER_COLD_AFTER, interval: float = TIER_INTERVAL,
+                       codec: str = "zlib", cache_size: int = TIER_CACHE_SIZE) -> None:
+        # Runs compress_cold every interval seconds on a background thread,
+        # cache_size bounds the decompressed payloads kept for reads
+        if codec not in TIER_CODECS:
+            raise ValueError(f"Codec must be one of {', '.join(TIER_CODECS)}")
+
+        if interval <= 0:
+            raise ValueError("Tiering interval must be positive")
+
+        self.disable_tiering()
+        self.content_store.cache_size = cache_size
+        self.tiering_stop = threading.Event()
+        self.tiering_thread = threading.Thread(target=self.tiering_worker,
+                                               args=(self.tiering_stop, cold_after, interval, codec), daemon=True)
+        self.tiering_thread.start()
+
+    def disable_tiering(self) -> None:
+        if self.tiering_stop is not None:
+            self.tiering_stop.set()
+            self.tiering_thread.join()
+            self.tiering_stop = self.tiering_thread = None
+
+    def tiering_worker(self, stop: threading.Event, cold_after: float, interval: float, codec: str) -> None:
+        while not stop.wait(interval):
+            self.compress_cold(cold_after, codec)
+
+    def memory_usage(self) -> int:
+        # Estimated heap bytes of the resident tree, in O(1). BufferFile items
+        # only count through SPILL_NODE_SIZE
+        content_store = self.content_store
+
+        return ((1 + self.root.nodes - self.spilled_nodes) * SPILL_NODE_SIZE
+                + content_store.resident_size + content_store.cached_size)
+
+    def evict(self) -> int:
+        # Spills least recently used subtrees, then the content of least recently
+        # used files, until memory_usage fits the budget. Returns the number of
+        # nodes spilled. Anything used in the current clock tick stays, and so
+        # do the working directory and directories that clones still read
+        if self.memory_budget is None:
+            raise ValueError("FileSystem has no memory budget")
+
+        with self.barrier.write():
+            self.clock += 1
+            now = self.clock
+            self.cwd.seen = now
+            subtrees = []
+            files = []
+            # Post-order walk of the resident tree: frames are [directory, childs, newest tick below]
+            stack = [[self.root, iter(self.root.childs), self.root.seen]]
+
+            while stack:
+                frame = stack[-1]
+                node = next(frame[1], None)
+
+                if node is None:
+                    stack.pop()
+
+                    if stack:
+                        stack[-1][2] = max(stack[-1][2], frame[2])
+
+                        if frame[2] < now and frame[0].nodes:
+                            subtrees.append((frame[2], len(stack), frame[0]))
+                elif isinstance(node, Directory):
+                    if node.lazy or node.clones:
+                        frame[2] = max(frame[2], node.seen if node.lazy else now)
+                    else:
+                        stack.append([node, iter(node.childs), node.seen])
+                else:
+                    frame[2] = max(frame[2], node.seen)
+
+                    if node.seen < now and not isinstance(node, BufferFile):
+                        files.append((node.seen, len(stack), node))
+
+            # Oldest first, and the biggest subtree among equally old ones
+            subtrees.sort(key=lambda candidate: candidate[:2])
+            spilled = 0
+
+            for _, _, directory in subtrees:
+                if self.memory_usage() <= self.memory_budget:
+                    return spilled
+
+                # Already inside a subtree spilled before it
+                if not directory.lazy and not any(parent.lazy for parent in directory.path):
+                    spilled += directory.spill()
+
+            files.sort(key=lambda candidate: candidate[:2])
+
+            for _, _, node in files:
+                if self.memory_usage() <= self.memory_budget:
+                    return spilled
+
+                if not any(parent.lazy for parent in node.path):
+                    node.spill_content()
+
+            excess = self.memory_usage() - self.memory_budget
+
+            if excess > 0:
+                self.content_store.trim(self.content_store.cached_size - excess)
+
+            return spilled
+
+    def spill_worker(self) -> None:
+        while not self.spill_stop.wait(SPILL_INTERVAL):
+            if self.memory_usage() > self.memory_budget:
+                self.evict()
+            else:
+                self.clock += 1
+
+    def get_node(self, path: str) -> Node:
+        return self.resolve(path, self.cwd)
+
+    def resolve(self, path: str, start: Directory) -> Node:
+        key = (start, path)
+        generation = self.generation
+        cached = self.path_cache.get(key)
+
+        if cached is not None and cached[1] == generation:
+            try:
+                self.path_cache.move_to_end(key)
+            except KeyError:
+                pass
+
+            cached[0].seen = self.clock
+            return cached[0]
+
+        # Single dict lookups are atomic, so walking needs no directory locks
+        node = start
+
+        for token in compile_path(path):
+            if not isinstance(node, Directory):
+                raise ValueError("Wrong path")
+
+            if token == "~":
+                node = self.root
+            elif token == "..":
+                node = node.parent or node
+            else:
+                node = node.entries.get(token)
+
+                if node is None:
+                    raise ValueError("Wrong path")
+
+        node.seen = self.clock
+
+        if self.path_cache_size:
+            # Stored with the generation read before walking, so a removal
+            # that raced with the walk invalidates the entry
+            self.path_cache[key] = (node, generation)
+
+            try:
+                self.path_cache.move_to_end(key)
+
+                if len(self.path_cache) > self.path_cache_size:
+                    self.path_cache.popitem(last=False)
+            except KeyError:
+                pass
+
+        return node
+
+    def create_directory(self, path: str, name: str) -> Directory:
+        dest_dir = self.get_node(path)
+        return dest_dir.create_directory(name)
+
+    def create_binary_file(self, path: str, name: str, information: str | bytes) -> BinaryFile:
+        dest_dir = self.get_node(path)
+        return dest_dir.create_binary_file(name, information)
+
+    def create_log_file(self, path: str, name: str, information: str = None) -> LogFile:
+        dest_dir = self.get_node(path)
+        return dest_dir.create_log_file(name, information)
+
+    def create_buffer(self, path: str, name: str, capacity: int = MAX_BUF_FILE_SIZE, mode: str = "lifo") -> BufferFile:
+        dest_dir = self.get_node(path)
+        return dest_dir.create_buffer(name, capacity, mode)
+
+    def du(self, path: str = ".") -> dict[str, Any]:
+        # O(1) from the rolled-up counters, nodes counts the node itself
+        node = self.get_node(path)
+        nodes, size = node.usage()
+
+        return {"path": node.full_path(), "nodes": nodes, "size": size}
+
+    def print_elements(self) -> None:
+        for line in self.iter_tree():
+            print(line)
+
+    def walk(self, path: str = ".", **kwargs) -> Iterator[tuple[int, Node]]:
+        start = self.get_node(path)
+
+        if not isinstance(start, Directory):
+            raise ValueError("Destination is not a directory")
+
+        return start.walk(**kwargs)
+
+    def iter_tree(self, path: str = ".", **kwargs) -> Iterator[str]:
+        # Lines of the tree listing, produced lazily
+        start = self.get_node(path)
+
+        if not isinstance(start, Directory):
+            raise ValueError("Destination is not a directory")
+
+        yield start.name
+
+        for depth, node in start.walk(**kwargs):
+            yield "   "*depth + node.name
+
+    def find(self, pattern: str = "*", path: str = ".", types: tuple[type, ...] | None = None,
+             limit: int | None = None) -> list[Node]:
+        within = self.get_node(path)
+
+        if not isinstance(within, Directory):
+            raise ValueError("Destination is not a directory")
+
+        return self.index.find(pattern, types, within, limit)
+
+    @classmethod
+    def open(cls, data_dir: str, fsync: str = "batch", snapshot_every: int | None = SNAPSHOT_EVERY, **kwargs) -> FileSystem:
+        # Load the latest snapshot, replay the journal written after it and keep journaling
+        os.makedirs(data_dir, exist_ok=True)
+        kwargs.setdefault("blob_dir", os.path.join(data_dir, "blobs"))
+
+        if kwargs.get("memory_budget") is not None and not kwargs.get("spill_dir"):
+            kwargs["spill_dir"] = os.path.join(data_dir, "spill")
+
+        fs = cls(**kwargs)
+        dir_max_elems = fs.dir_max_elems
+
+        snapshots = sorted(f for f in os.listdir(data_dir) if f.startswith("snapshot.") and f[9:].isdigit())
+        segments = sorted(f for f in os.listdir(data_dir) if f.startswith("journal.") and f[8:].isdigit())
+        start = 0
+
+        if snapshots:
+            start = int(snapshots[-1][9:])
+
+            with open(os.path.join(data_dir, snapshots[-1]), "rb") as file:
+                fs.load_snapshot(file)
+
+        for segment in segments:
+            if int(segment[8:]) >= start:
+                for record in Journal.read(os.path.join(data_dir, segment)):
+                    try:
+                        fs.apply(record)
+                    except ValueError:
+                        # Operation on a node that was already detached when it ran
+                        fs.dropped_records += 1
+
+        if fs.dropped_records:
+            warnings.warn(f"{fs.dropped_records} journal records of {data_dir} could not be replayed")
+
+        # Replay ran with the journaled limit, an explicit one applies from now on
+        if "dir_max_elems" in kwargs:
+            fs.dir_max_elems = dir_max_elems
+
+        fs.data_dir = data_dir
+        fs.snapshot_every = snapshot_every
+        fs.segment = max([start] + [int(segment[8:]) for segment in segments]) + 1
+        fs.journal = Journal(os.path.join(data_dir, f"journal.{fs.segment:012d}"), fsync)
+        fs.journal.append(("limits", "~", fs.dir_max_elems))
+        fs.persistence_thread = threading.Thread(target=fs.persistence_worker, daemon=True)
+        fs.persistence_thread.start()
+
+        return fs
+
+    def mutating(self):
+        # A running transaction already holds the barrier exclusively
+        if getattr(self.local, "transaction", None) is not None:
+            return nullcontext()
+
+        return self.barrier.read()
+
+    def exclusive(self):
+        # Like mutating, for the changes that hold the barrier exclusively
+        if getattr(self.local, "transaction", None) is not None:
+            return nullcontext()
+
+        return self.barrier.write()
+
+    def record(self, *operation) -> None:
+        # Every change ends here: journaled when persistent and turned into
+        # watch events, a transaction holds both back until it commits
+        if self.journal is None and not self.watchers:
+            return
+
+        transaction = getattr(self.local, "transaction", None)
+
+        if transaction is not None:
+            transaction.records.append(operation)
+            return
+
+        if self.journal is not None:
+            self.journal.append(operation)
+
+            if self.snapshot_every and self.journal.records >= self.snapshot_every:
+                self.snapshot_requested.set()
+
+        if self.watchers:
+            self.notify(operation)
+
+    def watch(self, path: str = ".", recursive: bool = True, size: int = WATCH_QUEUE_SIZE) -> Watcher:
+        # Events for path and its childs (all descendants when recursive).
+        # Paths are matched as strings, a watch doesn't follow a moved directory
+        node = self.get_node(path)
+
+        if size < 1:
+            raise ValueError("Watch queue size must be positive")
+
+        watcher = Watcher(self, node.full_path(), recursive, size)
+
+        with self.watch_lock:
+            self.watchers = self.watchers + (watcher,)
+
+        return watcher
+
+    def unwatch(self, watcher: Watcher) -> None:
+        with self.watch_lock:
+            self.watchers = tuple(w for w in self.watchers if w is not watcher)
+
+    def notify(self, operation: tuple) -> None:
+        for event in record_events(operation):
+            for watcher in self.watchers:
+                if watcher.matches(event["path"]) or ("dest" in event and watcher.matches(event["dest"])):
+                    watcher.put(dict(event))
+
+    @contextmanager
+    def transaction(self) -> Iterator[Transaction]:
+        # Operations of the block are undone if it raises. The barrier is held
+        # exclusively so nothing interleaves with the batch (a rollback truncates
+        # logs and drops the newest buffer items), and the batch is journaled as
+        # a single record once the block succeeds
+        if getattr(self.local, "transaction", None) is not None:
+            raise ValueError("Transactions can't be nested")
+
+        transaction = Transaction(self)
+
+        with self.barrier.write():
+            self.local.transaction = transaction
+
+            try:
+                yield transaction
+            except BaseException:
+                transaction.rollback()
+                raise
+            finally:
+                self.local.transaction = None
+
+            transaction.commit()
+
+    def persistence_worker(self) -> None:
+        # Bounds the fsync delay of the batch policy and takes requested snapshots
+        while not self.closed:
+            if self.snapshot_requested.wait(self.journal.fsync_interval):
+                self.snapshot_requested.clear()
+
+                if not self.closed:
+                    self.checkpoint()
+
+            self.journal.sync()
+
+    def checkpoint(self) -> None:
+        if self.journal is None:
+            raise ValueError("FileSystem is not persistent")
+
+        with self.barrier.write():
+            segment = self.segment + 1
+            snapshot_path = os.path.join(self.data_dir, f"snapshot.{segment:012d}")
+
+            with open(snapshot_path + ".tmp", "wb") as file:
+                self.write_snapshot(file)
+                file.flush()
+                os.fsync(file.fileno())
+
+            os.replace(snapshot_path + ".tmp", snapshot_path)
+
+            self.journal.close()
+            self.segment = segment
+            self.journal = Journal(os.path.join(self.data_dir, f"journal.{segment:012d}"), self.journal.fsync,
+                                   self.journal.fsync_batch, self.journal.fsync_interval)
+            self.journal.append(("limits", "~", self.dir_max_elems))
+
+            for name in os.listdir(self.data_dir):
+                prefix, _, number = name.partition(".")
+                if prefix in ("snapshot", "journal") and number.isdigit() and int(number) < segment:
+                    os.remove(os.path.join(self.data_dir, name))
+
+    def snapshot(self) -> FileSystem:
+        # Point-in-time copy of the whole tree in O(1). It shares content with
+        # this filesystem and copies directories lazily as they are read, or
+        # as they are about to change here. close() it once done
+        snapshot = FileSystem(self.dir_max_elems, self.path_cache_size, json_cache_size=self.json_cache_size)
+        snapshot.blob_store = self.blob_store
+        snapshot.content_store = self.content_store
+        snapshot.source = self
+        self.root.share(snapshot.root)
+
+        return snapshot
+
+    def unshare(self, directory: Directory) -> None:
+        # Called before directory (or a file in it) changes: clones still reading
+        # it or one of its ancestors copy their level first, root down.
+        # A lazy directory is materialized before its lock is taken
+        directory.seen = self.clock
+
+        if directory.lazy:
+            directory.materialize()
+
+        if not self.pending_clones:
+            return
+
+        with self.clone_lock:
+            for node in directory.path + [directory]:
+                while node.clones:
+                    node.clones[-1].materialize()
+
+    def materialize_all(self) -> None:
+        while self.lazy_dirs:
+            try:
+                directory = self.lazy_dirs.pop()
+            except KeyError:
+                break
+
+            directory.materialize()
+
+    def __enter__(self) -> FileSystem:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self.metrics is not None:
+            self.disable_metrics()
+
+        self.disable_tiering()
+
+        if self.spill_thread is not None:
+            self.spill_stop.set()
+            self.spill_thread.join()
+            self.spill_thread = None
+
+        if self.source is not None and not self.closed:
+            # Drops the content references and pending clones of a snapshot
+            self.closed = True
+            self.root.release()
+            return
+
+        if self.journal is None or self.closed:
+            return
+
+        self.closed = True
+        self.persistence_thread.join()
+        self.journal.close()
+
+    def write_snapshot(self, file) -> None:
+        # Caller holds the barrier, no mutation is in flight
+        batch = []
+
+        for record in self.export_records(self.root):
+            batch.append(record)
+
+            if len(batch) >= SNAPSHOT_BATCH:
+                pickle.dump(batch, file, protocol=pickle.HIGHEST_PROTOCOL)
+                batch = []
+
+        pickle.dump(batch, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def load_snapshot(self, file) -> None:
+        def records():
+            while True:
+                try:
+                    yield from pickle.load(file)
+                except EOFError:
+                    return
+
+        self.load_records(None, records())
+
+    def export_records(self, node: Node) -> Iterator[tuple]:
+        # Pre-order records of the subtree of node, directories carry their number of childs
+        stack = [node]
+
+        while stack:
+            node = stack.pop()
+
+            if isinstance(node, Directory) and isinstance(node.entries, SpilledEntries):
+                yield from node.spilled_records()
+            elif isinstance(node, Directory):
+                childs = node.childs
+                yield ("d", node.name, len(childs), node.quota)
+                stack.extend(reversed(childs))
+            elif isinstance(node, BinaryFile):
+                yield ("b", node.name, node.information)
+            elif isinstance(node, LogFile):
+                yield ("l", node.name, node.read())
+            else:
+                yield ("q", node.name, node.capacity, node.mode, node.items)
+
+    def import_path(self, host_dir: str, dest: str = ".", name: str | None = None, workers: int = IMPORT_WORKERS,
+                    progress: Callable[[int, int], None] | None = None) -> Node:
+        # Copies the host directory host_dir below dest (as name, its own name by
+        # default) in one journal record. The host tree is scanned and validated
+        # first, then read by a thread pool and attached at once, see import_records.
+        # Symlinks and special files are skipped, progress(files, bytes) follows the reads
+        dest_dir = self.get_node(dest)
+
+        if not isinstance(dest_dir, Directory):
+            raise ValueError("Destination is not a directory")
+
+        if not os.path.isdir(host_dir):
+            raise ValueError(f"{host_dir} is not a directory")
+
+        max_elems = self.dir_max_elems
+
+        def scan(directory: str) -> list[os.DirEntry]:
+            try:
+                with os.scandir(directory) as entries:
+                    childs = sorted((entry for entry in entries
+                                     if entry.is_dir(follow_symlinks=False) or entry.is_file(follow_symlinks=False)),
+                                    key=lambda entry: entry.name)
+            except OSError as e:
+                raise ValueError(f"Can't read {directory}: {e.strerror}")
+
+            if max_elems is not None and len(childs) > max_elems:
+                raise ValueError(f"{directory} has more than {max_elems} entries")
+
+            return childs
+
+        childs = scan(host_dir)
+        records: list[tuple] = [("d", check_import_name(name or os.path.basename(os.path.abspath(host_dir))), len(childs), None)]
+        # File records are placeholders until read, paths[i] fills records[slots[i]]
+        paths: list[str] = []
+        slots: list[int] = []
+        stack = [iter(childs)]
+
+        while stack:
+            entry = next(stack[-1], None)
+
+            if entry is None:
+                stack.pop()
+                continue
+
+            check_import_name(entry.name)
+
+            if entry.is_dir(follow_symlinks=False):
+                childs = scan(entry.path)
+                records.append(("d", entry.name, len(childs), None))
+                stack.append(iter(childs))
+            else:
+                paths.append(entry.path)
+                slots.append(len(records))
+                records.append(("b", entry.name))
+
+        batches = [paths[start:start + IMPORT_BATCH] for start in range(0, len(paths), IMPORT_BATCH)]
+        files = size = 0
+
+        with ThreadPoolExecutor(max(1, workers)) as pool:
+            for contents in pool.map(read_host_files, batches):
+                for content in contents:
+                    slot = slots[files]
+                    records[slot] = host_record(records[slot][1], content)
+                    files += 1
+                    size += len(content)
+
+                if progress is not None:
+                    progress(files, size)
+
+        return dest_dir.import_records(records)
+
+    def import_tar(self, source: str | Any, dest: str = ".", name: str | None = None,
+                   progress: Callable[[int, int], None] | None = None) -> Node:
+        # Extracts a tar archive (a host path or a readable binary stream, plain or
+        # compressed) below dest in one pass, validated and attached like import_path.
+        # Without name the archive must hold a single top level entry, with it the
+        # entries go into a new directory name. PYFS.* pax headers keep the node types
+        dest_dir = self.get_node(dest)
+
+        if not isinstance(dest_dir, Directory):
+            raise ValueError("Destination is not a directory")
+
+        if isinstance(source, str) and not os.path.isfile(source):
+            raise ValueError(f"{source} is not a file")
+
+        # Directories are dicts of name -> dict or file record, in archive order
+        tree: dict[str, Any] = {}
+        quotas: dict[int, tuple] = {}
+        files = size = 0
+
+        try:
+            archive = tarfile.open(source, "r|*") if isinstance(source, str) else tarfile.open(fileobj=source, mode="r|*")
+
+            with archive:
+                for member in archive:
+                    parts = [part for part in member.name.split("/") if part not in ("", ".")]
+
+                    if not parts or not (member.isdir() or member.isfile()):
+                        continue
+
+                    directory = tree
+
+                    for part in parts[:-1]:
+                        directory = directory.setdefault(check_import_name(part), {})
+
+                        if not isinstance(directory, dict):
+                            raise ValueError(f"{member.name} is below a file")
+
+                    leaf = check_import_name(parts[-1])
+
+                    if member.isdir():
+                        node = directory.setdefault(leaf, {})
+
+                        if not isinstance(node, dict):
+                            raise ValueError(f"{member.name} is both a file and a directory")
+
+                        if "PYFS.quota" in member.pax_headers:
+                            quotas[id(node)] = tuple(None if limit == "-" else int(limit)
+                                                     for limit in member.pax_headers["PYFS.quota"].split(","))
+                    else:
+                        if isinstance(directory.get(leaf), dict):
+                            raise ValueError(f"{member.name} is both a file and a directory")
+
+                        data = archive.extractfile(member).read()
+                        directory[leaf] = tar_record(leaf, data, member.pax_headers)
+                        files += 1
+                        size += len(data)
+
+                        if progress is not None and files % IMPORT_BATCH == 0:
+                            progress(files, size)
+        except tarfile.TarError as e:
+            raise ValueError(f"Can't read the archive: {e}")
+
+        if progress is not None:
+            progress(files, size)
+
+        if name is not None:
+            top = (check_import_name(name), tree)
+        elif len(tree) == 1:
+            top = next(iter(tree.items()))
+        else:
+            raise ValueError("The archive has several top level entries, pass a name to import them")
+
+        # Pre-order records, validated before anything is attached
+        max_elems = self.dir_max_elems
+        records = []
+        stack = [iter([top])]
+
+        while stack:
+            item = next(stack[-1], None)
+
+            if item is None:
+                stack.pop()
+                continue
+
+            node_name, node = item
+
+            if not isinstance(node, dict):
+                records.append(node)
+                continue
+
+            if max_elems is not None and len(node) > max_elems:
+                raise ValueError(f"{node_name} has more than {max_elems} entries")
+
+            records.append(("d", node_name, len(node), quotas.get(id(node))))
+            stack.append(iter(node.items()))
+
+        return dest_dir.import_records(records)
+
+    def export_tar(self, path: str = ".", compression: str | None = None) -> Iterator[bytes]:
+        # Streams the subtree at path as a tar archive (gz or xz compressed) in about
+        # TAR_CHUNK_SIZE chunks, holding one directory listing and one file at a time.
+        # Like tar on a live filesystem each directory is listed as it is reached,
+        # no lock is held between chunks. import_tar reads it back
+        if compression is not None and compression not in TAR_COMPRESSIONS:
+            raise ValueError(f"Compression must be one of {', '.join(TAR_COMPRESSIONS)}")
+
+        return tar_stream(self, self.get_node(path), compression)
+
+    def load_records(self, parent: Directory | None, records: Iterable[tuple]) -> Node:
+        # Builds export_records output below parent, or into the root when parent
+        # is None. Records were validated when exported, nodes are attached directly
+        stack: list[list] = []
+        top = None
+
+        for record in records:
+            kind, name = record[0], record[1]
+
+            if top is None and parent is None:
+                top = self.root
+                self.root.quota = record[3] if len(record) > 3 else None
+                stack.append([self.root, record[2]])
+                continue
+
+            directory = stack[-1][0] if stack else parent
+
+            if stack:
+                stack[-1][1] -= 1
+
+            if kind == "d":
+                node = Directory(self, directory, name)
+                node.quota = record[3] if len(record) > 3 else None
+                stack.append([node, record[2]])
+            elif kind == "b":
+                node = BinaryFile(directory, name, record[2])
+            elif kind == "l":
+                node = LogFile(directory, name, record[2])
+            else:
+                node = BufferFile(directory, name, record[2], record[3])
+                node.load(record[4])
+
+            # Quotas were checked when the records were written. The directories
+            # built here are charged once complete instead of per node up to the root
+            if kind != "d" and directory is parent:
+                directory.charge(*node.usage(), check=False)
+            elif kind != "d":
+                nodes, size = node.usage()
+                directory.nodes += nodes
+                directory.size += size
+
+            directory.add_child(node)
+            self.index.add(node)
+            top = top or node
+
+            while stack and stack[-1][1] == 0:
+                done = stack.pop()[0]
+
+                if stack:
+                    nodes, size = done.usage()
+                    stack[-1][0].nodes += nodes
+                    stack[-1][0].size += size
+                elif done.parent is not None:
+                    done.parent.charge(*done.usage(), check=False)
+
+        return top
+
+    def apply(self, record: tuple) -> None:
+        operation, path, *args = record
+
+        if operation == "batch":
+            for batched in path:
+                self.apply(batched)
+            return
+
+        if operation == "limits":
+            # First record of every journal segment, see FileSystem.open
+            self.dir_max_elems = args[0]
+            return
+
+        node = self.resolve(path, self.root)
+
+        if operation == "mkdir":
+            node.create_directory(*args)
+        elif operation == "mkbin":
+            node.create_binary_file(*args)
+        elif operation == "mklog":
+            node.create_log_file(*args)
+        elif operation == "mkbuf":
+            node.create_buffer(*args)
+        elif operation == "append":
+            node.append(*args)
+        elif operation == "push":
+            node.push_many(*args)
+        elif operation == "pop":
+            node.pop_many(*args)
+        elif operation == "move":
+            node.move(*args)
+        elif operation == "copy":
+            node.copy(*args)
+        elif operation == "clone":
+            node.clone(*args)
+        elif operation == "import":
+            node.import_records(*args)
+        elif operation == "quota":
+            node.set_quota(*args)
+        elif operation == "delete":
+            node.delete()
+        else:
+            raise ValueError(f"Unknown journal operation {operation}")
+
+
+class Node():
+    __slots__ = ("parent", "name", "seen", "moved", "__weakref__")
+
+    def __init__(self, parent: Directory | None, name: str):
+        self.parent = parent
+        self.name = name
+        # FileSystem.clock tick of the last access, see FileSystem.evict
+        self.seen = parent.fs.clock if parent is not None else 0
+        # FileSystem.generation of the last move into another directory, see json_fragment
+        self.moved = 0
+
+    @property
+    def filesystem(self) -> FileSystem:
+        return self.parent.fs
+
+    def full_path(self) -> str:
+        return DELIMITER.join([d.name for d in self.path] + [self.name])
+
+    @property
+    def path(self) -> list[Node]:
+        # Ancestors from the root down to the parent, built on demand
+        path = []
+        node = self.parent
+
+        while node is not None:
+            path.append(node)
+            node = node.parent
+
+        path.reverse()
+        return path
+
+    def to_json(self, limit: int | None = JSON_PAGE_SIZE, cursor: str | None = None, depth: int = 0) -> dict[str, Any]:
+        # limit/cursor page the childs of a directory, depth nests its children
+        return dict(self.json_fragment()[0])
+
+    def json_fragment(self) -> tuple[dict[str, Any], tuple[str, ...] | None]:
+        # Cached until the node or one of its ancestors moves (its path changed)
+        # or, for a directory, until its own childs change
+        fs = self.filesystem
+        generation = fs.generation
+        cached = fs.json_cache.get(self)
+
+        if cached is not None and cached[0] >= self.moved_at():
+            try:
+                fs.json_cache.move_to_end(self)
+            except KeyError:
+                pass
+
+            return cached[1], cached[2]
+
+        fragment = {"name": self.name, "type": NODE_TYPE_NAMES[type(self)], "path": [n.name for n in self.path]}
+
+        if not isinstance(self, Directory):
+            childs = None
+            self.cache_fragment(generation, fragment, childs)
+        else:
+            if self.lazy:
+                self.materialize()
+
+            # Stored under the read lock so a concurrent add/remove can't be missed
+            with self.lock.read():
+                childs = tuple(self.entries)
+                self.cache_fragment(generation, fragment, childs)
+
+        return fragment, childs
+
+    def moved_at(self) -> int:
+        # Newest move of the node and its ancestors
+        moved = 0
+        node = self
+
+        while node is not None:
+            if node.moved > moved:
+                moved = node.moved
+
+            node = node.parent
+
+        return moved
+
+    def cache_fragment(self, generation: int, fragment: dict[str, Any], childs: tuple[str, ...] | None) -> None:
+        fs = self.filesystem
+
+        if not fs.json_cache_size:
+            return
+
+        fs.json_cache[self] = (generation, fragment, childs)
+
+        try:
+            fs.json_cache.move_to_end(self)
+
+            if len(fs.json_cache) > fs.json_cache_size:
+                fs.json_cache.popitem(last=False)
+        except KeyError:
+            pass
+
+    def delete(self) -> Node:
+        self.detach()
+        self.release()
+
+        return self
+
+    def usage(self) -> tuple[int, int]:
+        # (nodes, bytes) this node adds to the counters of its ancestors
+        return 1, 0
+
+    def content_lock(self):
+        # Held while the node changes directory, so its usage can't change meanwhile.
+        # A directory's usage changes under any write below it, so a directory is
+        # only detached or moved while holding the barrier exclusively
+        return nullcontext()
+
+    def detach(self) -> Directory:
+        # Unlinks the node from its parent, which is returned
+        while True:
+            parent = self.parent
+
+            if parent is None:
+                raise ValueError("Can't delete root directory")
+
+            parent.fs.unshare(parent)
+            barrier = parent.fs.exclusive() if isinstance(self, Directory) else parent.fs.mutating()
+
+            with barrier, parent.lock.write():
+                # A concurrent move may have re-parented the node meanwhile
+                if self.parent is not parent:
+                    continue
+
+                if parent.entries.get(self.name) is not self:
+                    raise ValueError("File does not exist")
+
+                with self.content_lock():
+                    parent.charge(*(-n for n in self.usage()))
+                    parent.remove_child(self.name)
+
+                parent.fs.record("delete", self.full_path())
+
+            parent.fs.index.remove_tree(self)
+
+            return parent
+
+    def release(self) -> None:
+        # Drops shared content references of a deleted node
+        pass
+
+
+class Directory(Node):
+    __slots__ = ("entries", "fs", "lock", "clones", "nodes", "size", "quota")
+
+    def __init__(self, fs: FileSystem, parent: Directory | None, name: str):
+        if DELIMITER in name:
+            raise ValueError(f"Directory name contains {DELIMITER}")
+
+        super().__init__(parent, name)
+        # name -> node, dict keeps insertion order for ls/tree
+        self.entries: dict[str, Node] = {}
+        self.fs = fs
+        # Guards entries: create/move/delete write, listings read
+        self.lock = RWLock()
+        # Lazy clones that still have to copy this directory, see clone
+        self.clones: list[Directory] | None = None
+        # Rolled-up number of descendants and their bytes, see charge,
+        # and the (max nodes, max size) caps on them, see set_quota
+        self.nodes = 0
+        self.size = 0
+        self.quota: tuple[int | None, int | None] | None = None
+
+    @property
+    def childs(self) -> list[Node]:
+        if self.lazy:
+            self.materialize()
+
+        with self.lock.read():
+            return list(self.entries.values())
+
+    def iter_childs(self):
+        return iter(self.childs)
+
+    @property
+    def filesystem(self) -> FileSystem:
+        return self.fs
+
+    def get_child(self, name: str) -> Node | None:
+        return self.entries.get(name)
+
+    def add_child(self, node: Node) -> Node:
+        self.entries[node.name] = node
+        node.parent = self
+        self.fs.json_cache.pop(self, None)
+
+        return node
+
+    def usage(self) -> tuple[int, int]:
+        return 1 + self.nodes, self.size
+
+    def charge(self, nodes: int, size: int, stop: Directory | None = None, check: bool = True) -> None:
+        # Adds to the counters of self and its ancestors up to (not including)
+        # stop. Growing past a quota on the way raises before anything changes
+        if check and (nodes > 0 or size > 0) and self.has_quota(stop):
+            with self.fs.usage_lock:
+                self.check_quota(nodes, size, stop)
+                self.add_usage(nodes, size, stop)
+        else:
+            self.add_usage(nodes, size, stop)
+
+    def has_quota(self, stop: Directory | None = None) -> bool:
+        directory = self
+
+        while directory is not stop:
+            if directory.quota is not None:
+                return True
+
+            directory = directory.parent
+
+        return False
+
+    def add_usage(self, nodes: int, size: int, stop: Directory | None = None) -> None:
+        locks = self.fs.counter_locks
+        directory = self
+
+        while directory is not stop:
+            with locks[(id(directory) >> 4) % len(locks)]:
+                directory.nodes += nodes
+                directory.size += size
+
+            directory = directory.parent
+
+    def check_quota(self, nodes: int, size: int, stop: Directory | None = None) -> None:
+        directory = self
+
+        while directory is not stop:
+            quota = directory.quota
+
+            if quota is not None:
+                if quota[0] is not None and directory.nodes + nodes > quota[0]:
+                    raise ValueError(f"Quota of {directory.full_path()} allows {quota[0]} nodes")
+
+                if quota[1] is not None and directory.size + size > quota[1]:
+                    raise ValueError(f"Quota of {directory.full_path()} allows {quota[1]} bytes")
+
+            directory = directory.parent
+
+    def adopt(self, node: Node) -> Node:
+        # Caller holds self.lock: charges a new node and links it. A node that
+        # doesn't fit a quota is released instead
+        try:
+            self.charge(*node.usage())
+        except ValueError:
+            node.release()
+            raise
+
+        return self.add_child(node)
+
+    def set_quota(self, max_nodes: int | None = None, max_size: int | None = None) -> None:
+        # Caps the nodes below this directory and their bytes, None lifts a cap.
+        # A quota under the current usage only blocks further growth
+        if (max_nodes is not None and max_nodes < 0) or (max_size is not None and max_size < 0):
+            raise ValueError("Quota can't be negative")
+
+        with self.fs.mutating():
+            self.quota = None if max_nodes is None and max_size is None else (max_nodes, max_size)
+            self.fs.record("quota", self.full_path(), max_nodes, max_size)
+
+    def attach(self, node: Node, position: int | None = None) -> Node:
+        # Puts back a node detached by a rolled back transaction, at position
+        # of the listing when given
+        self.fs.unshare(self)
+
+        with self.fs.mutating(), self.lock.write():
+            self.can_create_file(node.name)
+            self.adopt(node)
+
+            if position is not None:
+                self.place(node.name, position)
+
+        self.fs.index.add_tree(node)
+
+        return node
+
+    def position(self, name: str) -> int:
+        # Index of the child name in the listing
+        with self.lock.read():
+            return list(self.entries).index(name)
+
+    def reorder(self, name: str, position: int) -> None:
+        # Moves the child name back to position, see Transaction.move
+        with self.fs.mutating(), self.lock.write():
+            self.place(name, position)
+
+    def place(self, name: str, position: int) -> None:
+        # Caller holds self.lock. Entries keep insertion order, so the
+        # childs after position are re-inserted behind name
+        entries = self.entries
+        node = entries.pop(name)
+        tail = [(child, entries.pop(child)) for child in list(entries)[position:]]
+        entries[name] = node
+        entries.update(tail)
+        self.fs.json_cache.pop(self, None)
+
+    def remove_child(self, name: str) -> Node:
+        node = self.entries.pop(name)
+        self.fs.generation = next(self.fs.generations)
+        self.fs.json_cache.pop(self, None)
+
+        return node
+
+    def to_json(self, limit: int | None = JSON_PAGE_SIZE, cursor: str | None = None, depth: int = 0) -> dict[str, Any]:
+        # A page of at most limit child names after the child named cursor;
+        # next_cursor and total are only added when the listing doesn't fit in
+        # one page. Childs are listed in insertion order, so creations and
+        # deletions while paging neither skip nor repeat a name
+        fragment, childs = self.json_fragment()
+        start, end = page_bounds(childs, limit, cursor)
+        page = childs[start:end]
+        result = dict(fragment, childs=list(page), nodes=self.nodes, size=self.size)
+
+        if self.quota is not None:
+            result["quota"] = {"nodes": self.quota[0], "size": self.quota[1]}
+
+        if start or end < len(childs):
+            result["total"] = len(childs)
+
+            if end < len(childs):
+                result["next_cursor"] = page[-1]
+
+        if depth > 0:
+            result["children"] = []
+
+            for name in page:
+                child = self.entries.get(name)
+
+                if child is not None:
+                    result["children"].append(child.to_json(limit, None, depth - 1))
+
+        return result
+
+    def __repr__(self):
+        return f"<DIR | Path: {DELIMITER.join([d.name for d in self.path]) if self.path else ''}/[ {self.name} ]>"
+
+    def move(self, filename: str, destination: str):
+        dest_dir = self.fs.get_node(destination)
+
+        target = self.entries.get(filename)
+
+        if target is None:
+            raise ValueError("File does not exist")
+        
+        if not dest_dir or not isinstance(dest_dir, Directory):
+            raise ValueError("Wrong destination path")
+
+        if dest_dir is self:
+            return dest_dir
+
+        # Moving a directory changes the paths below it, see FileSystem.barrier
+        barrier = self.fs.exclusive() if isinstance(target, Directory) else self.fs.mutating()
+        self.fs.unshare(self)
+        self.fs.unshare(dest_dir)
+
+        with barrier, write_locked(self, dest_dir), target.content_lock():
+            if self.entries.get(filename) is not target:
+                raise ValueError("File does not exist")
+
+            if isinstance(target, Directory) and dest_dir.is_inside(target):
+                raise ValueError("Can't move directory inside itself")
+
+            dest_dir.can_create_file(target.name)
+
+            # Only the counters below the closest common ancestor change
+            ancestors = set(self.path)
+            ancestors.add(self)
+            common = dest_dir
+
+            while common not in ancestors:
+                common = common.parent
+
+            nodes, size = target.usage()
+            dest_dir.charge(nodes, size, stop=common)
+            self.charge(-nodes, -size, stop=common)
+            self.remove_child(filename)
+            dest_dir.add_child(target)
+            target.moved = next(self.fs.generations)
+
+            self.fs.record("move", self.full_path(), filename, dest_dir.full_path())
+
+        return dest_dir
+
+    def copy(self, filename: str, destination: str) -> Directory:
+        # Content is shared with the source, only nodes are duplicated
+        dest_dir = self.fs.get_node(destination)
+
+        source = self.entries.get(filename)
+
+        if source is None:
+            raise ValueError("File does not exist")
+
+        if not dest_dir or not isinstance(dest_dir, Directory):
+            raise ValueError("Wrong destination path")
+
+        self.fs.unshare(dest_dir)
+
+        with self.fs.mutating(), dest_dir.lock.write():
+            dest_dir.can_create_file(source.name)
+            copy = dest_dir.adopt(source.duplicate(dest_dir))
+            self.fs.index.add_tree(copy)
+            self.fs.record("copy", self.full_path(), filename, dest_dir.full_path())
+
+        return dest_dir
+
+    def clone(self, destination: str) -> Directory:
+        # O(1) copy-on-write copy of this directory into destination: each
+        # level is copied on its first access from the clone, or right
+        # before it changes here, whichever comes first
+        dest_dir = self.fs.get_node(destination)
+
+        if not isinstance(dest_dir, Directory):
+            raise ValueError("Wrong destination path")
+
+        if self.parent is None:
+            raise ValueError("Can't clone root directory, use FileSystem.snapshot")
+
+        copy = Directory(dest_dir.fs, dest_dir, self.name)
+        self.share(copy)
+        self.fs.unshare(dest_dir)
+
+        try:
+            with self.fs.mutating(), dest_dir.lock.write():
+                dest_dir.can_create_file(copy.name)
+                dest_dir.charge(*copy.usage())
+                dest_dir.add_child(copy)
+                self.fs.record("clone", self.full_path(), dest_dir.full_path())
+        except ValueError:
+            copy.release()
+            raise
+
+        self.fs.index.add(copy)
+
+        return copy
+
+    @property
+    def lazy(self) -> bool:
+        return isinstance(self.entries, (LazyEntries, SpilledEntries))
+
+    def share(self, copy: Directory) -> None:
+        # Makes the empty directory copy a lazy clone of self
+        copy.entries = LazyEntries(copy, self)
+        copy.nodes, copy.size, copy.quota = self.nodes, self.size, self.quota
+
+        with self.fs.clone_lock:
+            if self.clones is None:
+                self.clones = []
+
+            self.clones.append(copy)
+            self.fs.pending_clones += 1
+
+        copy.fs.lazy_dirs.add(copy)
+
+    def unregister(self, copy: Directory) -> None:
+        # Caller holds self.fs.clone_lock
+        self.clones.remove(copy)
+        self.fs.pending_clones -= 1
+        copy.fs.lazy_dirs.discard(copy)
+
+    def materialize(self) -> dict[str, Node]:
+        # Copies one level of a lazy clone: files are duplicated (sharing
+        # content) and subdirectories become lazy clones themselves
+        entries = self.entries
+
+        if isinstance(entries, SpilledEntries):
+            return self.fault_in()
+
+        if not isinstance(entries, LazyEntries):
+            return entries
+
+        source = entries.source
+
+        with source.fs.clone_lock:
+            if self.entries is not entries:
+                return self.entries
+
+            materialized = {}
+
+            for child in source.childs:
+                if isinstance(child, Directory):
+                    copy = Directory(self.fs, self, child.name)
+                    child.share(copy)
+                else:
+                    copy = child.duplicate(self)
+
+                materialized[child.name] = copy
+
+            source.unregister(self)
+            self.entries = materialized
+
+        for child in materialized.values():
+            self.fs.index.add(child)
+
+        return materialized
+
+    def spill(self) -> int:
+        # Caller holds fs.barrier exclusively. Writes the subtree below self
+        # and its content to the spill store, and leaves SpilledEntries stubs
+        # behind, see fault_in. Returns the number of nodes spilled
+        fs = self.fs
+        childs = self.childs
+        records = []
+        nodes = []
+        stack = list(reversed(childs))
+
+        with fs.spill_lock:
+            while stack:
+                node = stack.pop()
+                nodes.append(node)
+
+                if isinstance(node, Directory):
+                    node_childs = node.childs
+                    records.append(("d", node.name, len(node_childs), node.quota, node.nodes, node.size))
+                    stack.extend(reversed(node_childs))
+                else:
+                    records.append(node.spill_record())
+
+            data = pickle.dumps((len(childs), records), protocol=pickle.HIGHEST_PROTOCOL)
+            offset = fs.spill_store.write(data)
+
+            for child in childs:
+                fs.index.remove_tree(child)
+
+            for node in nodes:
+                if isinstance(node, Directory):
+                    node.entries = SpilledEntries(node, self)
+
+            self.entries = SpilledEntries(self, self, offset, len(data), len(nodes), [weakref.ref(n) for n in nodes])
+            fs.spilled_nodes += len(nodes)
+            fs.spilled_dirs.add(self)
+            fs.generation = next(fs.generations)
+
+        return len(nodes)
+
+    def fault_in(self) -> dict[str, Node]:
+        # Rebuilds the subtree written by spill. Nodes that are still referenced
+        # somewhere are put back as they are, the others are created from records
+        fs = self.fs
+
+        with fs.spill_lock:
+            entries = self.entries
+
+            if not isinstance(entries, SpilledEntries):
+                return entries
+
+            if entries.top is not self:
+                # Below a spilled directory: bringing that one back reattaches self
+                entries.top.fault_in()
+
+                if self.entries is entries:
+                    # The spilled directory was deleted meanwhile
+                    self.entries = {}
+
+                return self.entries
+
+            count, records = pickle.loads(fs.spill_store.read(entries.offset, entries.length))
+            loaded: dict[str, Node] = {}
+            # [directory, its entries being built, records still to come]
+            stack = [[self, loaded, count]]
+
+            for i, record in enumerate(records):
+                parent, parent_entries = stack[-1][0], stack[-1][1]
+                stack[-1][2] -= 1
+                node = entries.live[i]()
+
+                if node is None:
+                    node = load_spilled(fs, parent, record)
+
+                node.parent = parent
+                parent_entries[node.name] = node
+
+                if record[0] == "d":
+                    stack.append([node, {}, record[2]])
+
+                while len(stack) > 1 and stack[-1][2] == 0:
+                    directory, directory_entries, _ = stack.pop()
+                    directory.entries = directory_entries
+
+            self.entries = loaded
+            fs.spilled_nodes -= entries.nodes
+            fs.spilled_dirs.discard(self)
+
+        for child in loaded.values():
+            fs.index.add_tree(child)
+
+        return loaded
+
+    def spilled_match(self, pattern: str, types: tuple[type, ...] | None = None) -> bool:
+        # True if a node spilled below self matches a find, read from the
+        # spill store without faulting the subtree in
+        fs = self.fs
+
+        with fs.spill_lock:
+            entries = self.entries
+
+            if not isinstance(entries, SpilledEntries) or entries.top is not self:
+                return False
+
+            count, records = pickle.loads(fs.spill_store.read(entries.offset, entries.length))
+
+        for record in records:
+            if fnmatchcase(record[1], pattern) and (not types or issubclass(SPILLED_TYPES[record[0]], types)):
+                return True
+
+        return False
+
+    def spilled_records(self) -> Iterator[tuple]:
+        # export_records of a spilled directory, read from the spill store
+        # without faulting it in
+        fs = self.fs
+        entries = self.entries
+        count, records = pickle.loads(fs.spill_store.read(entries.offset, entries.length))
+        yield ("d", self.name, count, self.quota)
+
+        for record in records:
+            if record[0] == "d":
+                yield record[:4]
+            elif record[0] == "b":
+                data = fs.content_store.expand(record[3])
+                yield ("b", record[1], str(data, "utf-8") if record[2] else data)
+            elif record[0] == "l":
+                yield ("l", record[1], "".join(fs.content_store.expand(chunk) for chunk in record[2]) + record[4])
+            else:
+                yield record
+
+    def duplicate(self, parent: Directory) -> Directory:
+        copy = Directory(self.fs, parent, self.name)
+        stack = [(self, copy)]
+        copies = []
+
+        while stack:
+            source, target = stack.pop()
+            target.quota = source.quota
+            copies.append(target)
+
+            for child in source.childs:
+                if isinstance(child, Directory):
+                    child_copy = Directory(self.fs, target, child.name)
+                    stack.append((child, child_copy))
+                else:
+                    child_copy = child.duplicate(target)
+
+                target.entries[child.name] = child_copy
+
+        # Subdirectories come after their parent, so reversed is bottom-up
+        for target in reversed(copies):
+            for child in target.entries.values():
+                nodes, size = child.usage()
+                target.nodes += nodes
+                target.size += size
+
+        return copy
+
+    def release(self) -> None:
+        stack = [self]
+
+        while stack:
+            directory = stack.pop()
+            entries = directory.entries
+
+            if isinstance(entries, SpilledEntries):
+                # Spilled content isn't reference counted, the file space is just left behind
+                with directory.fs.spill_lock:
+                    if directory.entries is entries:
+                        directory.fs.spilled_nodes -= entries.nodes
+                        directory.fs.spilled_dirs.discard(directory)
+                        directory.entries = {}
+                        continue
+
+            if directory.lazy:
+                with directory.entries.source.fs.clone_lock:
+                    if directory.lazy:
+                        directory.entries.source.unregister(directory)
+                        directory.entries = {}
+                        continue
+
+            # Clones of a deleted directory copy it before its content is released
+            with directory.fs.clone_lock:
+                while directory.clones:
+                    directory.clones[-1].materialize()
+
+            for child in directory.childs:
+                if isinstance(child, Directory):
+                    stack.append(child)
+                else:
+                    child.release()
+
+    def is_inside(self, directory: Directory) -> bool:
+        node = self
+
+        while node is not None:
+            if node is directory:
+                return True
+            node = node.parent
+
+        return False
+
+    def can_create_file(self, new_file_name: str) -> bool:
+        max_elems = self.fs.dir_max_elems
+
+        if max_elems is not None and len(self.entries) >= max_elems:
+            raise ValueError(f"Directory can't contain more than {max_elems} nodes")
+
+        if new_file_name in self.entries:
+            raise ValueError("File with that name already exists!")
+
+        return True
+
+    def create_directory(self, name: str) -> Directory:
+        self.fs.unshare(self)
+
+        with self.fs.mutating(), self.lock.write():
+            self.can_create_file(name)
+
+            directory = Directory(self.fs, self, name)
+            self.adopt(directory)
+            self.fs.index.add(directory)
+            self.fs.record("mkdir", self.full_path(), name)
+
+        return directory
+
+    def create_binary_file(self, name: str, information: str | bytes) -> BinaryFile:
+        self.fs.unshare(self)
+
+        with self.fs.mutating(), self.lock.write():
+            self.can_create_file(name)
+
+            file = BinaryFile(self, name, information)
+            self.adopt(file)
+            self.fs.index.add(file)
+            self.fs.record("mkbin", self.full_path(), name, information)
+
+        return file
+
+
+    def create_log_file(self, name: str, information: str = None) -> LogFile:
+        self.fs.unshare(self)
+
+        with self.fs.mutating(), self.lock.write():
+            self.can_create_file(name)
+
+            file = LogFile(self, name, information)
+            self.adopt(file)
+            self.fs.index.add(file)
+            self.fs.record("mklog", self.full_path(), name, information)
+
+        return file
+
+    def create_buffer(self, name: str, capacity: int = MAX_BUF_FILE_SIZE, mode: str = "lifo") -> BufferFile:
+        self.fs.unshare(self)
+
+        with self.fs.mutating(), self.lock.write():
+            self.can_create_file(name)
+
+            file = BufferFile(self, name, capacity, mode)
+            self.adopt(file)
+            self.fs.index.add(file)
+            self.fs.record("mkbuf", self.full_path(), name, capacity, mode)
+
+        return file
+
+    def import_records(self, records: list[tuple]) -> Node:
+        # Attaches a subtree exported by FileSystem.export_records, see ShardedFileSystem.move
+        self.fs.unshare(self)
+
+        with self.fs.mutating(), self.lock.write():
+            self.can_create_file(records[0][1])
+            self.check_quota(len(records), sum(record_size(record) for record in records))
+            node = self.fs.load_records(self, records)
+            self.fs.record("import", self.full_path(), records)
+
+        return node
+
+    def print_elements(self, lvl=0) -> None:
+        for depth, node in self.walk():
+            print("   "*(lvl+depth) + node.name)
+
+    def walk(self, max_depth: int | None = None, types: tuple[type, ...] | None = None,
+             prune: Callable[[Node], bool] | None = None) -> Iterator[tuple[int, Node]]:
+        # Pre-order (depth, node) of the descendants, with an explicit stack.
+        # types only filters what is yielded, prune(node) skips a whole subtree
+        stack = [iter(self.childs)]
+
+        while stack:
+            node = next(stack[-1], None)
+
+            if node is None:
+                stack.pop()
+                continue
+
+            if prune is not None and prune(node):
+                continue
+
+            depth = len(stack)
+
+            if types is None or isinstance(node, types):
+                yield depth, node
+
+            if isinstance(node, Directory) and (max_depth is None or depth < max_depth):
+                stack.append(iter(node.childs))
+
+    def get_node_helper(self, path: str) -> Node:
+        return self.fs.resolve(path, self)
+
+
+class BinaryFile(Node):
+    __slots__ = ("data", "text", "accessed")
+
+    def __init__(self, parent: Directory, name: str, information: str | bytes):
+        if DELIMITER in name:
+            raise ValueError(f"BinaryFile name contains {DELIMITER}")
+            
+        super().__init__(parent, name)
+        # str content is kept encoded and handed back as str
+        self.text = isinstance(information, str)
+        self.data = parent.fs.content_store.acquire(information.encode() if self.text else bytes(information))
+        self.accessed = time.monotonic()
+
+    def __repr__(self):
+        return f"<BIN | Path: {DELIMITER.join([d.name for d in self.path]) if self.path else ''}/[ {self.name} ]>"
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def usage(self) -> tuple[int, int]:
+        return 1, len(self.data)
+
+    @property
+    def information(self) -> str | bytes:
+        return self.read()
+
+    def read(self) -> str | bytes:
+        data = self.content()
+
+        return str(data, "utf-8") if self.text else bytes(data)
+
+    def view(self, offset: int = 0, length: int | None = None) -> memoryview:
+        # Zero-copy slice of the content
+        data = self.content()
+        end = len(data) if length is None else min(len(data), offset + length)
+
+        return memoryview(data)[offset:end]
+
+    def content(self) -> bytes | memoryview:
+        self.accessed = time.monotonic()
+        data = self.data
+
+        if type(data) is Compressed or type(data) is Spilled:
+            return self.filesystem.content_store.expand(data)
+
+        return data
+
+    def compress_cold(self, cutoff: float, codec: str) -> int:
+        # Compressed when not read since cutoff, the swap happens under the
+        # parent lock so a concurrent delete releases one or the other
+        data = self.data
+
+        if self.accessed > cutoff:
+            return 0
+
+        content_store = self.filesystem.content_store
+        compressed = content_store.pack(data, codec)
+        parent = self.parent
+
+        if compressed is None or parent is None:
+            return 0
+
+        # The barrier keeps evict from spilling it meanwhile
+        with self.filesystem.mutating(), parent.lock.read():
+            if parent.entries.get(self.name) is not self or self.data is not data:
+                return 0
+
+            self.data = content_store.replace(data, compressed)
+
+        return 1
+
+    def spill_content(self) -> None:
+        # Caller holds fs.barrier exclusively, see FileSystem.evict
+        content_store = self.filesystem.content_store
+
+        if type(self.data) is not Spilled:
+            self.data = content_store.replace(self.data, content_store.spill(self.data))
+
+    def spill_record(self) -> tuple:
+        self.spill_content()
+
+        return ("b", self.name, self.text, self.data)
+
+    def duplicate(self, parent: Directory) -> BinaryFile:
+        copy = BinaryFile.__new__(BinaryFile)
+        Node.__init__(copy, parent, self.name)
+        copy.text = self.text
+        copy.data = parent.fs.content_store.acquire(self.data)
+        copy.accessed = self.accessed
+
+        return copy
+
+    def release(self) -> None:
+        self.filesystem.content_store.release(self.data)
+
+
+class LogFile(Node):
+    __slots__ = ("chunks", "chunk_offsets", "chunk_accessed", "pending", "pending_size", "size", "line_starts", "lock")
+
+    def __init__(self, parent: Directory, name: str, information: str = ""):
+        if DELIMITER in name:
+            raise ValueError(f"LogFile name contains {DELIMITER}")
+            
+        super().__init__(parent, name)
+        # Content is kept as sealed chunks of ~LOG_CHUNK_SIZE characters
+        # plus a list of pending appends that gets sealed once it is big enough
+        self.chunks: list[str | Compressed] = []
+        self.chunk_offsets = array("Q")
+        # When each chunk was sealed or last read, see compress_cold
+        self.chunk_accessed = array("d")
+        self.pending: list[str] = []
+        self.pending_size = 0
+        self.size = 0
+        # Offsets at which each line starts
+        self.line_starts = array("Q", [0])
+        self.lock = RWLock()
+
+        if information:
+            self.extend(information)
+
+    def __repr__(self):
+        return f"<LOG | Path: {DELIMITER.join([d.name for d in self.path]) if self.path else ''}/[ {self.name} ]>"
+
+    def usage(self) -> tuple[int, int]:
+        return 1, self.size
+
+    def content_lock(self):
+        return self.lock.write()
+
+    @property
+    def information(self) -> str:
+        return self.read()
+
+    def read(self, offset: int = 0, length: int | None = None) -> str:
+        with self.lock.read():
+            return self.read_range(offset, length)
+
+    def read_range(self, offset: int, length: int | None) -> str:
+        # Caller holds self.lock
+        if offset < 0:
+            offset = max(0, self.size + offset)
+
+        end = self.size if length is None else min(self.size, offset + length)
+
+        if offset >= end:
+            return ""
+
+        parts = []
+        i = max(0, bisect_right(self.chunk_offsets, offset) - 1)
+
+        if i < len(self.chunks) and self.chunk_offsets[i] < end:
+            now = time.monotonic()
+
+        while i < len(self.chunks) and self.chunk_offsets[i] < end:
+            start = self.chunk_offsets[i]
+            chunk = self.chunks[i]
+
+            if type(chunk) is Compressed or type(chunk) is Spilled:
+                chunk = self.filesystem.content_store.expand(chunk)
+
+            self.chunk_accessed[i] = now
+            parts.append(chunk[max(0, offset - start):end - start])
+            i += 1
+
+        pending_start = self.size - self.pending_size
+
+        if end > pending_start:
+            if len(self.pending) > 1:
+                self.pending = ["".join(self.pending)]
+
+            parts.append(self.pending[0][max(0, offset - pending_start):end - pending_start])
+
+        return "".join(parts)
+
+    def tail(self, lines: int) -> str:
+        if lines <= 0:
+            return ""
+
+        with self.lock.read():
+            # A trailing newline does not start a new line
+            count = len(self.line_starts)
+            if self.line_starts[-1] == self.size:
+                count -= 1
+
+            return self.read_range(self.line_starts[max(0, count - lines)], None)
+
+    def append(self, information: str) -> int:
+        fs = self.filesystem
+        fs.unshare(self.parent)
+
+        with fs.mutating(), self.lock.write():
+            self.parent.charge(0, len(information))
+            size = self.extend(information)
+            fs.record("append", self.full_path(), information)
+
+            return size
+
+    def extend(self, information: str) -> int:
+        # Caller holds self.lock
+        start = self.size
+        pos = information.find("\n")
+
+        while pos != -1:
+            self.line_starts.append(start + pos + 1)
+            pos = information.find("\n", pos + 1)
+
+        self.pending.append(information)
+        self.pending_size += len(information)
+        self.size += len(information)
+
+        if self.pending_size >= LOG_CHUNK_SIZE:
+            self.seal()
+
+        return self.size
+
+    def truncate(self, size: int) -> None:
+        # Drops content past size, used to roll back appends
+        fs = self.filesystem
+        fs.unshare(self.parent)
+
+        with fs.mutating(), self.lock.write():
+            if size >= self.size:
+                return
+
+            i = max(0, bisect_right(self.chunk_offsets, size) - 1)
+
+            if i < len(self.chunks) and self.chunk_offsets[i] + len(self.chunks[i]) <= size:
+                i += 1
+
+            start = self.chunk_offsets[i] if i < len(self.chunks) else self.size - self.pending_size
+            kept = self.read_range(start, size - start)
+            content_store = self.filesystem.content_store
+
+            for chunk in self.chunks[i:]:
+                content_store.release(chunk)
+
+            del self.chunks[i:]
+            del self.chunk_offsets[i:]
+            del self.chunk_accessed[i:]
+            del self.line_starts[bisect_right(self.line_starts, size):]
+            self.pending = [kept] if kept else []
+            self.pending_size = len(kept)
+            self.parent.charge(0, size - self.size)
+            self.size = size
+
+    def seal(self) -> None:
+        # Caller holds self.lock
+        if not self.pending:
+            return
+
+        self.chunk_offsets.append(self.size - self.pending_size)
+        self.chunk_accessed.append(time.monotonic())
+        self.chunks.append(self.filesystem.content_store.acquire("".join(self.pending)))
+        self.pending = []
+        self.pending_size = 0
+
+    def compress_cold(self, cutoff: float, codec: str) -> int:
+        # Sealed chunks not read since cutoff are compressed one at a time
+        # outside the lock, appends only ever touch the pending part
+        content_store = self.filesystem.content_store
+
+        with self.lock.read():
+            cold = [(i, chunk) for i, chunk in enumerate(self.chunks)
+                    if self.chunk_accessed[i] <= cutoff and type(chunk) is not Compressed]
+
+        compressed = 0
+
+        for i, chunk in cold:
+            packed = content_store.pack(chunk, codec)
+            parent = self.parent
+
+            if packed is None or parent is None:
+                continue
+
+            # Same order as detach, a deleted file is skipped
+            with self.filesystem.mutating(), parent.lock.read(), self.lock.write():
+                if parent.entries.get(self.name) is not self or i >= len(self.chunks) or self.chunks[i] is not chunk:
+                    continue
+
+                self.chunks[i] = content_store.replace(chunk, packed)
+                compressed += 1
+
+        return compressed
+
+    def spill_content(self) -> None:
+        # Caller holds fs.barrier exclusively, see FileSystem.evict. The
+        # pending part stays, it is at most LOG_CHUNK_SIZE
+        content_store = self.filesystem.content_store
+
+        with self.lock.write():
+            for i, chunk in enumerate(self.chunks):
+                if type(chunk) is not Spilled:
+                    self.chunks[i] = content_store.replace(chunk, content_store.spill(chunk))
+
+    def spill_record(self) -> tuple:
+        self.spill_content()
+
+        with self.lock.read():
+            return ("l", self.name, list(self.chunks), self.chunk_offsets.tobytes(), "".join(self.pending),
+                    self.size, self.line_starts.tobytes())
+
+    def duplicate(self, parent: Directory) -> LogFile:
+        copy = LogFile(parent, self.name)
+        content_store = parent.fs.content_store
+
+        with self.lock.read():
+            copy.chunks = [content_store.acquire(chunk) for chunk in self.chunks]
+            copy.chunk_offsets = array("Q", self.chunk_offsets)
+            copy.chunk_accessed = array("d", self.chunk_accessed)
+            copy.pending = list(self.pending)
+            copy.pending_size = self.pending_size
+            copy.size = self.size
+            copy.line_starts = array("Q", self.line_starts)
+
+        return copy
+
+    def release(self) -> None:
+        content_store = self.filesystem.content_store
+
+        for chunk in self.chunks:
+            content_store.release(chunk)
+
+
+def page_bounds(childs: Sequence[str], limit: int | None, cursor: str | None) -> tuple[int, int]:
+    # Slice of the page after the child named cursor, see Directory.to_json
+    start = 0
+
+    if cursor is not None:
+        try:
+            start = childs.index(cursor) + 1
+        except ValueError:
+            raise ValueError(f"Cursor {cursor} is not listed anymore, restart the listing")
+
+    return start, len(childs) if limit is None else min(len(childs), start + limit)
+
+
+def wait_on(condition: threading.Condition, predicate, timeout: float | None) -> bool:
+    # timeout None/0 keeps the non-blocking behaviour
+    if timeout:
+        return condition.wait_for(predicate, timeout)
+
+    return predicate()
+
+
+async def wait_future(future: asyncio.Future, timeout: float) -> None:
+    try:
+        await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        pass
+
+
+def item_size(item: Any) -> int:
+    # Bytes a BufferFile item counts for in the Directory counters
+    if isinstance(item, (str, bytes, bytearray)):
+        return len(item)
+
+    return len(str(item))
+
+
+def load_spilled(fs: FileSystem, parent: Directory, record: tuple) -> Node:
+    # A node of a spilled subtree that nothing referenced anymore, see Directory.fault_in
+    kind, name = record[0], record[1]
+
+    if kind == "d":
+        node = Directory(fs, parent, name)
+        node.quota, node.nodes, node.size = record[3], record[4], record[5]
+    elif kind == "b":
+        node = BinaryFile.__new__(BinaryFile)
+        Node.__init__(node, parent, name)
+        node.text, node.data, node.accessed = record[2], record[3], 0.0
+    elif kind == "l":
+        node = LogFile(parent, name)
+        node.chunks = record[2]
+        node.chunk_offsets.frombytes(record[3])
+        node.chunk_accessed = array("d", [0.0] * len(node.chunks))
+        node.pending = [record[4]] if record[4] else []
+        node.pending_size = len(record[4])
+        node.size = record[5]
+        node.line_starts = array("Q")
+        node.line_starts.frombytes(record[6])
+    else:
+        node = BufferFile(parent, name, record[2], record[3])
+        node.load(record[4])
+
+    return node
+
 
-    def change_working_directory(self, path):
-        dest = self.get_node(path)
-        
-        if not isinstance(dest, Directory):
-            raise ValueError("Destination is not a directory")
+def check_import_name(name: str) -> str:
+    # Host and archive names become node names, these would not resolve back
+    if name in ("", ".", "..", "~") or DELIMITER in name:
+        raise ValueError(f"Can't import a node named {name!r}")
 
-        self.cwd = dest
+    return name
 
-    def print_cwd(self):
-        for c in self.cwd.childs:
-            print(c)
 
-    def string_to_path(self, string: str) -> list[Node]:
-        return [self.cwd] + self.cwd.string_to_path(string, [])
+def read_host_files(paths: list[str]) -> list[bytes]:
+    # One thread pool task of FileSystem.import_path. Plain os.read, open() and
+    # readall cost twice as much per small file
+    contents = []
 
-    def path_to_string(self, path: list[Node]) -> str:
-        return DELIMITER.join(path)
+    for path in paths:
+        try:
+            fd = os.open(path, os.O_RDONLY)
 
-    def get_node(self, path) -> Node:
-        return self.cwd.get_node_helper(path)
+            try:
+                data = os.read(fd, IMPORT_READ_SIZE)
 
-    def create_directory(self, path: str, name: str) -> Directory:
-        dest_dir = self.get_node(path)
-        return dest_dir.create_directory(name)
+                if len(data) == IMPORT_READ_SIZE:
+                    parts = [data]
 
-    def create_binary_file(self, path: str, name: str, information: str) -> BinaryFile:
-        dest_dir = self.get_node(path)
-        return dest_dir.create_binary_file(name, information)
+                    while chunk := os.read(fd, IMPORT_READ_SIZE):
+                        parts.append(chunk)
 
-    def create_log_file(self, path: str, name: str, information: str = None) -> LogFile:
-        dest_dir = self.get_node(path)
-        return dest_dir.create_log_file(name, information)
+                    data = b"".join(parts)
+            finally:
+                os.close(fd)
+        except OSError as e:
+            raise ValueError(f"Can't read {path}: {e.strerror}")
 
-    def create_buffer(self, path: str, name: str) -> BufferFile:
-        dest_dir = self.get_node(path)
-        return dest_dir.create_buffer(name)
+        contents.append(data)
 
-    def print_elements(self) -> None:
-        print(self.cwd.name)
-        self.cwd.print_elements(lvl=0)
+    return contents
 
 
-class Node():
-    def __init__(self, path: list[Node], name: str):
-        self.path = path
-        self.name = name
+def host_record(name: str, data: bytes) -> tuple:
+    # *.log files that decode become LogFiles, anything else a BinaryFile of bytes
+    if name.endswith(".log"):
+        try:
+            return ("l", name, data.decode())
+        except UnicodeDecodeError:
+            pass
 
-    def delete(self):
-        parent = self.path[-1]
-        parent.childs.pop(parent.childs.index(self))
+    return ("b", name, data)
 
 
-class Directory(Node):
-    def __init__(self, fs: FileSystem, path: list[Node], name: str):
-        if DELIMITER in name:
-            raise ValueError(f"Directory name contains {DELIMITER}")
+def tar_record(name: str, data: bytes, headers: dict[str, str]) -> tuple:
+    # Record of an archive member, typed by the PYFS.type pax header of tar_blocks
+    kind = headers.get("PYFS.type")
 
-        super().__init__(path, name)
-        self.childs = []
-        self.fs = fs
+    if kind == "text":
+        return ("b", name, data.decode())
 
-    def __repr__(self):
-        return f"<DIR | Path: {DELIMITER.join([d.name for d in self.path]) if self.path else ''}/[ {self.name} ]>"
+    if kind == "log":
+        return ("l", name, data.decode())
 
-    def move(self, filename: str, destination: str):
-        dest_dir = self.fs.get_node(destination)
+    if kind == "buffer":
+        capacity = int(headers.get("PYFS.capacity", MAX_BUF_FILE_SIZE))
+        mode = headers.get("PYFS.mode", "lifo")
+        items = json.loads(data)
 
-        target = None
+        if capacity < 1 or mode not in BUFFER_MODES or not isinstance(items, list) or len(items) > capacity:
+            raise ValueError(f"{name} is not a valid BufferFile")
 
-        for c in self.childs:
-            if c.name == filename:
-                target = c
+        return ("q", name, capacity, mode, items)
 
-        if target is None:
-            raise ValueError("File does not exist")
-        
-        if not dest_dir or not isinstance(dest_dir, Directory):
-            raise ValueError("Wrong destination path")
+    return host_record(name, data)
 
-        self.childs.remove(target)
-        dest_dir.childs.append(target)
 
-    def can_create_file(self, new_file_name: str) -> bool:
-        if len(self.childs) == DIR_MAX_ELEMS:
-            raise ValueError(f"Directory can't contain more than {DIR_MAX_ELEMS} nodes")
+def tar_blocks(fs: FileSystem, node: Node) -> Iterator[bytes]:
+    # Headers, contents and padding of the tar members of node's subtree.
+    # The root itself has no member, its childs are the top level entries
+    mtime = int(time.time())
+    stack: list[list] = []
+    skip_root = node.parent is None
 
-        for child in self.childs:
-            if child.name == new_file_name:
-                raise ValueError("File with that name already exists!")
+    for record in fs.export_records(node):
+        kind, name = record[0], record[1]
 
-        return True
+        if skip_root:
+            stack.append(["", record[2]])
+            skip_root = False
+            continue
 
-    def create_directory(self, name: str) -> Directory:
-        self.can_create_file(name)
-        self.childs.append(Directory(self.fs, self.path + [self], name))
+        member = tarfile.TarInfo(stack[-1][0] + name if stack else name)
+        member.mtime = mtime
 
-    def create_binary_file(self, name: str, information: str) -> BinaryFile:
-        self.can_create_file(name)
+        if stack:
+            stack[-1][1] -= 1
 
-        file = BinaryFile(self.path + [self], name, information)
-        self.childs.append(file)
+        if kind == "d":
+            member.type = tarfile.DIRTYPE
+            member.mode = 0o755
+            data = b""
 
-        return file
+            if record[3] is not None:
+                member.pax_headers["PYFS.quota"] = ",".join("-" if limit is None else str(limit) for limit in record[3])
 
+            stack.append([member.name + DELIMITER, record[2]])
+        elif kind == "b":
+            data = record[2].encode() if isinstance(record[2], str) else record[2]
 
-    def create_log_file(self, name: str, information: str = None) -> LogFile:
-        self.can_create_file(name)
+            if isinstance(record[2], str):
+                member.pax_headers["PYFS.type"] = "text"
+        elif kind == "l":
+            data = record[2].encode()
+            member.pax_headers["PYFS.type"] = "log"
+        else:
+            data = json.dumps(record[4], default=str).encode()
+            member.pax_headers.update({"PYFS.type": "buffer", "PYFS.capacity": str(record[2]), "PYFS.mode": record[3]})
 
-        file = LogFile(self.path + [self], name, information)
-        self.childs.append(file)
+        member.size = len(data)
+        yield tar_header(member)
 
-        return file
+        if data:
+            yield data
+            yield bytes(-len(data) % tarfile.BLOCKSIZE)
 
-    def create_buffer(self, name: str) -> BufferFile:
-        self.can_create_file(name)
+        while stack and stack[-1][1] == 0:
+            stack.pop()
 
-        file = BufferFile(self.path + [self], name)
-        self.childs.append(file)
 
-        return file
+def tar_header(member: tarfile.TarInfo) -> bytes:
+    # TarInfo.tobuf is slow, a member without pax headers and with a short
+    # name gets its ustar header packed directly
+    name = (member.name + "/" if member.isdir() else member.name).encode()
 
-    def print_elements(self, lvl=0) -> None:
-        for child in self.childs:
-            print("   "*(lvl+1) + child.name)
-            
-            if isinstance(child, Directory):
-                child.print_elements(lvl+1)
+    if member.pax_headers or len(name) > 100 or member.size >= 8**11:
+        return member.tobuf(tarfile.PAX_FORMAT)
 
-    def string_to_path(self, string: str, path: list[Node]) -> list[Node]:
-        print(f"string_to_path | {string} || {path}")
-        if len(string) == 0:
-            return path
+    header = bytearray(TAR_HEADER.pack(
+        name, b"%07o\0" % member.mode, b"0000000\0", b"0000000\0", b"%011o\0" % member.size,
+        b"%011o\0" % member.mtime, b" " * 8, member.type, b"", b"ustar\0", b"00", b"", b"",
+        b"", b"", b"", b""))
+    header[148:156] = b"%06o\0 " % sum(header)
 
-        string_split = [s.strip() for s in string.split(DELIMITER)]
-        search_node = string_split[0]
+    return bytes(header)
 
-        if search_node == "..":
-            path.pop()
-            return self.path[-1].string_to_path('/'.join(string_split[1:]), path)
 
-        elif search_node == "~":
-            path = [self.path[0]]
-            return self.path[0].string_to_path('/'.join(string_split[1:]), path)
-        
-        elif search_node == '.':
-            return self.string_to_path('/'.join(string_split[1:]), path)
+def tar_stream(fs: FileSystem, node: Node, compression: str | None) -> Iterator[bytes]:
+    # Body of FileSystem.export_tar
+    if compression == "gz":
+        compressor = zlib.compressobj(wbits=31)
+    elif compression == "xz":
+        compressor = lzma.LZMACompressor()
+    else:
+        compressor = None
 
-        for node in self.childs:
-            if node.name == search_node:
-                if not isinstance(node, Directory):
-                    raise ValueError("Destination is not a directory")
+    def output(data: bytes) -> Iterator[bytes]:
+        view = memoryview(data)
 
-                path.append(node)
-                return node.string_to_path('/'.join(string_split[1:]), path)
+        for offset in range(0, len(view), TAR_CHUNK_SIZE):
+            chunk = bytes(view[offset:offset + TAR_CHUNK_SIZE])
+            chunk = compressor.compress(chunk) if compressor is not None else chunk
 
-        raise ValueError("Wrong path")
+            if chunk:
+                yield chunk
 
-    def get_node_helper(self, path):
-        target_dir_name = path.split(DELIMITER)[0]
-        target = None
+    pending: list[bytes] = []
+    size = written = 0
 
-        if target_dir_name == '.':
-            target = self
-        elif target_dir_name == '..':
-            target = self.path[-1]
-        elif target_dir_name == '~':
-            target = self.fs.root
+    for block in tar_blocks(fs, node):
+        pending.append(block)
+        size += len(block)
+        written += len(block)
 
-        for c in self.childs:
-            if c.name == target_dir_name:
-                target = c
+        if size >= TAR_CHUNK_SIZE:
+            yield from output(b"".join(pending))
+            pending, size = [], 0
 
-        if target is None:
-            raise ValueError("Wrong path")
+    # End of archive: two zero blocks, padded to a whole record like tarfile does
+    written += 2 * tarfile.BLOCKSIZE
+    pending.append(bytes(2 * tarfile.BLOCKSIZE + -written % tarfile.RECORDSIZE))
+    yield from output(b"".join(pending))
 
-        if DELIMITER in path:
-            return target.get_node_helper(DELIMITER.join(path.split(DELIMITER)[1:]))
-        else:
-            return target
+    if compressor is not None:
+        yield compressor.flush()
 
 
-class BinaryFile(Node):
-    def __init__(self, path: list[Node], name: str, information: str):
-        if DELIMITER in name:
-            raise ValueError(f"BinaryFile name contains {DELIMITER}")
-            
-        super().__init__(path, name)
-        self.information = information
+def record_size(record: tuple) -> int:
+    # Bytes of a node exported by FileSystem.export_records
+    if record[0] == "b":
+        return len(record[2].encode()) if isinstance(record[2], str) else len(record[2])
 
-    def __repr__(self):
-        return f"<BIN | Path: {DELIMITER.join([d.name for d in self.path]) if self.path else ''}/[ {self.name} ]>"
+    if record[0] == "l":
+        return len(record[2])
 
-    def read(self) -> None:
-        return self.information
+    if record[0] == "q":
+        return sum(item_size(item) for item in record[4])
 
+    return 0
 
-class LogFile(Node):
-    def __init__(self, path: list[Node], name: str, information: str = ""):
-        if DELIMITER in name:
-            raise ValueError(f"LogFile name contains {DELIMITER}")
-            
-        super().__init__(path, name)
-        self.information = information
 
-    def __repr__(self):
-        return f"<LOG | Path: {DELIMITER.join([d.name for d in self.path]) if self.path else ''}/[ {self.name} ]>"
+def resolve_future(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
 
-    def read(self) -> str:
-        return self.information
+def wake_waiters(waiters: list[tuple[asyncio.AbstractEventLoop, asyncio.Future]]) -> None:
+    for loop, waiter in waiters:
+        # Timed out waiters are already done, their loop may be gone
+        if not waiter.done() and not loop.is_closed():
+            loop.call_soon_threadsafe(resolve_future, waiter)
 
-    def append(self, information: str) -> str:
-        self.information += information
+    waiters.clear()
 
 
 class BufferFile(Node):
-    def __init__(self, path: list[Node], name: str):
+    __slots__ = ("ring", "capacity", "mode", "head", "count", "used", "lock", "not_empty", "not_full", "getters", "putters")
+
+    def __init__(self, parent: Directory, name: str, capacity: int = MAX_BUF_FILE_SIZE, mode: str = "lifo"):
         if DELIMITER in name:
             raise ValueError(f"BufferFile name contains {DELIMITER}")
+
+        if capacity < 1:
+            raise ValueError("BufferFile capacity must be positive")
+
+        if mode not in BUFFER_MODES:
+            raise ValueError(f"BufferFile mode must be one of {', '.join(BUFFER_MODES)}")
             
-        super().__init__(path, name)
-        self.items = []
+        super().__init__(parent, name)
+        # Preallocated ring, items live in ring[head:head+count] (wrapping)
+        self.ring: list[Any] = [None] * capacity
+        self.capacity = capacity
+        self.mode = mode
+        self.head = 0
+        self.count = 0
+        # Bytes of the queued items, see item_size
+        self.used = 0
+
+        # Blocking waiters use the conditions, asyncio waiters park a future
+        # in getters/putters that is resolved from whichever thread changes the buffer
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.not_full = threading.Condition(self.lock)
+        self.getters: list[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+        self.putters: list[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    def to_json(self, limit: int | None = JSON_PAGE_SIZE, cursor: str | None = None, depth: int = 0) -> dict[str, Any]:
+        return dict(self.json_fragment()[0], length=self.count)
 
     def __repr__(self):
         return f"<BUF | Path: {DELIMITER.join([d.name for d in self.path]) if self.path else ''}/[ {self.name} ]>"
 
-    def push(self, element: Any) -> bool:
-        if len(self.items) == MAX_BUF_FILE_SIZE:
+    def __len__(self) -> int:
+        return self.count
+
+    def usage(self) -> tuple[int, int]:
+        return 1, self.used
+
+    def content_lock(self):
+        return self.lock
+
+    @property
+    def items(self) -> list[Any]:
+        # Oldest to newest
+        with self.lock:
+            return self.ordered_items()
+
+    def duplicate(self, parent: Directory) -> BufferFile:
+        copy = BufferFile(parent, self.name, self.capacity, self.mode)
+
+        with self.lock:
+            items = self.ordered_items()
+
+        copy.load(items)
+
+        return copy
+
+    def load(self, items: list[Any]) -> None:
+        # Fills a new, not yet attached buffer
+        self.ring[:len(items)] = items
+        self.count = len(items)
+        self.used = sum(item_size(item) for item in items)
+
+    def spill_record(self) -> tuple:
+        # Caller holds fs.barrier exclusively and fs.spill_lock, the buffer lock
+        # comes last like in every other path, see FileSystem.barrier
+        with self.lock:
+            return ("q", self.name, self.capacity, self.mode, self.ordered_items())
+
+    def ordered_items(self) -> list[Any]:
+        # Caller holds self.lock (or the filesystem barrier)
+        return [self.ring[(self.head + i) % self.capacity] for i in range(self.count)]
+
+    @contextmanager
+    def ready(self, condition: threading.Condition, predicate: Callable[[], bool], timeout: float | None):
+        # Holds the barrier, then self.lock, like every mutation, and yields
+        # whether predicate holds. A blocking wait holds only self.lock, so a
+        # checkpoint or an eviction doesn't wait for a parked push or pop
+        fs = self.filesystem
+        deadline = time.monotonic() + timeout if timeout else None
+
+        while True:
+            with fs.mutating(), self.lock:
+                if deadline is None or predicate() or time.monotonic() >= deadline:
+                    yield predicate()
+                    return
+
+            with self.lock:
+                condition.wait_for(predicate, deadline - time.monotonic())
+
+    def push(self, element: Any, timeout: float | None = None) -> int:
+        self.filesystem.unshare(self.parent)
+
+        with self.ready(self.not_full, lambda: self.count < self.capacity, timeout) as ready:
+            if not ready:
+                raise ValueError("BufferFile size reached limit")
+
+            return self.insert([element])
+
+    def push_many(self, elements: list[Any], timeout: float | None = None) -> int:
+        if len(elements) > self.capacity:
             raise ValueError("BufferFile size reached limit")
 
-        self.items.append(element)
+        self.filesystem.unshare(self.parent)
+
+        with self.ready(self.not_full, lambda: self.count + len(elements) <= self.capacity, timeout) as ready:
+            if not ready:
+                raise ValueError("BufferFile size reached limit")
+
+            return self.insert(elements)
+
+    def pop(self, timeout: float | None = None) -> Any:
+        self.filesystem.unshare(self.parent)
+
+        with self.ready(self.not_empty, lambda: self.count > 0, timeout) as ready:
+            if not ready:
+                raise ValueError("Can't get items from an empty BufferFile")
+
+            return self.remove(1)[0]
+
+    def pop_many(self, count: int, timeout: float | None = None) -> list[Any]:
+        self.filesystem.unshare(self.parent)
+
+        with self.ready(self.not_empty, lambda: self.count > 0, timeout):
+            return self.remove(min(count, self.count))
+
+    async def apush(self, element: Any, timeout: float | None = None) -> int:
+        # The locked step can wait on the barrier and runs in the default
+        # executor, only the wait for room parks on the loop
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (timeout or 0)
+
+        while True:
+            remaining = deadline - loop.time()
+            waiter = loop.create_future() if remaining > 0 else None
+            done, count = await asyncio.to_thread(self.push_or_park, element, loop, waiter)
+
+            if done:
+                return count
+
+            if waiter is None:
+                raise ValueError("BufferFile size reached limit")
+
+            await wait_future(waiter, remaining)
+
+    async def apop(self, timeout: float | None = None) -> Any:
+        # See apush
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (timeout or 0)
+
+        while True:
+            remaining = deadline - loop.time()
+            waiter = loop.create_future() if remaining > 0 else None
+            done, element = await asyncio.to_thread(self.pop_or_park, loop, waiter)
+
+            if done:
+                return element
+
+            if waiter is None:
+                raise ValueError("Can't get items from an empty BufferFile")
+
+            await wait_future(waiter, remaining)
+
+    def push_or_park(self, element: Any, loop: asyncio.AbstractEventLoop, waiter: asyncio.Future | None) -> tuple[bool, int]:
+        # (pushed, count), a full buffer registers waiter to be woken by a pop
+        fs = self.filesystem
+        fs.unshare(self.parent)
+
+        with fs.mutating(), self.lock:
+            if self.count < self.capacity:
+                return True, self.insert([element])
+
+            if waiter is not None:
+                self.putters.append((loop, waiter))
+
+            return False, self.count
+
+    def pop_or_park(self, loop: asyncio.AbstractEventLoop, waiter: asyncio.Future | None) -> tuple[bool, Any]:
+        # (popped, element), an empty buffer registers waiter to be woken by a push
+        fs = self.filesystem
+        fs.unshare(self.parent)
+
+        with fs.mutating(), self.lock:
+            if self.count > 0:
+                return True, self.remove(1)[0]
+
+            if waiter is not None:
+                self.getters.append((loop, waiter))
+
+            return False, None
+
+    def insert(self, elements: list[Any]) -> int:
+        # Caller holds the barrier (fs.mutating) and self.lock
+        size = sum(item_size(element) for element in elements)
+        self.parent.charge(0, size)
+        self.used += size
+
+        for element in elements:
+            self.put(element)
+
+        self.filesystem.record("push", self.full_path(), elements)
+
+        return self.count
+
+    def remove(self, count: int) -> list[Any]:
+        # Caller holds the barrier (fs.mutating) and self.lock
+        elements = [self.take() for _ in range(count)]
+
+        if elements:
+            size = sum(item_size(element) for element in elements)
+            self.parent.charge(0, -size)
+            self.used -= size
+            self.filesystem.record("pop", self.full_path(), len(elements))
+
+        return elements
+
+    def drop(self, count: int) -> None:
+        # Removes the count newest items, used to roll back a push
+        fs = self.filesystem
+        fs.unshare(self.parent)
+
+        with fs.mutating(), self.lock:
+            size = 0
+
+            for _ in range(min(count, self.count)):
+                self.count -= 1
+                index = (self.head + self.count) % self.capacity
+                size += item_size(self.ring[index])
+                self.ring[index] = None
+
+            self.parent.charge(0, -size)
+            self.used -= size
+
+            self.not_full.notify_all()
+            wake_waiters(self.putters)
+
+    def put(self, element: Any) -> None:
+        # Caller holds self.lock
+        self.ring[(self.head + self.count) % self.capacity] = element
+        self.count += 1
+
+        self.not_empty.notify_all()
+        wake_waiters(self.getters)
+
+    def take(self) -> Any:
+        # Caller holds self.lock
+        if self.mode == "fifo":
+            index = self.head
+            self.head = (self.head + 1) % self.capacity
+        else:
+            index = (self.head + self.count - 1) % self.capacity
+
+        element = self.ring[index]
+        self.ring[index] = None
+        self.count -= 1
+
+        self.not_full.notify_all()
+        wake_waiters(self.putters)
+
+        return element
+
+
+NODE_TYPES = {"directory": Directory, "binary": BinaryFile, "logfile": LogFile, "buffer": BufferFile}
+NODE_TYPE_NAMES = {cls: name for name, cls in NODE_TYPES.items()}
+# Node class of each kind of spill record, see Node.spill_record
+SPILLED_TYPES = {"d": Directory, "b": BinaryFile, "l": LogFile, "q": BufferFile}
+# (class, method, operation) counted by Metrics, see set_instrumentation
+INSTRUMENTED_METHODS = [
+    (FileSystem, "get_node", "get_node"),
+    (Directory, "create_directory", "create_directory"),
+    (Directory, "create_binary_file", "create_binary_file"),
+    (Directory, "create_log_file", "create_log_file"),
+    (Directory, "create_buffer", "create_buffer"),
+    (Directory, "move", "move"),
+    (Node, "delete", "delete"),
+    (BinaryFile, "read", "read"),
+    (LogFile, "read", "read"),
+    (LogFile, "append", "append"),
+    (BufferFile, "push", "push"),
+    (BufferFile, "push_many", "push"),
+    (BufferFile, "pop", "pop"),
+    (BufferFile, "pop_many", "pop"),
+]
+
+
+def instrument_nodes() -> None:
+    # Run once at import, see set_instrumentation
+    for cls, name, operation in INSTRUMENTED_METHODS:
+        if cls is not FileSystem:
+            setattr(cls, name, instrumented(cls.__dict__[name], operation))
+
+
+instrument_nodes()
+
+
+# Journal operation -> node type of the created node
+CREATED_TYPES = {"mkdir": "directory", "mkbin": "binary", "mklog": "logfile", "mkbuf": "buffer"}
+# Events merged into the previous queued one when it has the same kind and path
+COALESCED_EVENTS = {"append": "size", "push": "count", "pop": "count"}
+
+
+def record_events(record: tuple) -> list[dict[str, Any]]:
+    # Watch events of a journal record, see FileSystem.record
+    operation, path, *args = record
+
+    if operation == "batch":
+        return [event for batched in path for event in record_events(batched)]
+
+    if operation in CREATED_TYPES:
+        return [{"event": "create", "path": path + DELIMITER + args[0], "type": CREATED_TYPES[operation]}]
+
+    if operation == "import":
+        return [{"event": "create", "path": path + DELIMITER + args[0][0][1]}]
+
+    if operation == "copy":
+        return [{"event": "create", "path": args[1] + DELIMITER + args[0]}]
+
+    if operation == "clone":
+        return [{"event": "create", "path": args[0] + DELIMITER + path.rsplit(DELIMITER, 1)[-1], "type": "directory"}]
+
+    if operation == "move":
+        return [{"event": "move", "path": path + DELIMITER + args[0], "dest": args[1] + DELIMITER + args[0]}]
+
+    if operation == "append":
+        return [{"event": "append", "path": path, "size": len(args[0])}]
+
+    if operation == "push":
+        return [{"event": "push", "path": path, "count": len(args[0])}]
+
+    if operation == "pop":
+        return [{"event": "pop", "path": path, "count": args[0]}]
+
+    return [{"event": operation, "path": path}]
+
+
+class Watcher():
+    # Bounded event queue of one subscriber, see FileSystem.watch. Repeated
+    # append/push/pop events of a path are merged while they wait in the queue.
+    # A full queue drops events and queues one overflow event counting them,
+    # after which the subscriber should re-read the tree
+    def __init__(self, fs: FileSystem, path: str, recursive: bool, size: int):
+        self.fs = fs
+        self.path = path
+        self.prefix = path + DELIMITER
+        self.recursive = recursive
+        self.size = size
+        self.queue: deque[dict[str, Any]] = deque()
+        self.overflow: dict[str, Any] | None = None
+        self.closed = False
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.getters: list[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    def matches(self, path: str) -> bool:
+        if path == self.path or (self.recursive and path.startswith(self.prefix)):
+            return True
+
+        return path.rsplit(DELIMITER, 1)[0] == self.path
+
+    def put(self, event: dict[str, Any]) -> None:
+        with self.lock:
+            last = self.queue[-1] if self.queue else None
+            merged = COALESCED_EVENTS.get(event["event"])
+
+            if merged and last is not None and last["event"] == event["event"] and last["path"] == event["path"]:
+                last[merged] += event[merged]
+                last["coalesced"] = last.get("coalesced", 1) + 1
+            elif last is not None and last is self.overflow:
+                self.overflow["dropped"] += 1
+            elif len(self.queue) >= self.size:
+                self.overflow = {"event": "overflow", "path": self.path, "dropped": 1}
+                self.queue.append(self.overflow)
+            else:
+                self.queue.append(event)
+
+            self.not_empty.notify_all()
+            wake_waiters(self.getters)
+
+    def take(self) -> dict[str, Any]:
+        # Caller holds self.lock
+        event = self.queue.popleft()
+
+        if event is self.overflow:
+            self.overflow = None
+
+        return event
+
+    def get(self, timeout: float | None = None) -> dict[str, Any] | None:
+        # Next event or None, timeout None/0 doesn't wait
+        with self.lock:
+            if not wait_on(self.not_empty, lambda: self.queue or self.closed, timeout) or not self.queue:
+                return None
+
+            return self.take()
+
+    async def aget(self, timeout: float | None = None) -> dict[str, Any] | None:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (timeout or 0)
+
+        while True:
+            remaining = deadline - loop.time()
+
+            with self.lock:
+                if self.queue:
+                    return self.take()
+
+                if remaining <= 0 or self.closed:
+                    return None
+
+                waiter = loop.create_future()
+                self.getters.append((loop, waiter))
+
+            await wait_future(waiter, remaining)
+
+    def close(self) -> None:
+        self.fs.unwatch(self)
+
+        with self.lock:
+            self.closed = True
+            self.not_empty.notify_all()
+            wake_waiters(self.getters)
+
+    def __enter__(self) -> Watcher:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def shard_get(fs: FileSystem, path: str, limit: int | None, cursor: str | None, depth: int) -> dict[str, Any]:
+    return fs.get_node(path).to_json(limit, cursor, depth)
+
+
+def shard_read(fs: FileSystem, path: str) -> Any:
+    node = fs.get_node(path)
+
+    if isinstance(node, BufferFile):
+        return node.items
+
+    if not isinstance(node, (BinaryFile, LogFile)):
+        raise ValueError("Can't read that file")
+
+    return node.read()
+
+
+def shard_append(fs: FileSystem, path: str, information: str) -> int:
+    log_file = fs.get_node(path)
+
+    if not isinstance(log_file, LogFile):
+        raise ValueError("Can't find LogFile")
+
+    return log_file.append(information)
+
+
+def shard_buffer(fs: FileSystem, path: str) -> BufferFile:
+    buffer_file = fs.get_node(path)
+
+    if not isinstance(buffer_file, BufferFile):
+        raise ValueError("Can't find BufferFile")
+
+    return buffer_file
+
+
+def shard_move(fs: FileSystem, src: str, dest: str) -> dict[str, Any]:
+    node = fs.get_node(src)
+    return node.parent.move(node.name, dest).to_json()
+
+
+def shard_export(fs: FileSystem, path: str) -> tuple[list[tuple], str]:
+    # Records of the subtree and their digest, see ShardedFileSystem.move
+    records = list(fs.export_records(fs.get_node(path)))
+
+    return records, records_digest(records)
+
+
+def shard_remove(fs: FileSystem, path: str, digest: str) -> None:
+    # Deletes a moved subtree, unless it changed since shard_export
+    node = fs.get_node(path)
+
+    if records_digest(list(fs.export_records(node))) != digest:
+        raise ValueError(f"{path} changed while it was moved")
+
+    node.delete()
+
+
+def records_digest(records: list[tuple]) -> str:
+    return hashlib.blake2b(pickle.dumps(records, protocol=pickle.HIGHEST_PROTOCOL), digest_size=16).hexdigest()
+
+
+def shard_import(fs: FileSystem, path: str, records: list[tuple]) -> dict[str, Any]:
+    directory = fs.get_node(path)
+
+    if not isinstance(directory, Directory):
+        raise ValueError("Wrong destination path")
+
+    directory.import_records(records)
+
+    return directory.to_json()
+
+
+# Operations a shard worker runs for ShardedFileSystem, paths are absolute
+SHARD_OPERATIONS: dict[str, Callable[..., Any]] = {
+    "get": shard_get,
+    "read": shard_read,
+    "mkdir": lambda fs, path, name: fs.create_directory(path, name).to_json(),
+    "mkbin": lambda fs, path, name, information: fs.create_binary_file(path, name, information).to_json(),
+    "mklog": lambda fs, path, name, information: fs.create_log_file(path, name, information).to_json(),
+    "mkbuf": lambda fs, path, name, capacity, mode: fs.create_buffer(path, name, capacity, mode).to_json(),
+    "append": shard_append,
+    "push": lambda fs, path, element: shard_buffer(fs, path).push(element),
+    "pop": lambda fs, path: shard_buffer(fs, path).pop(),
+    "move": shard_move,
+    "delete": lambda fs, path: fs.get_node(path).delete().to_json(),
+    "export": shard_export,
+    "remove": shard_remove,
+    "import": shard_import,
+}
+
+
+def shard_worker(ready: Connection, authkey: bytes, data_dir: str | None, kwargs: dict[str, Any]) -> None:
+    # Serves one shard: a thread per client connection, one operation at a time
+    fs = FileSystem.open(data_dir, **kwargs) if data_dir else FileSystem(**kwargs)
+    listener = Listener(family="AF_UNIX", authkey=authkey)
+    lock = threading.Lock()
+    stopping = threading.Event()
+
+    def serve(connection: Connection) -> None:
+        with connection:
+            while True:
+                try:
+                    operation, *args = connection.recv()
+                except (EOFError, OSError):
+                    return
+
+                if operation == "shutdown":
+                    with lock:
+                        fs.close()
+
+                    stopping.set()
+                    connection.send(("ok", None))
+                    return
+
+                try:
+                    with lock:
+                        result = ("ok", SHARD_OPERATIONS[operation](fs, *args))
+                except ValueError as e:
+                    result = ("error", str(e))
+
+                connection.send(result)
+
+    def accept() -> None:
+        while True:
+            threading.Thread(target=serve, args=(listener.accept(),), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    ready.send(listener.address)
+    stopping.wait()
+    listener.close()
+
+
+class ShardedFileSystem():
+    # Router over shard worker processes. Every top-level entry of ~ lives on
+    # one shard, picked by a stable hash of its name, and its whole subtree
+    # with it. Nodes stay in the workers, results come back as to_json dicts.
+    # Several routers, in several processes, can share the same workers.
+    def __init__(self, addresses: list[str], authkey: bytes):
+        self.addresses = addresses
+        self.authkey = authkey
+        self.connections = [Client(address, family="AF_UNIX", authkey=authkey) for address in addresses]
+        self.locks = [threading.Lock() for _ in addresses]
+        self.processes: list[multiprocessing.Process] = []
+
+    @classmethod
+    def start(cls, workers: int, data_dir: str | None = None, **kwargs) -> ShardedFileSystem:
+        # Spawns the workers, each shard persists to data_dir/shard.N when given.
+        # The number of workers of a data_dir can't change, names are hashed on it
+        context = multiprocessing.get_context("spawn")
+        authkey = os.urandom(16)
+        processes = []
+        addresses = []
+
+        for shard in range(workers):
+            ready, remote = context.Pipe()
+            shard_dir = os.path.join(data_dir, f"shard.{shard}") if data_dir else None
+            process = context.Process(target=shard_worker, args=(remote, authkey, shard_dir, kwargs), daemon=True)
+            process.start()
+            processes.append(process)
+            addresses.append(ready.recv())
+
+        router = cls(addresses, authkey)
+        router.processes = processes
+
+        return router
+
+    def close(self) -> None:
+        # Stops the workers too when this router started them
+        for shard, process in enumerate(self.processes):
+            self.call(shard, "shutdown")
+            process.join()
+
+        for connection in self.connections:
+            connection.close()
+
+    def __enter__(self) -> ShardedFileSystem:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def call(self, shard: int, operation: str, *args) -> Any:
+        with self.locks[shard]:
+            self.connections[shard].send((operation, *args))
+            status, result = self.connections[shard].recv()
+
+        if status == "error":
+            raise ValueError(result)
+
+        return result
+
+    def split(self, path: str) -> tuple[str, ...]:
+        # Absolute parts of path, relative paths start at ~
+        parts = ["~"]
+
+        for token in compile_path(path):
+            if token == "~":
+                parts = ["~"]
+            elif token == "..":
+                if len(parts) > 1:
+                    parts.pop()
+            else:
+                parts.append(token)
+
+        return tuple(parts)
+
+    def shard_of(self, name: str) -> int:
+        return zlib.crc32(name.encode()) % len(self.connections)
+
+    def route(self, path: str) -> tuple[int, str]:
+        parts = self.split(path)
+
+        if len(parts) == 1:
+            raise ValueError("Operation is not supported on the root directory")
+
+        return self.shard_of(parts[1]), DELIMITER.join(parts)
+
+    def get_node(self, path: str, limit: int | None = JSON_PAGE_SIZE, cursor: str | None = None, depth: int = 0) -> dict[str, Any]:
+        if len(self.split(path)) > 1:
+            shard, path = self.route(path)
+            return self.call(shard, "get", path, limit, cursor, depth)
+
+        # The root listing and its counters are merged from every shard
+        roots = [self.call(shard, "get", "~", None, None, 0) for shard in range(len(self.connections))]
+        childs = [name for root in roots for name in root["childs"]]
+        root = roots[0]
+        root["nodes"] = sum(shard_root["nodes"] for shard_root in roots)
+        root["size"] = sum(shard_root["size"] for shard_root in roots)
+        start, end = page_bounds(childs, limit, cursor)
+        root["childs"] = childs[start:end]
+
+        if start or end < len(childs):
+            root["total"] = len(childs)
+
+            if end < len(childs):
+                root["next_cursor"] = childs[end - 1]
+
+        return root
+
+    def read(self, path: str) -> Any:
+        shard, path = self.route(path)
+        return self.call(shard, "read", path)
+
+    def create(self, operation: str, path: str, name: str, *args) -> dict[str, Any]:
+        parts = self.split(path)
+        shard = self.shard_of(parts[1] if len(parts) > 1 else name)
+
+        return self.call(shard, operation, DELIMITER.join(parts), name, *args)
+
+    def create_directory(self, path: str, name: str) -> dict[str, Any]:
+        return self.create("mkdir", path, name)
+
+    def create_binary_file(self, path: str, name: str, information: str | bytes) -> dict[str, Any]:
+        return self.create("mkbin", path, name, information)
+
+    def create_log_file(self, path: str, name: str, information: str = None) -> dict[str, Any]:
+        return self.create("mklog", path, name, information)
+
+    def create_buffer(self, path: str, name: str, capacity: int = MAX_BUF_FILE_SIZE, mode: str = "lifo") -> dict[str, Any]:
+        return self.create("mkbuf", path, name, capacity, mode)
+
+    def append(self, path: str, information: str) -> int:
+        shard, path = self.route(path)
+        return self.call(shard, "append", path, information)
+
+    def push(self, path: str, element: Any) -> int:
+        shard, path = self.route(path)
+        return self.call(shard, "push", path, element)
+
+    def pop(self, path: str) -> Any:
+        shard, path = self.route(path)
+        return self.call(shard, "pop", path)
+
+    def delete(self, path: str) -> dict[str, Any]:
+        shard, path = self.route(path)
+        return self.call(shard, "delete", path)
+
+    def move(self, src: str, dest: str) -> dict[str, Any]:
+        # Within a shard this is a plain move. Across shards the subtree is
+        # copied into the other shard first and only then deleted from its
+        # own, so a failure leaves it where it was. A subtree changed
+        # meanwhile is kept at its source and the copy is deleted again
+        source = self.split(src)
+        destination = self.split(dest)
+
+        if len(source) == 1:
+            raise ValueError("Can't move root directory")
+
+        if destination[:len(source)] == source:
+            raise ValueError("Can't move directory inside itself")
+
+        source_shard = self.shard_of(source[1])
+        dest_shard = self.shard_of(destination[1] if len(destination) > 1 else source[-1])
+        src, dest = DELIMITER.join(source), DELIMITER.join(destination)
+
+        if source_shard == dest_shard:
+            return self.call(source_shard, "move", src, dest)
+
+        records, digest = self.call(source_shard, "export", src)
+        result = self.call(dest_shard, "import", dest, records)
 
-    def pop(self) -> bool:
-        if len(self.items) == 0:
-            raise ValueError("Can't get items from an empty BufferFile")
+        try:
+            self.call(source_shard, "remove", src, digest)
+        except ValueError:
+            self.call(dest_shard, "delete", DELIMITER.join(destination + (source[-1],)))
+            raise
 
-        return self.items.pop()
+        return result
@@ -1,4 +1,15 @@
-from filesystem import FileSystem, Directory, MAX_BUF_FILE_SIZE, DIR_MAX_ELEMS
+from filesystem import FileSystem, ShardedFileSystem, Directory, BinaryFile, LogFile, Compressed, Spilled, MAX_BUF_FILE_SIZE, DIR_MAX_ELEMS, LOG_CHUNK_SIZE, BLOB_INLINE_LIMIT, JSON_PAGE_SIZE, SPILL_NODE_SIZE
+import asyncio
+import io
+import os
+import random
+import shlex
+import sys
+import tarfile
+import threading
+import time
+from itertools import count
+from fsinterfacepy import parse, run_script
 import pytest
 
 
@@ -212,3 +223,1462 @@ def test_exception_directory_max_elements(filesystem: FileSystem):
 
     with pytest.raises(ValueError):
         filesystem.create_directory(".", "Dummy")
+
+
+def test_directory_keeps_insertion_order(filesystem: FileSystem):
+    for name in ["c", "a", "b"]:
+        filesystem.create_directory("./Dir_1", name)
+
+    folder = filesystem.get_node("./Dir_1")
+
+    assert [c.name for c in folder.childs] == ["c", "a", "b"]
+
+
+def test_directory_max_elements_per_filesystem():
+    fs = FileSystem(dir_max_elems=3)
+
+    for i in range(3):
+        fs.create_directory(".", "Dir__"+str(i))
+
+    with pytest.raises(ValueError):
+        fs.create_directory(".", "Dummy")
+
+
+def test_directory_max_elements_unlimited():
+    fs = FileSystem(dir_max_elems=None)
+
+    for i in range(DIR_MAX_ELEMS * 10):
+        fs.create_binary_file(".", "File__"+str(i), "")
+
+    assert len(fs.root.childs) == DIR_MAX_ELEMS * 10
+    assert fs.get_node("./File__57").name == "File__57"
+
+
+def test_exception_move_name_taken(filesystem_complex: FileSystem):
+    filesystem_complex.create_buffer("./Dir_1", "dummy.buf")
+    filesystem_complex.create_buffer("./Dir_2", "dummy.buf")
+
+    with pytest.raises(ValueError):
+        filesystem_complex.get_node("./Dir_1").move("dummy.buf", "./Dir_2")
+
+    assert filesystem_complex.get_node("./Dir_1/dummy.buf").name == "dummy.buf"
+
+
+def test_move_updates_subtree_parent(filesystem_complex: FileSystem):
+    filesystem_complex.create_log_file("./Dir_1/Dir_11", "dummy.log")
+    filesystem_complex.get_node("./Dir_1").move("Dir_11", "./Dir_2/Dir_21")
+
+    log_file = filesystem_complex.get_node("./Dir_2/Dir_21/Dir_11/dummy.log")
+
+    assert [d.name for d in log_file.path] == ["~", "Dir_2", "Dir_21", "Dir_11"]
+
+    log_file.parent.delete()
+
+    assert len(filesystem_complex.get_node("./Dir_2/Dir_21").childs) == 0
+    assert [c.name for c in filesystem_complex.get_node("./Dir_1").childs] == ["Dir_12"]
+
+
+def test_exception_move_into_itself(filesystem_complex: FileSystem):
+    with pytest.raises(ValueError):
+        filesystem_complex.root.move("Dir_1", "./Dir_1/Dir_11")
+
+
+def test_get_node_special_names(filesystem_complex: FileSystem):
+    filesystem_complex.change_working_directory("./Dir_1/Dir_11")
+
+    assert filesystem_complex.get_node(".").name == "Dir_11"
+    assert filesystem_complex.get_node("..").name == "Dir_1"
+    assert filesystem_complex.get_node("~/Dir_2/Dir_21").name == "Dir_21"
+    assert filesystem_complex.get_node("../Dir_12/").name == "Dir_12"
+    assert filesystem_complex.get_node("~/..") is filesystem_complex.root
+
+
+def test_exception_path_through_file(filesystem: FileSystem):
+    filesystem.create_log_file("./Dir_1", "dummy.log")
+
+    with pytest.raises(ValueError):
+        filesystem.get_node("./Dir_1/dummy.log/anything")
+
+
+def test_get_node_cache_invalidation(filesystem_complex: FileSystem):
+    filesystem_complex.create_log_file("./Dir_1/Dir_11", "dummy.log")
+    log_file = filesystem_complex.get_node("./Dir_1/Dir_11/dummy.log")
+
+    assert filesystem_complex.get_node("./Dir_1/Dir_11/dummy.log") is log_file
+
+    filesystem_complex.get_node("./Dir_1").move("Dir_11", "./Dir_3")
+
+    with pytest.raises(ValueError):
+        filesystem_complex.get_node("./Dir_1/Dir_11/dummy.log")
+
+    assert filesystem_complex.get_node("./Dir_3/Dir_11/dummy.log") is log_file
+
+    log_file.delete()
+
+    with pytest.raises(ValueError):
+        filesystem_complex.get_node("./Dir_3/Dir_11/dummy.log")
+
+
+def test_log_file_ranged_read(filesystem: FileSystem):
+    log_file = filesystem.create_log_file("./Dir_1", "dummy.log")
+    expected = ""
+
+    for i in range(LOG_CHUNK_SIZE // 4):
+        line = f"{i:08}\n"
+        log_file.append(line)
+        expected += line
+
+    assert len(log_file.chunks) > 0
+    assert log_file.read() == expected
+    assert log_file.read(LOG_CHUNK_SIZE - 5, 20) == expected[LOG_CHUNK_SIZE - 5:LOG_CHUNK_SIZE + 15]
+    assert log_file.read(-9) == expected[-9:]
+    assert log_file.read(len(expected) + 5) == ""
+
+
+def test_log_file_tail(filesystem: FileSystem):
+    log_file = filesystem.create_log_file("./Dir_1", "dummy.log")
+
+    assert log_file.tail(3) == ""
+
+    log_file.append("1 - a\n2 - b")
+    log_file.append("\n3 - c\n")
+
+    assert log_file.tail(1) == "3 - c\n"
+    assert log_file.tail(2) == "2 - b\n3 - c\n"
+    assert log_file.tail(10) == "1 - a\n2 - b\n3 - c\n"
+
+    log_file.append("4")
+
+    assert log_file.tail(1) == "4"
+
+
+def test_log_file_created_without_information(filesystem: FileSystem):
+    log_file = filesystem.create_log_file("./Dir_1", "dummy.log")
+    log_file.append("first")
+
+    assert log_file.read() == "first"
+
+
+def test_buffer_file_lifo_order(filesystem: FileSystem):
+    buffer = filesystem.create_buffer(".", "dummy.buf")
+    buffer.push_many([1, 2, 3])
+
+    assert buffer.pop() == 3
+    assert buffer.pop_many(5) == [2, 1]
+    assert buffer.pop_many(5) == []
+
+
+def test_buffer_file_fifo_wraps(filesystem: FileSystem):
+    buffer = filesystem.create_buffer(".", "dummy.buf", capacity=4, mode="fifo")
+    buffer.push_many([1, 2, 3])
+
+    assert buffer.pop_many(2) == [1, 2]
+
+    buffer.push_many([4, 5, 6])
+
+    assert buffer.items == [3, 4, 5, 6]
+    assert [buffer.pop() for _ in range(4)] == [3, 4, 5, 6]
+
+
+def test_exception_buffer_capacity(filesystem: FileSystem):
+    buffer = filesystem.create_buffer(".", "dummy.buf", capacity=3)
+    buffer.push(1)
+
+    with pytest.raises(ValueError):
+        buffer.push_many([2, 3, 4])
+
+    assert buffer.items == [1]
+
+    with pytest.raises(ValueError):
+        filesystem.create_buffer(".", "wrong.buf", mode="random")
+
+
+def test_buffer_file_blocking_pop(filesystem: FileSystem):
+    buffer = filesystem.create_buffer(".", "dummy.buf")
+    threading.Timer(0.05, buffer.push, args=("item",)).start()
+
+    assert buffer.pop(timeout=5) == "item"
+
+    with pytest.raises(ValueError):
+        buffer.pop(timeout=0.05)
+
+
+def test_buffer_file_blocking_push(filesystem: FileSystem):
+    buffer = filesystem.create_buffer(".", "dummy.buf", capacity=1)
+    buffer.push(1)
+    threading.Timer(0.05, buffer.pop).start()
+
+    assert buffer.push(2, timeout=5) == 1
+    assert buffer.items == [2]
+
+
+def test_buffer_file_async_pop(filesystem: FileSystem):
+    buffer = filesystem.create_buffer(".", "dummy.buf", capacity=1)
+
+    async def consumer():
+        with pytest.raises(ValueError):
+            await buffer.apop(timeout=0.01)
+
+        threading.Timer(0.05, buffer.push, args=("item",)).start()
+        item = await buffer.apop(timeout=5)
+
+        await buffer.apush("again")
+        return item
+
+    assert asyncio.run(consumer()) == "item"
+    assert buffer.items == ["again"]
+
+
+def check_tree_invariants(fs: FileSystem) -> int:
+    '''Walks the tree, checks parent/name links and that there are no cycles'''
+    seen = set()
+    stack = [fs.root]
+
+    while stack:
+        directory = stack.pop()
+        assert id(directory) not in seen
+        seen.add(id(directory))
+
+        for name, child in directory.entries.items():
+            assert child.name == name
+            assert child.parent is directory
+            assert fs.get_node("~/" + "/".join([d.name for d in child.path[1:]] + [name])) is child
+
+            if isinstance(child, Directory):
+                stack.append(child)
+
+    return len(seen)
+
+
+def test_concurrent_stress():
+    fs = FileSystem(dir_max_elems=None)
+    directories = [fs.root]
+    errors = []
+
+    def path_of(node) -> str:
+        return "~/" + "/".join([d.name for d in node.path[1:]] + [node.name])
+
+    def worker(seed: int):
+        rng = random.Random(seed)
+
+        for i in range(1500):
+            directory = rng.choice(directories)
+            op = rng.random()
+
+            try:
+                if op < 0.3:
+                    directories.append(directory.create_directory(f"d{seed}_{i}"))
+                elif op < 0.5:
+                    directory.create_log_file(f"f{seed}_{i}").append("x")
+                elif op < 0.75:
+                    childs = directory.childs
+                    if childs and directory.parent is not None:
+                        directory.move(rng.choice(childs).name, path_of(rng.choice(directories)))
+                elif op < 0.85:
+                    childs = directory.childs
+                    if childs:
+                        rng.choice(childs).delete()
+                else:
+                    fs.get_node(path_of(directory))
+            except ValueError:
+                pass
+            except Exception as e:
+                errors.append(e)
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+
+    try:
+        threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(8)]
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+
+    assert errors == []
+    assert check_tree_invariants(fs) > 1
+
+
+def build_persistent_tree(fs: FileSystem) -> None:
+    fs.create_directory(".", "Dir_1")
+    fs.create_directory("./Dir_1", "Dir_11")
+    fs.create_directory(".", "Dir_2")
+    fs.create_binary_file("./Dir_1", "file.bin", "binary info")
+    fs.create_log_file("./Dir_1/Dir_11", "file.log", "first")
+    fs.get_node("./Dir_1/Dir_11/file.log").append("\nsecond")
+    buffer = fs.create_buffer("./Dir_2", "file.buf", capacity=4, mode="fifo")
+    buffer.push_many([1, 2, 3])
+    buffer.pop()
+    fs.get_node("./Dir_1").move("Dir_11", "~/Dir_2")
+    fs.create_directory(".", "Dir_3").delete()
+
+
+def check_persistent_tree(fs: FileSystem, buffer_items: list = [2, 3]) -> None:
+    assert [c.name for c in fs.root.childs] == ["Dir_1", "Dir_2"]
+    assert fs.get_node("./Dir_1/file.bin").read() == "binary info"
+    assert fs.get_node("./Dir_2/Dir_11/file.log").read() == "first\nsecond"
+    assert fs.get_node("./Dir_2/file.buf").items == buffer_items
+    assert fs.get_node("./Dir_2/file.buf").mode == "fifo"
+
+
+@pytest.mark.parametrize("fsync", ["always", "batch", "never"])
+def test_journal_recovery(tmp_path, fsync: str):
+    fs = FileSystem.open(str(tmp_path), fsync=fsync)
+    build_persistent_tree(fs)
+    fs.close()
+
+    recovered = FileSystem.open(str(tmp_path))
+    check_persistent_tree(recovered)
+    recovered.close()
+
+
+def test_snapshot_recovery(tmp_path):
+    fs = FileSystem.open(str(tmp_path))
+    build_persistent_tree(fs)
+    fs.checkpoint()
+    fs.get_node("./Dir_2/file.buf").push(4)
+    fs.close()
+
+    assert len([f for f in os.listdir(tmp_path) if f.startswith("snapshot.")]) == 1
+
+    recovered = FileSystem.open(str(tmp_path))
+    check_persistent_tree(recovered, [2, 3, 4])
+    recovered.close()
+
+
+def test_journal_concurrent_moves(tmp_path):
+    fs = FileSystem.open(str(tmp_path), dir_max_elems=None)
+    fs.create_directory(".", "x")
+    fs.create_directory(".", "y")
+    fs.create_directory("./x", "a")
+    directory = fs.create_directory("./x/a", "b")
+
+    def creator(prefix):
+        for i in range(300):
+            directory.create_binary_file(f"{prefix}{i}", "")
+
+    threads = [threading.Thread(target=creator, args=(prefix,)) for prefix in "pqr"]
+
+    for thread in threads:
+        thread.start()
+
+    # Records are journaled with the path they had when the swap ran
+    for i in range(40):
+        source, dest = ("x", "y") if i % 2 == 0 else ("y", "x")
+        fs.get_node(f"./{source}").move("a", f"./{dest}")
+
+    for thread in threads:
+        thread.join()
+
+    fs.close()
+
+    recovered = FileSystem.open(str(tmp_path))
+
+    assert len(recovered.get_node("./x/a/b").childs) == 900
+    assert recovered.dropped_records == 0
+    assert recovered.dir_max_elems is None
+    recovered.close()
+
+    # An explicit limit applies after the replay
+    recovered = FileSystem.open(str(tmp_path), dir_max_elems=5)
+
+    assert len(recovered.get_node("./x/a/b").childs) == 900
+    assert recovered.dir_max_elems == 5
+    recovered.close()
+
+
+def test_snapshot_concurrent_buffer(tmp_path):
+    fs = FileSystem.open(str(tmp_path), snapshot_every=None)
+    buffer_file = fs.create_buffer(".", "file.buf", capacity=10)
+
+    def worker():
+        for i in range(500):
+            buffer_file.push(i, timeout=1)
+            buffer_file.pop(timeout=1)
+
+    def checkpointer():
+        for _ in range(50):
+            fs.checkpoint()
+
+    # A checkpoint holds the barrier and reads the buffer, push/pop take them the same way round
+    threads = [threading.Thread(target=target, daemon=True) for target in (worker, worker, checkpointer)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join(timeout=30)
+
+    assert not any(thread.is_alive() for thread in threads)
+    assert buffer_file.items == []
+    fs.close()
+
+
+def test_journal_torn_tail(tmp_path):
+    fs = FileSystem.open(str(tmp_path))
+    build_persistent_tree(fs)
+    fs.close()
+
+    journal = sorted(f for f in os.listdir(tmp_path) if f.startswith("journal."))[-1]
+    with open(tmp_path / journal, "ab") as file:
+        file.write(b"\x10\x00\x00\x00garbage")
+
+    recovered = FileSystem.open(str(tmp_path))
+    check_persistent_tree(recovered)
+    recovered.close()
+
+
+def test_exception_journal_fsync_policy(tmp_path):
+    with pytest.raises(ValueError):
+        FileSystem.open(str(tmp_path), fsync="sometimes")
+
+
+def test_binary_file_blob_store(tmp_path):
+    fs = FileSystem(blob_dir=str(tmp_path))
+    text = "0123456789" * BLOB_INLINE_LIMIT
+    payload = bytes(range(256)) * 64
+
+    text_file = fs.create_binary_file(".", "text.bin", text)
+    bytes_file = fs.create_binary_file(".", "bytes.bin", payload)
+    small_file = fs.create_binary_file(".", "small.bin", "small")
+
+    assert isinstance(text_file.data, memoryview)
+    assert isinstance(small_file.data, bytes)
+    assert text_file.read() == text
+    assert bytes_file.read() == payload
+    assert bytes(bytes_file.view(256, 4)) == bytes([0, 1, 2, 3])
+    assert small_file.information == "small"
+
+
+def test_binary_file_blob_store_recovery(tmp_path):
+    payload = b"\x00\xff" * BLOB_INLINE_LIMIT
+
+    fs = FileSystem.open(str(tmp_path))
+    fs.create_binary_file(".", "big.bin", payload)
+    fs.checkpoint()
+    fs.close()
+
+    recovered = FileSystem.open(str(tmp_path))
+
+    assert recovered.get_node("./big.bin").read() == payload
+    recovered.close()
+
+
+def test_content_deduplication(filesystem: FileSystem):
+    first = filesystem.create_binary_file("./Dir_1", "first.bin", "same payload")
+    second = filesystem.create_binary_file("./Dir_1", "second.bin", "same payload")
+    filesystem.create_binary_file("./Dir_1", "other.bin", "other payload")
+
+    assert first.data is second.data
+
+    stats = filesystem.content_store.stats()
+
+    assert stats["entries"] == 2
+    assert stats["saved_size"] == len("same payload")
+
+    first.delete()
+    second.delete()
+
+    assert filesystem.content_store.stats()["entries"] == 1
+
+
+def test_copy_shares_content(filesystem: FileSystem):
+    filesystem.create_directory(".", "Dir_2")
+    filesystem.create_binary_file("./Dir_1", "file.bin", "payload")
+    log_file = filesystem.create_log_file("./Dir_1", "file.log")
+    log_file.append("x" * LOG_CHUNK_SIZE)
+    log_file.append("tail")
+
+    filesystem.root.copy("Dir_1", "./Dir_2")
+
+    copied_log = filesystem.get_node("./Dir_2/Dir_1/file.log")
+
+    assert filesystem.get_node("./Dir_2/Dir_1/file.bin").data is filesystem.get_node("./Dir_1/file.bin").data
+    assert copied_log.chunks[0] is log_file.chunks[0]
+    assert copied_log.read() == log_file.read()
+
+    copied_log.append("more")
+
+    assert log_file.read().endswith("tail")
+    assert filesystem.content_store.stats()["dedup_ratio"] == 2.0
+
+    filesystem.get_node("./Dir_2/Dir_1").delete()
+
+    assert filesystem.content_store.stats()["dedup_ratio"] == 1.0
+
+
+def test_walk(filesystem_complex: FileSystem):
+    filesystem_complex.create_log_file("./Dir_1/Dir_11", "file.log")
+
+    assert [(d, n.name) for d, n in filesystem_complex.walk()] == [
+        (1, "Dir_1"), (2, "Dir_11"), (3, "file.log"), (2, "Dir_12"),
+        (1, "Dir_2"), (2, "Dir_21"), (2, "Dir_22"), (1, "Dir_3"),
+    ]
+    assert [n.name for _, n in filesystem_complex.walk(max_depth=1)] == ["Dir_1", "Dir_2", "Dir_3"]
+    assert [n.name for _, n in filesystem_complex.walk(types=(LogFile,))] == ["file.log"]
+    assert [n.name for _, n in filesystem_complex.walk("./Dir_1", prune=lambda n: n.name == "Dir_11")] == ["Dir_12"]
+
+
+def test_iter_tree_deep():
+    fs = FileSystem()
+    directory = fs.root
+
+    for i in range(sys.getrecursionlimit() + 100):
+        directory = directory.create_directory(f"d{i}")
+
+    lines = fs.iter_tree()
+
+    assert next(lines) == "~"
+    assert next(lines) == "   d0"
+    assert sum(1 for _ in lines) == sys.getrecursionlimit() + 99
+
+
+def test_find(filesystem_complex: FileSystem):
+    filesystem_complex.create_log_file("./Dir_1/Dir_11", "err.log")
+    filesystem_complex.create_log_file("./Dir_2", "error.log")
+    filesystem_complex.create_binary_file("./Dir_2", "err.bin", "")
+    filesystem_complex.create_log_file("./Dir_3", "access.log")
+
+    assert [n.full_path() for n in filesystem_complex.find("err*", types=(LogFile,))] == ["~/Dir_1/Dir_11/err.log", "~/Dir_2/error.log"]
+    assert [n.name for n in filesystem_complex.find("err*", "./Dir_2")] == ["err.bin", "error.log"]
+    assert [n.name for n in filesystem_complex.find("*.log", types=(LogFile,))] == ["access.log", "err.log", "error.log"]
+    assert [n.name for n in filesystem_complex.find("Dir_2?")] == ["Dir_21", "Dir_22"]
+    assert len(filesystem_complex.find("err*", limit=1)) == 1
+    assert filesystem_complex.find("missing") == []
+
+
+def test_find_follows_changes(filesystem_complex: FileSystem):
+    filesystem_complex.create_binary_file("./Dir_1/Dir_11", "data.bin", "")
+
+    filesystem_complex.root.move("Dir_1", "./Dir_2")
+
+    assert [n.full_path() for n in filesystem_complex.find("data.bin")] == ["~/Dir_2/Dir_1/Dir_11/data.bin"]
+    assert filesystem_complex.find("data.bin", "./Dir_3") == []
+
+    filesystem_complex.get_node("./Dir_2").copy("Dir_1", "./Dir_3")
+
+    assert len(filesystem_complex.find("data.bin", types=(BinaryFile,))) == 2
+
+    filesystem_complex.get_node("./Dir_2/Dir_1").delete()
+
+    assert [n.full_path() for n in filesystem_complex.find("data.bin")] == ["~/Dir_3/Dir_1/Dir_11/data.bin"]
+    assert filesystem_complex.find("Dir_1?", "./Dir_2") == []
+
+
+def test_find_recovery(tmp_path):
+    fs = FileSystem.open(str(tmp_path))
+    fs.create_directory(".", "Dir_1")
+    fs.create_log_file("./Dir_1", "err.log")
+    fs.checkpoint()
+    fs.create_log_file(".", "err2.log")
+    fs.close()
+
+    recovered = FileSystem.open(str(tmp_path))
+
+    assert [n.full_path() for n in recovered.find("err*")] == ["~/Dir_1/err.log", "~/err2.log"]
+    recovered.close()
+
+
+def test_transaction_commit(filesystem_complex: FileSystem):
+    with filesystem_complex.transaction() as transaction:
+        transaction.mkdir("./Dir_1", "new")
+        transaction.mklog("./Dir_1/new", "file.log", "first")
+        transaction.append("./Dir_1/new/file.log", "\nsecond")
+        transaction.move("./Dir_2", "./Dir_1/new")
+        transaction.delete("./Dir_3")
+
+    assert filesystem_complex.get_node("./Dir_1/new/file.log").read() == "first\nsecond"
+    assert [c.name for c in filesystem_complex.root.childs] == ["Dir_1"]
+    assert [c.name for c in filesystem_complex.get_node("./Dir_1/new").childs] == ["file.log", "Dir_2"]
+
+
+def test_transaction_rollback(filesystem_complex: FileSystem):
+    log_file = filesystem_complex.create_log_file("./Dir_1", "file.log", "x" * (LOG_CHUNK_SIZE - 10))
+    buffer_file = filesystem_complex.create_buffer("./Dir_1", "file.buf", capacity=4)
+    buffer_file.push(1)
+
+    with pytest.raises(ValueError):
+        with filesystem_complex.transaction() as transaction:
+            transaction.mkdir("./Dir_1", "new")
+            transaction.append("./Dir_1/file.log", "y\n" * 20)
+            transaction.push("./Dir_1/file.buf", [2, 3])
+            transaction.move("./Dir_2/Dir_21", "./Dir_3")
+            transaction.delete("./Dir_1/Dir_11")
+            transaction.mkdir("./missing", "new")
+
+    assert [c.name for c in filesystem_complex.get_node("./Dir_1").childs] == ["Dir_11", "Dir_12", "file.log", "file.buf"]
+    assert [c.name for c in filesystem_complex.get_node("./Dir_2").childs] == ["Dir_21", "Dir_22"]
+    assert filesystem_complex.get_node("./Dir_3").childs == []
+    assert log_file.read() == "x" * (LOG_CHUNK_SIZE - 10)
+    assert log_file.tail(1) == log_file.read()
+    assert buffer_file.items == [1]
+    assert [n.name for n in filesystem_complex.find("Dir_11")] == ["Dir_11"]
+    assert filesystem_complex.find("new") == []
+
+
+def test_transaction_rollback_concurrent(filesystem: FileSystem):
+    log_file = filesystem.create_log_file("./Dir_1", "file.log")
+    buffer_file = filesystem.create_buffer("./Dir_1", "file.buf", capacity=1000)
+
+    def writer():
+        for _ in range(300):
+            log_file.append("w")
+            buffer_file.push("w")
+            time.sleep(0.0001)
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+
+    # A rollback must not truncate or drop what the writer added meanwhile
+    for _ in range(30):
+        with pytest.raises(ValueError):
+            with filesystem.transaction() as transaction:
+                transaction.append("./Dir_1/file.log", "t")
+                transaction.push("./Dir_1/file.buf", ["t"])
+                time.sleep(0.001)
+                raise ValueError("rollback")
+
+        time.sleep(0.001)
+
+    thread.join()
+
+    assert log_file.read() == "w" * 300
+    assert buffer_file.items == ["w"] * 300
+    assert filesystem.root.size == 600
+
+
+def test_transaction_recovery(tmp_path):
+    fs = FileSystem.open(str(tmp_path))
+    fs.create_directory(".", "Dir_1")
+
+    with fs.transaction() as transaction:
+        transaction.mkdir("./Dir_1", "Dir_11")
+        transaction.mklog("./Dir_1/Dir_11", "file.log", "first")
+        transaction.delete("./Dir_1")
+
+    with pytest.raises(ValueError):
+        with fs.transaction() as transaction:
+            transaction.mkdir(".", "Dir_2")
+            transaction.delete("./missing")
+
+    fs.close()
+
+    recovered = FileSystem.open(str(tmp_path))
+
+    assert recovered.root.childs == []
+    recovered.close()
+
+
+def test_to_json(filesystem_complex: FileSystem):
+    filesystem_complex.create_buffer("./Dir_1/Dir_11", "file.buf").push(1)
+
+    assert filesystem_complex.root.to_json() == {"name": "~", "type": "directory", "path": [], "childs": ["Dir_1", "Dir_2", "Dir_3"], "nodes": 8, "size": 1}
+    assert filesystem_complex.get_node("./Dir_1/Dir_11/file.buf").to_json() == {"name": "file.buf", "type": "buffer", "path": ["~", "Dir_1", "Dir_11"], "length": 1}
+    assert filesystem_complex.root.to_json(depth=2)["children"][0] == {
+        "name": "Dir_1", "type": "directory", "path": ["~"], "childs": ["Dir_11", "Dir_12"], "nodes": 3, "size": 1, "children": [
+            {"name": "Dir_11", "type": "directory", "path": ["~", "Dir_1"], "childs": ["file.buf"], "nodes": 1, "size": 1},
+            {"name": "Dir_12", "type": "directory", "path": ["~", "Dir_1"], "childs": [], "nodes": 0, "size": 0},
+        ],
+    }
+
+
+def test_to_json_cache_invalidation(filesystem_complex: FileSystem):
+    dir_11 = filesystem_complex.get_node("./Dir_1/Dir_11")
+
+    assert dir_11.to_json()["path"] == ["~", "Dir_1"]
+    assert filesystem_complex.root.to_json()["childs"] == ["Dir_1", "Dir_2", "Dir_3"]
+
+    filesystem_complex.create_directory(".", "Dir_4")
+    filesystem_complex.get_node("./Dir_1").move("Dir_11", "./Dir_2")
+
+    assert dir_11.to_json()["path"] == ["~", "Dir_2"]
+    assert filesystem_complex.root.to_json()["childs"] == ["Dir_1", "Dir_2", "Dir_3", "Dir_4"]
+    assert filesystem_complex.get_node("./Dir_1").to_json()["childs"] == ["Dir_12"]
+
+    # Changes outside a subtree keep its fragments cached
+    dir_22 = filesystem_complex.get_node("./Dir_2/Dir_22")
+    fragment = dir_22.json_fragment()[0]
+    filesystem_complex.get_node("./Dir_3").delete()
+    filesystem_complex.get_node("./Dir_1").move("Dir_12", "./Dir_4")
+
+    assert dir_22.json_fragment()[0] is fragment
+
+    filesystem_complex.get_node(".").move("Dir_2", "./Dir_4")
+
+    assert dir_22.to_json()["path"] == ["~", "Dir_4", "Dir_2"]
+
+
+def test_to_json_pagination():
+    fs = FileSystem(dir_max_elems=None)
+
+    for i in range(JSON_PAGE_SIZE + 5):
+        fs.create_directory(".", f"d{i}")
+
+    first = fs.root.to_json()
+
+    assert len(first["childs"]) == JSON_PAGE_SIZE
+    assert first["total"] == JSON_PAGE_SIZE + 5
+
+    last = fs.root.to_json(cursor=first["next_cursor"])
+
+    assert last["childs"] == [f"d{i}" for i in range(JSON_PAGE_SIZE, JSON_PAGE_SIZE + 5)]
+    assert "next_cursor" not in last
+    assert fs.root.to_json(limit=2, cursor="d2")["childs"] == ["d3", "d4"]
+
+    # Changes between pages neither skip nor repeat a name
+    page = fs.root.to_json(limit=2, cursor="d2")
+    fs.get_node("./d1").delete()
+    fs.get_node("./d3").delete()
+    fs.create_directory(".", "new")
+
+    assert fs.root.to_json(limit=2, cursor=page["next_cursor"])["childs"] == ["d5", "d6"]
+    assert fs.root.to_json(cursor=f"d{JSON_PAGE_SIZE + 4}")["childs"] == ["new"]
+
+    with pytest.raises(ValueError):
+        fs.root.to_json(cursor="d3")
+
+
+def test_clone_copy_on_write(filesystem_complex: FileSystem):
+    log_file = filesystem_complex.create_log_file("./Dir_1/Dir_11", "file.log", "first")
+    filesystem_complex.create_buffer("./Dir_1", "file.buf").push(1)
+
+    clone = filesystem_complex.get_node("./Dir_1").clone("./Dir_2")
+
+    assert clone.lazy
+
+    log_file.append("\nsecond")
+    filesystem_complex.get_node("./Dir_1/file.buf").push(2)
+    filesystem_complex.get_node("./Dir_1/Dir_12").delete()
+    filesystem_complex.create_directory("./Dir_1", "Dir_13")
+
+    assert [c.name for c in clone.childs] == ["Dir_11", "Dir_12", "file.buf"]
+    assert filesystem_complex.get_node("./Dir_2/Dir_1/Dir_11/file.log").read() == "first"
+    assert filesystem_complex.get_node("./Dir_2/Dir_1/file.buf").items == [1]
+
+    filesystem_complex.get_node("./Dir_2/Dir_1/Dir_11/file.log").append("\nclone")
+    filesystem_complex.create_directory("./Dir_2/Dir_1/Dir_11", "only_clone")
+
+    assert log_file.read() == "first\nsecond"
+    assert [c.name for c in filesystem_complex.get_node("./Dir_1/Dir_11").childs] == ["file.log"]
+    assert [n.full_path() for n in filesystem_complex.find("only_clone")] == ["~/Dir_2/Dir_1/Dir_11/only_clone"]
+    assert filesystem_complex.pending_clones == 0
+
+
+def test_clone_deleted_source(filesystem_complex: FileSystem):
+    filesystem_complex.create_binary_file("./Dir_1/Dir_11", "file.bin", "payload")
+
+    filesystem_complex.get_node("./Dir_1").clone("./Dir_2")
+    filesystem_complex.get_node("./Dir_1").delete()
+
+    assert filesystem_complex.get_node("./Dir_2/Dir_1/Dir_11/file.bin").read() == "payload"
+
+    filesystem_complex.get_node("./Dir_2").clone("./Dir_3").delete()
+
+    assert filesystem_complex.pending_clones == 0
+    assert filesystem_complex.content_store.stats()["entries"] == 1
+
+
+def test_snapshot(filesystem_complex: FileSystem):
+    filesystem_complex.create_log_file("./Dir_1", "file.log", "first")
+
+    with filesystem_complex.snapshot() as snapshot:
+        filesystem_complex.get_node("./Dir_1/file.log").append("\nsecond")
+        filesystem_complex.get_node("./Dir_2").delete()
+        filesystem_complex.create_directory("./Dir_3", "Dir_31")
+
+        assert [n.name for _, n in snapshot.walk()] == ["Dir_1", "Dir_11", "Dir_12", "file.log", "Dir_2", "Dir_21", "Dir_22", "Dir_3"]
+        assert snapshot.get_node("./Dir_1/file.log").read() == "first"
+        assert [n.full_path() for n in snapshot.find("Dir_2*")] == ["~/Dir_2", "~/Dir_2/Dir_21", "~/Dir_2/Dir_22"]
+
+    assert filesystem_complex.pending_clones == 0
+    assert [c.name for c in filesystem_complex.root.childs] == ["Dir_1", "Dir_3"]
+
+
+def test_clone_recovery(tmp_path):
+    fs = FileSystem.open(str(tmp_path))
+    fs.create_directory(".", "Dir_1")
+    fs.create_log_file("./Dir_1", "file.log", "first")
+    fs.create_directory(".", "Dir_2")
+    fs.get_node("./Dir_1").clone("./Dir_2")
+    fs.get_node("./Dir_1/file.log").append("\nsecond")
+    fs.close()
+
+    recovered = FileSystem.open(str(tmp_path))
+
+    assert recovered.get_node("./Dir_2/Dir_1/file.log").read() == "first"
+    assert recovered.get_node("./Dir_1/file.log").read() == "first\nsecond"
+    recovered.close()
+
+
+def test_export_import_records(filesystem_complex: FileSystem):
+    filesystem_complex.create_log_file("./Dir_1/Dir_11", "file.log", "first")
+    filesystem_complex.create_buffer("./Dir_1", "file.buf").push_many([1, 2])
+    records = list(filesystem_complex.export_records(filesystem_complex.get_node("./Dir_1")))
+
+    target = FileSystem()
+    target.create_directory(".", "dest")
+    target.get_node("./dest").import_records(records)
+
+    assert [n.name for _, n in target.walk("./dest/Dir_1")] == ["Dir_11", "file.log", "Dir_12", "file.buf"]
+    assert target.get_node("./dest/Dir_1/Dir_11/file.log").read() == "first"
+    assert target.get_node("./dest/Dir_1/file.buf").items == [1, 2]
+    assert sorted(n.full_path() for n in target.find("file.*")) == ["~/dest/Dir_1/Dir_11/file.log", "~/dest/Dir_1/file.buf"]
+
+    with pytest.raises(ValueError):
+        target.get_node("./dest").import_records(records)
+
+
+@pytest.fixture(scope="module")
+def sharded() -> ShardedFileSystem:
+    with ShardedFileSystem.start(2) as router:
+        yield router
+
+
+def names_by_shard(router: ShardedFileSystem, prefix: str) -> list[str]:
+    # One top-level name per shard
+    names = {}
+
+    for i in count():
+        names.setdefault(router.shard_of(f"{prefix}{i}"), f"{prefix}{i}")
+
+        if len(names) == len(router.connections):
+            return [names[shard] for shard in range(len(names))]
+
+
+def test_sharded_routing(sharded: ShardedFileSystem):
+    first, second = names_by_shard(sharded, "route_")
+    sharded.create_directory("~", first)
+    sharded.create_directory("~", second)
+    sharded.create_log_file(f"~/{first}", "file.log", "first")
+    sharded.append(f"./{first}/../{first}/file.log", "\nsecond")
+    sharded.create_buffer(f"~/{second}", "file.buf", 2, "fifo")
+    sharded.push(f"~/{second}/file.buf", 1)
+    sharded.push(f"~/{second}/file.buf", 2)
+
+    assert {first, second} <= set(sharded.get_node("~")["childs"])
+    assert sharded.read(f"~/{first}/file.log") == "first\nsecond"
+    assert sharded.pop(f"~/{second}/file.buf") == 1
+    assert sharded.get_node(f"~/{second}")["childs"] == ["file.buf"]
+
+    sharded.push(f"~/{second}/file.buf", 3)
+
+    with pytest.raises(ValueError):
+        sharded.push(f"~/{second}/file.buf", 4)
+
+    with pytest.raises(ValueError):
+        sharded.get_node(f"~/{first}/missing")
+
+    sharded.delete(f"~/{second}")
+    assert second not in sharded.get_node("~")["childs"]
+
+
+def test_sharded_move(sharded: ShardedFileSystem):
+    first, second = names_by_shard(sharded, "move_")
+    sharded.create_directory("~", first)
+    sharded.create_directory("~", second)
+    sharded.create_directory(f"~/{first}", "sub")
+    sharded.create_log_file(f"~/{first}/sub", "file.log", "first")
+    sharded.create_directory(f"~/{second}", "sub")
+
+    with pytest.raises(ValueError):
+        sharded.move(f"~/{first}", f"~/{first}/sub")
+
+    # Name taken on the other shard: the subtree goes back where it was
+    with pytest.raises(ValueError):
+        sharded.move(f"~/{first}/sub", f"~/{second}")
+
+    assert sharded.read(f"~/{first}/sub/file.log") == "first"
+    assert sharded.get_node(f"~/{second}")["childs"] == ["sub"]
+
+    # The source is only deleted while it still matches the copy
+    source_shard = sharded.shard_of(first)
+    records, digest = sharded.call(source_shard, "export", f"~/{first}/sub")
+    sharded.append(f"~/{first}/sub/file.log", "\nsecond")
+
+    with pytest.raises(ValueError):
+        sharded.call(source_shard, "remove", f"~/{first}/sub", digest)
+
+    assert sharded.read(f"~/{first}/sub/file.log") == "first\nsecond"
+
+    sharded.delete(f"~/{second}/sub")
+    sharded.move(f"~/{first}/sub", f"~/{second}")
+
+    assert sharded.get_node(f"~/{first}")["childs"] == []
+    assert sharded.read(f"~/{second}/sub/file.log") == "first\nsecond"
+
+    # Root counters are summed over the shards
+    root = sharded.get_node("~")
+    assert root["nodes"] == sum(sharded.get_node(f"~/{name}")["nodes"] + 1 for name in root["childs"])
+
+
+def test_metrics(filesystem_complex: FileSystem):
+    metrics = filesystem_complex.enable_metrics(sample_rate=1.0, slowest=3)
+    buffer_file = filesystem_complex.create_buffer("./Dir_1", "file.buf", 2)
+    buffer_file.push_many([1, 2])
+    buffer_file.pop()
+    filesystem_complex.get_node("./Dir_1/Dir_11").delete()
+
+    with pytest.raises(ValueError):
+        filesystem_complex.get_node("./Dir_1/Dir_11")
+
+    assert metrics.calls == {"get_node": 3, "create_buffer": 1, "push": 1, "pop": 1, "delete": 1}
+    assert metrics.errors == {"get_node": 1}
+    assert metrics.latency["get_node"].count == 3
+    assert metrics.path_depth.sum == 1 + 2 + 2
+    assert metrics.buffer_depth.sum == 2 + 1
+
+    slowest = metrics.slowest()
+    assert len(slowest) == 3
+    assert slowest[0]["seconds"] >= slowest[1]["seconds"] >= slowest[2]["seconds"]
+
+    # Sampled paths are taken before the call, a deleted node keeps its own
+    metrics = filesystem_complex.enable_metrics(sample_rate=1.0)
+    filesystem_complex.get_node("./Dir_2/Dir_21").delete()
+    assert {(c["operation"], c["path"]) for c in metrics.slowest()} == {("get_node", "./Dir_2/Dir_21"), ("delete", "~/Dir_2/Dir_21")}
+
+    # Keyword arguments are counted too, other filesystems are not
+    other = FileSystem()
+    other.create_directory(".", "Dir_1").create_log_file("file.log").append(information="x")
+    other.get_node(path="./Dir_1")
+    filesystem_complex.get_node(path="./Dir_1")
+    filesystem_complex.get_node("./Dir_1/file.buf").pop_many(count=1)
+    assert metrics.calls == {"get_node": 3, "delete": 1, "pop": 1}
+    assert metrics.log_appended == 0
+
+    filesystem_complex.disable_metrics()
+    filesystem_complex.get_node("./Dir_1")
+    assert metrics.calls["get_node"] == 3
+
+
+def test_watch(filesystem_complex: FileSystem):
+    watcher = filesystem_complex.watch("./Dir_1")
+    direct = filesystem_complex.watch("./Dir_1", recursive=False)
+    log_file = filesystem_complex.create_log_file("./Dir_1/Dir_11", "file.log")
+    log_file.append("first\n")
+    log_file.append("second\n")
+    buffer_file = filesystem_complex.create_buffer("./Dir_2", "file.buf")
+    buffer_file.push(1)
+    filesystem_complex.root.move("Dir_2", "./Dir_1")
+    filesystem_complex.get_node("./Dir_1/Dir_12").delete()
+
+    events = []
+    while (event := watcher.get()) is not None:
+        events.append(event)
+
+    assert events == [
+        {"event": "create", "path": "~/Dir_1/Dir_11/file.log", "type": "logfile"},
+        {"event": "append", "path": "~/Dir_1/Dir_11/file.log", "size": 13, "coalesced": 2},
+        {"event": "move", "path": "~/Dir_2", "dest": "~/Dir_1/Dir_2"},
+        {"event": "delete", "path": "~/Dir_1/Dir_12"},
+    ]
+    assert [e["event"] for e in iter(direct.get, None)] == ["move", "delete"]
+
+    direct.close()
+    assert filesystem_complex.watchers == (watcher,)
+
+
+def test_watch_overflow_and_transactions(filesystem_complex: FileSystem):
+    watcher = filesystem_complex.watch(".", size=2)
+
+    with pytest.raises(ValueError):
+        with filesystem_complex.transaction() as transaction:
+            transaction.mkdir("./Dir_1", "Dir_13")
+            transaction.mkdir("./Dir_1", "Dir_11")
+
+    assert watcher.get() is None
+
+    for i in range(5):
+        filesystem_complex.create_directory("./Dir_3", f"Dir_3{i}")
+
+    assert list(iter(watcher.get, None)) == [
+        {"event": "create", "path": "~/Dir_3/Dir_30", "type": "directory"},
+        {"event": "create", "path": "~/Dir_3/Dir_31", "type": "directory"},
+        {"event": "overflow", "path": "~", "dropped": 3},
+    ]
+
+    filesystem_complex.create_directory("./Dir_3", "Dir_35")
+    assert watcher.get() == {"event": "create", "path": "~/Dir_3/Dir_35", "type": "directory"}
+
+
+def test_watch_async(filesystem_complex: FileSystem):
+    async def run():
+        with filesystem_complex.watch("./Dir_2") as watcher:
+            assert await watcher.aget(timeout=0.01) is None
+
+            waiting = asyncio.ensure_future(watcher.aget(timeout=5))
+            await asyncio.sleep(0.01)
+            await asyncio.to_thread(filesystem_complex.create_binary_file, "./Dir_2", "file.bin", "data")
+
+            assert (await waiting)["path"] == "~/Dir_2/file.bin"
+
+        assert filesystem_complex.watchers == ()
+
+    asyncio.run(run())
+
+
+def check_usage(fs: FileSystem) -> None:
+    # Rolled-up counters match a full walk of every directory
+    for directory in [fs.root] + [n for _, n in fs.walk(types=(Directory,))]:
+        nodes = [n for _, n in directory.walk()]
+        size = sum(n.usage()[1] for n in nodes if not isinstance(n, Directory))
+
+        assert (directory.nodes, directory.size) == (len(nodes), size), directory.full_path()
+
+
+def test_usage_counters(filesystem_complex: FileSystem):
+    filesystem_complex.create_binary_file("./Dir_1/Dir_11", "file.bin", "data")
+    log_file = filesystem_complex.create_log_file("./Dir_1", "file.log", "first")
+    log_file.append("\nsecond")
+    buffer_file = filesystem_complex.create_buffer("./Dir_2/Dir_21", "file.buf")
+    buffer_file.push_many(["a", "bb", "ccc"])
+    buffer_file.pop()
+    check_usage(filesystem_complex)
+
+    assert filesystem_complex.du("./Dir_1") == {"path": "~/Dir_1", "nodes": 5, "size": 4 + 12}
+
+    filesystem_complex.root.move("Dir_1", "./Dir_2/Dir_22")
+    filesystem_complex.get_node("./Dir_2/Dir_22").copy("Dir_1", "./Dir_3")
+    filesystem_complex.get_node("./Dir_2/Dir_21").clone("./Dir_3")
+    filesystem_complex.get_node("./Dir_2/Dir_22/Dir_1/Dir_11").delete()
+    check_usage(filesystem_complex)
+
+    with pytest.raises(ValueError):
+        with filesystem_complex.transaction() as transaction:
+            transaction.append("./Dir_3/Dir_1/file.log", "\nthird")
+            transaction.push("./Dir_3/Dir_21/file.buf", ["dddd"])
+            transaction.delete("./Dir_3/Dir_1")
+            transaction.mkdir("./Dir_3", "Dir_21")
+
+    check_usage(filesystem_complex)
+
+    records = list(filesystem_complex.export_records(filesystem_complex.get_node("./Dir_3")))
+    filesystem_complex.get_node("./Dir_3").delete()
+    filesystem_complex.get_node("./Dir_2").import_records(records)
+    check_usage(filesystem_complex)
+    assert filesystem_complex.du().get("nodes") == len([n for _, n in filesystem_complex.walk()]) + 1
+
+
+def test_quota(filesystem_complex: FileSystem):
+    dir_1 = filesystem_complex.get_node("./Dir_1")
+    dir_1.set_quota(max_nodes=4, max_size=10)
+    log_file = filesystem_complex.create_log_file("./Dir_1/Dir_11", "file.log", "12345")
+
+    with pytest.raises(ValueError):
+        log_file.append("123456")
+
+    log_file.append("12345")
+
+    with pytest.raises(ValueError):
+        filesystem_complex.create_binary_file("./Dir_2", "file.bin", "1").parent.move("file.bin", "./Dir_1")
+
+    filesystem_complex.create_directory("./Dir_1", "Dir_13")
+
+    with pytest.raises(ValueError):
+        filesystem_complex.create_directory("./Dir_1/Dir_13", "Dir_131")
+
+    # Moves inside the quota don't count twice
+    dir_1.move("Dir_13", "./Dir_1/Dir_12")
+    assert dir_1.to_json()["quota"] == {"nodes": 4, "size": 10}
+    assert (dir_1.nodes, dir_1.size, filesystem_complex.root.size) == (4, 10, 11)
+
+    dir_1.set_quota()
+    filesystem_complex.create_directory("./Dir_1/Dir_12/Dir_13", "Dir_131")
+    check_usage(filesystem_complex)
+
+
+def test_usage_concurrent(filesystem_complex: FileSystem):
+    dir_1 = filesystem_complex.get_node("./Dir_1")
+    dir_1.set_quota(max_size=900)
+    log_files = [filesystem_complex.create_log_file(path, "file.log") for path in ("./Dir_1", "./Dir_1/Dir_11", "./Dir_2", "./Dir_3")]
+    rejected = []
+
+    def write(log_file):
+        for _ in range(500):
+            try:
+                log_file.append("x")
+            except ValueError:
+                rejected.append(log_file)
+
+    def churn():
+        for i in range(50):
+            filesystem_complex.create_directory("./Dir_2", f"tmp_{i}").delete()
+
+    threads = [threading.Thread(target=write, args=(log_file,)) for log_file in log_files]
+    threads.append(threading.Thread(target=churn))
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    # Writers below the quota share its 900 bytes, the others never wait on it
+    assert dir_1.size == 900
+    assert len(rejected) == 100 and set(rejected) <= set(log_files[:2])
+    assert log_files[2].size + log_files[3].size == 1000
+    check_usage(filesystem_complex)
+
+
+def test_usage_recovery(tmp_path):
+    fs = FileSystem.open(str(tmp_path))
+    build_persistent_tree(fs)
+    fs.get_node("./Dir_1").set_quota(max_size=100)
+    fs.checkpoint()
+    fs.get_node("./Dir_2").set_quota(max_nodes=5)
+    fs.close()
+
+    recovered = FileSystem.open(str(tmp_path))
+
+    check_usage(recovered)
+    assert recovered.get_node("./Dir_1").quota == (None, 100)
+    assert recovered.get_node("./Dir_2").quota == (5, None)
+    assert recovered.du() == fs.du()
+    recovered.close()
+
+
+def test_compress_cold(filesystem: FileSystem):
+    lines = "".join(f"2024-01-01 00:00:{i % 60:02d} INFO request {i} served\n" for i in range(10_000))
+    log_file = filesystem.create_log_file(".", "app.log")
+
+    for line in lines.splitlines(True) + ["tail\n"]:
+        log_file.append(line)
+
+    binary_file = filesystem.create_binary_file(".", "data.bin", "payload " * 1000)
+    binary_file.parent.copy("data.bin", "./Dir_1")
+    filesystem.create_binary_file(".", "small.bin", "payload")
+    du = filesystem.du()
+
+    assert filesystem.compress_cold(cold_after=60) == 0
+    assert filesystem.compress_cold(cold_after=0) == 2 + len(log_file.chunks)
+    assert all(type(chunk) is Compressed for chunk in log_file.chunks)
+    assert filesystem.compress_cold(cold_after=0) == 0
+
+    stats = filesystem.content_store.stats()
+    assert stats["compressed_size"] < len(lines) // 10
+    assert stats["entries"] == 2 + len(log_file.chunks)
+    assert filesystem.du() == du
+
+    assert log_file.read() == lines + "tail\n"
+    assert log_file.read(LOG_CHUNK_SIZE - 5, 20) == lines[LOG_CHUNK_SIZE - 5:LOG_CHUNK_SIZE + 15]
+    assert log_file.tail(2) == lines.splitlines(True)[-1] + "tail\n"
+    assert binary_file.read() == "payload " * 1000
+    assert bytes(binary_file.view(8, 7)) == b"payload"
+    assert filesystem.content_store.stats()["cached_size"] == log_file.size - log_file.pending_size + 8000
+
+    # Rolling back an append truncates across compressed chunks
+    size = log_file.size
+    with pytest.raises(ValueError):
+        with filesystem.transaction() as transaction:
+            transaction.append("./app.log", "x" * LOG_CHUNK_SIZE * 2)
+            transaction.mkdir(".", "Dir_1")
+
+    assert log_file.size == size and log_file.read() == lines + "tail\n"
+    assert [record[2] for record in filesystem.export_records(binary_file)] == ["payload " * 1000]
+
+    for name in ["app.log", "data.bin", "small.bin", "Dir_1/data.bin"]:
+        filesystem.get_node(name).delete()
+
+    assert filesystem.content_store.stats() == {
+        "entries": 0, "logical_size": 0, "stored_size": 0, "saved_size": 0, "dedup_ratio": 1.0,
+        "compressed_size": 0, "cached_size": 0, "resident_size": 0, "spilled_size": 0,
+    }
+
+
+def test_tiering(filesystem: FileSystem):
+    files = [filesystem.create_binary_file(".", f"f{i}.bin", f"{i} " * 2000) for i in range(5)]
+    with pytest.raises(ValueError):
+        filesystem.compress_cold(codec="gzip")
+
+    filesystem.enable_tiering(cold_after=0, interval=0.01, codec="lzma", cache_size=5000)
+
+    for _ in range(200):
+        if all(type(f.data) is Compressed for f in files):
+            break
+        time.sleep(0.01)
+
+    filesystem.close()
+
+    assert filesystem.tiering_thread is None
+    assert [f.read() for f in files] == [f"{i} " * 2000 for i in range(5)]
+    assert filesystem.content_store.stats()["cached_size"] <= 5000
+
+
+def build_spill_tree(fs: FileSystem) -> LogFile:
+    cold = fs.create_directory(".", "cold")
+    cold.create_directory("logs").create_log_file("app.log", "request served\n" * 10_000)
+    cold.create_binary_file("data.bin", "payload " * 1000)
+    cold.create_buffer("queue.buf").push_many([1, "two"])
+    cold.set_quota(max_nodes=5)
+    # Everything below is used one clock tick later than cold
+    fs.clock += 1
+    fs.create_directory(".", "hot").create_binary_file("data.bin", "hot " * 1000)
+
+    return fs.get_node("./cold/logs/app.log")
+
+
+def test_memory_budget(tmp_path):
+    with pytest.raises(ValueError):
+        FileSystem(memory_budget=1)
+
+    with pytest.raises(ValueError):
+        FileSystem().evict()
+
+    fs = FileSystem.open(str(tmp_path), memory_budget=10 ** 9)
+    log_file = build_spill_tree(fs)
+    records = list(fs.export_records(fs.root))
+    du = fs.du()
+
+    # Just over the budget: only the least recently used subtree goes
+    fs.memory_budget = fs.memory_usage() - 1
+    assert fs.evict() == 4
+    assert fs.get_node("./cold").lazy and not fs.get_node("./hot").lazy
+    assert fs.memory_usage() <= fs.memory_budget
+    assert fs.du() == du and fs.du("./cold")["nodes"] == 5
+    assert list(fs.export_records(fs.root)) == records
+
+    # find reads the spilled records, a subtree without a match stays on disk
+    usage = fs.memory_usage()
+    assert fs.find("*.txt") == [] and fs.find("*", "./hot", types=(LogFile,)) == []
+    assert fs.get_node("./cold").lazy and fs.memory_usage() == usage
+
+    # A kept reference is put back, not replaced
+    log_file.append("appended\n")
+    assert not fs.get_node("./cold").lazy
+    assert fs.get_node("./cold/logs/app.log") is log_file
+    assert log_file.tail(1) == "appended\n"
+
+    # Files outside of a spillable subtree only lose their content
+    top = fs.create_binary_file(".", "top.bin", "top " * 1000)
+    fs.memory_budget = 0
+    del log_file
+    fs.path_cache.clear()
+    fs.json_cache.clear()
+    assert fs.evict() == 5
+    assert type(top.data) is Spilled and top.read() == "top " * 1000
+    assert fs.spilled_nodes == 5
+    fs.content_store.trim(0)
+    assert fs.memory_usage() == 4 * SPILL_NODE_SIZE
+
+    # Faulted back in through childs, get_node and read
+    assert [child.name for child in fs.get_node("./cold").childs] == ["logs", "data.bin", "queue.buf"]
+    assert fs.get_node("./cold/logs/app.log").read(0, 15) == "request served\n"
+    assert fs.get_node("./hot/data.bin").read() == "hot " * 1000
+    assert fs.get_node("./cold/queue.buf").items == [1, "two"]
+    assert fs.get_node("./cold").quota == (5, None)
+    assert sorted(node.name for node in fs.find("*.bin")) == ["data.bin", "data.bin", "top.bin"]
+
+    with pytest.raises(ValueError):
+        fs.create_directory("./cold", "full").create_directory("too_many")
+
+    fs.evict()
+    fs.checkpoint()
+    fs.get_node("./hot").delete()
+    assert fs.spilled_nodes == 5
+    fs.close()
+
+    recovered = FileSystem.open(str(tmp_path), memory_budget=10 ** 9)
+    assert fs.du() == recovered.du()
+    assert recovered.get_node("./cold/logs/app.log").tail(1) == "appended\n"
+    recovered.close()
+
+
+def test_evict_concurrent_buffer(tmp_path):
+    fs = FileSystem(memory_budget=10 ** 9, spill_dir=str(tmp_path))
+    buffer_file = fs.create_directory(".", "cold").create_buffer("queue.buf", 4, "fifo")
+    fs.memory_budget = 0
+    popped = []
+
+    def produce():
+        for i in range(200):
+            buffer_file.push(i, timeout=5)
+
+    def consume():
+        for _ in range(200):
+            popped.append(buffer_file.pop(timeout=5))
+
+    threads = [threading.Thread(target=produce), threading.Thread(target=consume)]
+
+    for thread in threads:
+        thread.start()
+
+    # Parked pushes and pops hold only the buffer lock, evictions go through
+    while any(thread.is_alive() for thread in threads):
+        fs.clock += 1
+        fs.evict()
+
+    for thread in threads:
+        thread.join()
+
+    assert popped == list(range(200))
+    assert fs.get_node("./cold/queue.buf") is buffer_file and buffer_file.count == 0
+    check_usage(fs)
+    fs.close()
+
+
+def build_host_tree(root) -> None:
+    (root / "top" / "sub").mkdir(parents=True)
+    (root / "top" / "empty").mkdir()
+    (root / "top" / "a.txt").write_bytes(b"hello")
+    (root / "top" / "sub" / "app.log").write_text("first\nsecond\n")
+    (root / "top" / "sub" / "raw.log").write_bytes(b"\xff\xfe")
+    (root / "top" / "link").symlink_to("a.txt")
+
+
+def test_import_path(tmp_path):
+    build_host_tree(tmp_path)
+    fs = FileSystem.open(str(tmp_path / "data"))
+    calls = []
+
+    top = fs.import_path(str(tmp_path / "top"), ".", progress=lambda files, size: calls.append((files, size)), workers=2)
+
+    # Symlinks are skipped, decodable *.log files become LogFiles
+    assert [node.full_path() for _, node in fs.walk()] == ["~/top", "~/top/a.txt", "~/top/empty", "~/top/sub",
+                                                           "~/top/sub/app.log", "~/top/sub/raw.log"]
+    assert fs.get_node("./top/a.txt").read() == b"hello"
+    assert fs.get_node("./top/sub/app.log").tail(1) == "second\n"
+    assert fs.get_node("./top/sub/raw.log").read() == b"\xff\xfe"
+    assert calls[-1] == (3, 20)
+    assert top.usage() == (6, 20)
+    check_usage(fs)
+
+    fs.import_path(str(tmp_path / "top" / "sub"), "./top/empty", "copy")
+    assert fs.du("./top")["nodes"] == 9
+    check_usage(fs)
+
+    # Validated before anything is attached
+    with pytest.raises(ValueError):
+        FileSystem(dir_max_elems=2).import_path(str(tmp_path / "top"))
+
+    with pytest.raises(ValueError):
+        fs.import_path(str(tmp_path / "top"))
+
+    with pytest.raises(ValueError):
+        fs.import_path(str(tmp_path / "missing"))
+
+    assert fs.du()["nodes"] == 10
+    fs.close()
+
+    recovered = FileSystem.open(str(tmp_path / "data"))
+    assert recovered.get_node("./top/empty/copy/app.log").read() == "first\nsecond\n"
+    recovered.close()
+
+
+@pytest.mark.parametrize("compression", [None, "gz", "xz"])
+def test_tar_round_trip(filesystem_complex: FileSystem, compression):
+    filesystem_complex.create_binary_file("./Dir_1", "text", "some text")
+    filesystem_complex.create_binary_file("./Dir_1/Dir_11", "bytes", bytes(range(256)) * 10)
+    filesystem_complex.create_log_file("./Dir_1/Dir_12", "app.log", "first\nsecond\n")
+    filesystem_complex.create_buffer("./Dir_1", "queue.buf", 4, "fifo").push_many([1, "two"])
+    filesystem_complex.get_node("./Dir_1").set_quota(20, None)
+
+    chunks = list(filesystem_complex.export_tar("./Dir_1", compression))
+    data = b"".join(chunks)
+
+    with tarfile.open(fileobj=io.BytesIO(data)) as archive:
+        assert archive.getnames() == ["Dir_1", "Dir_1/Dir_11", "Dir_1/Dir_11/bytes", "Dir_1/Dir_12",
+                                      "Dir_1/Dir_12/app.log", "Dir_1/text", "Dir_1/queue.buf"]
+        assert archive.extractfile("Dir_1/Dir_11/bytes").read() == bytes(range(256)) * 10
+
+    target = FileSystem()
+    calls = []
+    copy = target.import_tar(io.BytesIO(data), progress=lambda files, size: calls.append(files))
+
+    assert list(target.export_records(copy)) == list(filesystem_complex.export_records(filesystem_complex.get_node("./Dir_1")))
+    assert copy.quota == (20, None)
+    assert calls == [4]
+    check_usage(target)
+
+    # The whole tree has several top level entries, they go into a new directory
+    with pytest.raises(ValueError):
+        target.import_tar(io.BytesIO(b"".join(filesystem_complex.export_tar("~", compression))))
+
+    target.import_tar(io.BytesIO(b"".join(filesystem_complex.export_tar("~", compression))), ".", "all")
+    assert [child.name for child in target.get_node("./all").childs] == ["Dir_1", "Dir_2", "Dir_3"]
+
+
+def test_export_tar_live(filesystem_complex: FileSystem):
+    for i in range(3):
+        filesystem_complex.create_binary_file(f"./Dir_2/Dir_2{i % 2 + 1}", f"f{i}", "x" * 50_000)
+
+    chunks = filesystem_complex.export_tar("./Dir_2")
+    first = next(chunks)
+
+    # Directories are listed as they are reached, like tar on a live filesystem
+    filesystem_complex.get_node("./Dir_2/Dir_22/f1").delete()
+    filesystem_complex.create_directory("./Dir_2/Dir_22", "later")
+
+    with tarfile.open(fileobj=io.BytesIO(first + b"".join(chunks))) as archive:
+        assert archive.getnames() == ["Dir_2", "Dir_2/Dir_21", "Dir_2/Dir_21/f0", "Dir_2/Dir_21/f2",
+                                      "Dir_2/Dir_22", "Dir_2/Dir_22/later"]
+
+    with pytest.raises(ValueError):
+        filesystem_complex.export_tar("./Dir_2", "zip")
+
+
+def test_import_tar_validation(filesystem: FileSystem):
+    def archive(*members: tuple[str, bytes | None]) -> io.BytesIO:
+        data = io.BytesIO()
+
+        with tarfile.open(fileobj=data, mode="w") as tar:
+            for name, content in members:
+                member = tarfile.TarInfo(name)
+
+                if content is None:
+                    member.type = tarfile.DIRTYPE
+                else:
+                    member.size = len(content)
+
+                tar.addfile(member, io.BytesIO(content or b""))
+
+        data.seek(0)
+        return data
+
+    for members in [[("top/../escape", b"")], [("top/~", b"")], [("top/a", b"x"), ("top/a/b", b"y")],
+                    [("top/a", None), ("top/a", b"x")], [("one", b""), ("two", b"")]]:
+        with pytest.raises(ValueError):
+            filesystem.import_tar(archive(*members))
+
+    with pytest.raises(ValueError):
+        filesystem.import_tar(archive(*[(f"top/f{i}", b"") for i in range(DIR_MAX_ELEMS + 1)]))
+
+    with pytest.raises(ValueError):
+        filesystem.import_tar(io.BytesIO(b"not an archive" * 100))
+
+    assert [child.name for child in filesystem.root.childs] == ["Dir_1"]
+
+    node = filesystem.import_tar(archive(("./top/a", b"x"), ("top/b/c", b"y")), "./Dir_1")
+    assert [n.full_path() for _, n in node.walk()] == ["~/Dir_1/top/a", "~/Dir_1/top/b", "~/Dir_1/top/b/c"]
+
+
+def test_shell_parse():
+    for line in ['makebin f1 payload', 'makebin "a b" \'c  d\' e\\ f', 'addlog ./l "say \\"hi\\"" \'it\\s\'',
+                 '  read   x  ', 'makebin a"b c"d', '', 'makebin "\\$HOME \\` \\\\ \\n" \\$x \'\\$y\'']:
+        assert parse(line) == shlex.split(line)
+
+    for line in ['makebin "a', "makebin 'a", 'makebin a\\']:
+        with pytest.raises(ValueError):
+            parse(line)
+
+
+def test_shell_script(filesystem: FileSystem, capsys):
+    lines = ["# provisioning", "", "makedir Dir_2", "cd Dir_2", 'makebin "with space" "two  spaces"',
+             "makelog app.log first", "read ./app.log", "unknown", "makebuf queue"]
+
+    assert run_script(filesystem, lines) == (6, 1)
+    assert filesystem.get_node("~/Dir_2/with space").read() == "two  spaces"
+    assert "line 8: ERROR" in capsys.readouterr().err
+
+    filesystem.change_working_directory("~")
+    assert run_script(filesystem, lines, keep_going=True) == (7, 4)
+    assert capsys.readouterr().out == "first\n"
+    assert [child.name for child in filesystem.get_node("~/Dir_2").childs] == ["with space", "app.log", "queue"]
+
+    # A comment isn't parsed, buffers are read without popping, the root stays put
+    filesystem.get_node("~/Dir_2/queue").push_many([1, 2])
+    lines = ["# it's a comment", "  #unmatched \"", "read ~/Dir_2/queue", "move ~ ~/Dir_2", "del ~/Dir_2/queue"]
+
+    assert run_script(filesystem, lines, keep_going=True) == (3, 1)
+    assert capsys.readouterr() == ("[1, 2]\n", "line 4: ERROR: Can't move root directory\n")
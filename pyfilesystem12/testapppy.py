@@ -1,4 +1,8 @@
+import io
+import json
+import threading
 import pytest
+from werkzeug.test import EnvironBuilder
 from app import app
 from python_filesystem.filesystem import FileSystem, Directory, BinaryFile, LogFile, BufferFile
 
@@ -22,13 +26,13 @@ def app_fixture():
 def test_index_get(app_fixture):
     index_response = app_fixture.get("/")
 
-    assert index_response.json == {"name": "~", "type": "directory", "path": [], "childs": ["dir1", "dir2", "dir3"]}
+    assert index_response.json == {"name": "~", "type": "directory", "path": [], "childs": ["dir1", "dir2", "dir3"], "nodes": 4, "size": 0}
 
 
 def test_file_get(app_fixture):
     index_response = app_fixture.get("/?path=./dir1")
 
-    assert index_response.json == {"name": "dir1", "type": "directory", "path": ["~"], "childs": ["dir11"]}
+    assert index_response.json == {"name": "dir1", "type": "directory", "path": ["~"], "childs": ["dir11"], "nodes": 1, "size": 0}
 
 
 def test_create_directory(app_fixture):
@@ -141,4 +145,241 @@ def test_buffer_pop(app_fixture):
     
     assert pop1.data == b"3"
     assert pop2.data == b"2"
-    assert pop3.data == b"1"
\ No newline at end of file
+    assert pop3.data == b"1"
+
+def test_logfile_append_response(app_fixture):
+    app_fixture.post("/logtextfile", data={"path": ".", "name": "lf", "information": "hello log"})
+    response = app_fixture.put("/logtextfile", data={"path": "./lf", "information": "\nmore info"})
+
+    assert response.status_code == 200
+    assert response.json == {"status": "ok", "size": 19}
+
+
+def test_logfile_append_quota(app_fixture):
+    app.config["FILESYSTEM_OBJ"].get_node("./dir1").set_quota(max_size=10)
+    app_fixture.post("/logtextfile", data={"path": "./dir1", "name": "lf", "information": "hello log"})
+    response = app_fixture.put("/logtextfile", data={"path": "./dir1/lf", "information": "\nmore info"})
+
+    assert response.status_code == 400
+    assert response.json == {"status": "error", "message": "Quota of ~/dir1 allows 10 bytes"}
+
+
+def test_logfile_ranged_read(app_fixture):
+    app_fixture.post("/logtextfile", data={"path": ".", "name": "lf", "information": "line 1\nline 2\nline 3"})
+
+    assert app_fixture.get("/logtextfile?path=./lf&offset=7&length=6").data == b'line 2'
+    assert app_fixture.get("/logtextfile?path=./lf&lines=2").data == b'line 2\nline 3'
+
+
+def test_buffer_batch(app_fixture):
+    app_fixture.post("/bufferfile", data={"path": ".", "name": "bf", "capacity": 1000, "mode": "fifo"})
+    response = app_fixture.put("/bufferfile", data={"path": "./bf", "information": [str(i) for i in range(1000)]})
+
+    assert response.status_code == 200
+    assert response.json['length'] == 1000
+
+    full = app_fixture.put("/bufferfile", data={"path": "./bf", "information": "overflow"})
+    assert full.status_code == 400
+
+    drained = app_fixture.get("/bufferfile?path=./bf&count=1000")
+
+    assert drained.json == {"items": [str(i) for i in range(1000)]}
+    assert app_fixture.get("/bufferfile?path=./bf&count=10").json == {"items": []}
+
+
+def test_buffer_long_poll(app_fixture):
+    app_fixture.post("/bufferfile", data={"path": ".", "name": "bf"})
+    buffer_file = app.config["FILESYSTEM_OBJ"].get_node("./bf")
+
+    empty = app_fixture.get("/bufferfile?path=./bf&wait=0.05")
+    assert empty.status_code == 400
+
+    threading.Timer(0.05, buffer_file.push, args=("late",)).start()
+    response = app_fixture.get("/bufferfile?path=./bf&wait=5")
+
+    assert response.status_code == 200
+    assert response.data == b"late"
+
+    threading.Timer(0.05, buffer_file.push_many, args=(["a", "b"],)).start()
+    response = app_fixture.get("/bufferfile?path=./bf&wait=5&count=10")
+
+    assert response.json == {"items": ["b", "a"]}
+
+
+def test_binaryfile_range_read(app_fixture):
+    app_fixture.post("/binaryfile", data={"path": ".", "name": "bf", "information": "hello world"})
+    response = app_fixture.get("/binaryfile?path=./bf", headers={"Range": "bytes=6-"})
+
+    assert response.status_code == 206
+    assert response.data == b'world'
+    assert response.headers["Content-Range"] == "bytes 6-10/11"
+
+    response = app_fixture.get("/binaryfile?path=./bf", headers={"Range": "bytes=20-30"})
+
+    assert response.status_code == 416
+
+
+def test_binaryfile_upload(app_fixture):
+    payload = bytes(range(256))
+    response = app_fixture.post("/binaryfile", data={"path": ".", "name": "bf", "information": (io.BytesIO(payload), "bf")})
+
+    assert response.status_code == 200
+    assert app_fixture.get("/binaryfile?path=./bf").data == payload
+
+
+def test_stats_dedup(app_fixture):
+    app_fixture.post("/binaryfile", data={"path": ".", "name": "bf1", "information": "payload"})
+    app_fixture.post("/binaryfile", data={"path": ".", "name": "bf2", "information": "payload"})
+
+    response = app_fixture.get("/stats")
+
+    assert response.status_code == 200
+    assert response.json["content"]["saved_size"] == len("payload")
+    assert response.json["content"]["dedup_ratio"] == 2.0
+
+
+def test_metrics(app_fixture):
+    assert app_fixture.get("/metrics").status_code == 404
+
+    app.config["FILESYSTEM_OBJ"].enable_metrics(sample_rate=1.0)
+    app_fixture.post("/logtextfile", data={"path": "./dir1", "name": "lf"})
+    app_fixture.put("/logtextfile", data={"path": "./dir1/lf", "information": "line\n"})
+    app_fixture.get("/", query_string={"path": "./dir1/missing"})
+
+    response = app_fixture.get("/metrics")
+    text = response.get_data(as_text=True)
+
+    assert response.status_code == 200
+    assert 'pyfs_operations_total{op="create_log_file"} 1' in text
+    assert 'pyfs_operations_total{op="append"} 1' in text
+    assert 'pyfs_operation_errors_total{op="get_node"} 1' in text
+    assert 'pyfs_operation_seconds_bucket{op="append",le="+Inf"} 1' in text
+    assert "pyfs_log_appended_characters_total 5" in text
+
+    calls = app_fixture.get("/metrics/slowest").json["calls"]
+    assert {"path": "~/dir1/lf", "operation": "append"}.items() <= next(c for c in calls if c["operation"] == "append").items()
+
+
+def test_watch(app_fixture):
+    response = app_fixture.get("/watch", query_string={"path": "./dir1"}, buffered=False)
+    stream = iter(response.response)
+
+    assert response.mimetype == "text/event-stream"
+    assert next(stream) == b": watching ~/dir1\n\n"
+
+    app.config["FILESYSTEM_OBJ"].create_log_file("./dir1/dir11", "lf")
+
+    assert next(stream) == b'event: create\ndata: {"event": "create", "path": "~/dir1/dir11/lf", "type": "logfile"}\n\n'
+
+    response.close()
+    assert app.config["FILESYSTEM_OBJ"].watchers == ()
+    assert app_fixture.get("/watch", query_string={"path": "./missing"}).status_code == 400
+
+    # A response dropped before its stream starts doesn't leave a watcher behind
+    body = app.wsgi_app(EnvironBuilder(path="/watch").get_environ(), lambda *args: None)
+    assert len(app.config["FILESYSTEM_OBJ"].watchers) == 1
+    body.close()
+    assert app.config["FILESYSTEM_OBJ"].watchers == ()
+
+
+def test_tree(app_fixture):
+    app_fixture.post("/logtextfile", data={"path": "./dir1/dir11", "name": "lf"})
+
+    response = app_fixture.get("/tree")
+
+    assert response.status_code == 200
+    assert response.data == b"   dir1\n      dir11\n         lf\n   dir2\n   dir3\n"
+
+    response = app_fixture.get("/tree?path=./dir1&type=logfile&format=jsonl")
+
+    assert [json.loads(line) for line in response.data.splitlines()] == [{"depth": 2, "name": "lf", "type": "logfile"}]
+    assert app_fixture.get("/tree?depth=1").data == b"   dir1\n   dir2\n   dir3\n"
+    assert app_fixture.get("/tree?type=folder").status_code == 400
+
+
+def test_search(app_fixture):
+    app_fixture.post("/logtextfile", data={"path": "./dir1/dir11", "name": "err.log"})
+    app_fixture.post("/logtextfile", data={"path": "./dir2", "name": "error.log"})
+    app_fixture.post("/binaryfile", data={"path": "./dir2", "name": "err.bin", "information": "data"})
+
+    response = app_fixture.get("/search?pattern=err*&type=logfile")
+
+    assert response.status_code == 200
+    assert response.json["results"] == ["~/dir1/dir11/err.log", "~/dir2/error.log"]
+    assert app_fixture.get("/search?pattern=err*&path=./dir2").json["results"] == ["~/dir2/err.bin", "~/dir2/error.log"]
+    assert app_fixture.get("/search?pattern=dir*&type=directory&limit=2").json["results"] == ["~/dir1", "~/dir1/dir11"]
+    assert app_fixture.get("/search?type=folder").status_code == 400
+    assert app_fixture.get("/search?path=./missing").status_code == 400
+
+
+def test_batch(app_fixture):
+    response = app_fixture.post("/batch", json=[
+        {"op": "mkdir", "path": "./dir1", "name": "new"},
+        {"op": "mklog", "path": "./dir1/new", "name": "lf", "information": "first"},
+        {"op": "append", "path": "./dir1/new/lf", "information": "\nsecond"},
+        {"op": "mkbuf", "path": "./dir1/new", "name": "bf", "mode": "fifo"},
+        {"op": "push", "path": "./dir1/new/bf", "information": ["a", "b"]},
+        {"op": "move", "src": "./dir2", "dest": "./dir1/new"},
+        {"op": "delete", "path": "./dir3"},
+    ])
+
+    assert response.status_code == 200
+    assert response.json["results"][:3] == [
+        {"status": "ok", "path": "~/dir1/new"},
+        {"status": "ok", "path": "~/dir1/new/lf"},
+        {"status": "ok", "size": len("first\nsecond")},
+    ]
+    assert response.json["results"][4] == {"status": "ok", "count": 2}
+    assert app_fixture.get("/logtextfile?path=./dir1/new/lf").data == b"first\nsecond"
+    assert app_fixture.get("/search?pattern=dir*&type=directory").json["results"] == ["~/dir1", "~/dir1/dir11", "~/dir1/new/dir2"]
+
+
+def test_batch_rollback(app_fixture):
+    response = app_fixture.post("/batch", json=[
+        {"op": "mkdir", "path": ".", "name": "new"},
+        {"op": "delete", "path": "./dir2"},
+        {"op": "mkdir", "path": "./missing", "name": "new"},
+        {"op": "mkdir", "path": ".", "name": "other"},
+    ])
+
+    assert response.status_code == 400
+    assert response.json["index"] == 2
+    assert [r["status"] for r in response.json["results"]] == ["rolled_back", "rolled_back", "error", "skipped"]
+    assert app_fixture.get("/search?pattern=*&type=directory").json["results"] == ["~/dir1", "~/dir1/dir11", "~/dir2", "~/dir3"]
+    assert app_fixture.post("/batch", json=[{"op": "format"}]).status_code == 400
+    assert app_fixture.post("/batch", json=[{"op": "mkdir", "path": "."}]).status_code == 400
+    assert app_fixture.post("/batch", json={"op": "mkdir"}).status_code == 400
+
+
+def test_index_get_paged(app_fixture):
+    response = app_fixture.get("/?limit=2")
+
+    assert response.json == {"name": "~", "type": "directory", "path": [], "childs": ["dir1", "dir2"], "nodes": 4, "size": 0, "total": 3, "next_cursor": "dir2"}
+    assert app_fixture.get("/?limit=2&cursor=dir2").json["childs"] == ["dir3"]
+    assert app_fixture.get("/?depth=1").json["children"][0] == {"name": "dir1", "type": "directory", "path": ["~"], "childs": ["dir11"], "nodes": 1, "size": 0}
+    assert app_fixture.get("/?limit=-1").status_code == 400
+    assert app_fixture.get("/?cursor=missing").status_code == 400
+
+
+def test_import_export(app_fixture):
+    app_fixture.post("/binaryfile", data={"path": "./dir1", "name": "bf", "information": "payload"})
+    app_fixture.post("/logtextfile", data={"path": "./dir1/dir11", "name": "app.log", "information": "first\n"})
+
+    response = app_fixture.get("/export?path=./dir1&compression=gz")
+
+    assert response.status_code == 200
+    assert response.mimetype == "application/gzip"
+
+    archive = response.data
+    response = app_fixture.post("/import?path=./dir2", data=archive, content_type="application/gzip")
+
+    assert response.json == {"status": "ok", "path": "~/dir2/dir1", "nodes": 4, "size": 13}
+    assert app_fixture.get("/logtextfile?path=./dir2/dir1/dir11/app.log").data == b"first\n"
+
+    response = app_fixture.post("/import?path=./dir3&name=copy&progress=1", data={"archive": (io.BytesIO(archive), "dir1.tgz")})
+    events = [json.loads(line) for line in response.data.decode().splitlines()]
+
+    assert events == [{"files": 2, "size": 13}, {"status": "ok", "path": "~/dir3/copy", "nodes": 5, "size": 13}]
+
+    assert app_fixture.post("/import?path=./dir2", data=archive).status_code == 400
+    assert app_fixture.get("/export?path=./dir1&compression=zip").status_code == 400
@@ -0,0 +1,132 @@
+import asyncio
+import io
+import json
+import tarfile
+import pytest
+from asgi import app
+from python_filesystem.filesystem import FileSystem
+
+
+@pytest.fixture
+def asgi_fixture():
+    fs = FileSystem()
+    fs.create_directory(".", "dir1")
+    fs.create_directory("./dir1", "dir11")
+    fs.create_directory(".", "dir2")
+    fs.create_directory(".", "dir3")
+
+    app.config.update({
+        "TESTING": True,
+        "FILESYSTEM_OBJ": fs
+    })
+
+    return app.test_client()
+
+
+def test_directory(asgi_fixture):
+    async def run():
+        response = await asgi_fixture.post("/directory", form={"path": "./dir1", "name": "new"})
+
+        assert response.status_code == 200
+        assert (await response.get_json())["name"] == "new"
+
+        response = await asgi_fixture.post("/directory", form={"path": "./dir1", "name": "new"})
+
+        assert response.status_code == 400
+
+    asyncio.run(run())
+
+
+def test_logtextfile(asgi_fixture):
+    async def run():
+        await asgi_fixture.post("/logtextfile", form={"path": "./dir1", "name": "lf", "information": "first"})
+        response = await asgi_fixture.put("/logtextfile", form={"path": "./dir1/lf", "information": "\nsecond"})
+
+        assert await response.get_json() == {"status": "ok", "size": len("first\nsecond")}
+
+        response = await asgi_fixture.get("/logtextfile?path=./dir1/lf&lines=1")
+
+        assert await response.get_data() == b"second"
+
+        app.config["FILESYSTEM_OBJ"].get_node("./dir1").set_quota(max_size=12)
+        response = await asgi_fixture.put("/logtextfile", form={"path": "./dir1/lf", "information": "third"})
+
+        assert response.status_code == 400
+
+    asyncio.run(run())
+
+
+def test_bufferfile_long_poll(asgi_fixture):
+    async def run():
+        await asgi_fixture.post("/bufferfile", form={"path": "./dir1", "name": "bf"})
+
+        # The consumer waits on the loop, so the producer request is served meanwhile
+        consumer = asyncio.create_task(asgi_fixture.get("/bufferfile?path=./dir1/bf&wait=5"))
+        await asyncio.sleep(0.1)
+        await asgi_fixture.put("/bufferfile", form={"path": "./dir1/bf", "information": "item"})
+        response = await consumer
+
+        assert await response.get_data() == b"item"
+
+        response = await asgi_fixture.get("/bufferfile?path=./dir1/bf&count=5&wait=0.1")
+
+        assert await response.get_json() == {"items": []}
+
+    asyncio.run(run())
+
+
+def test_binaryfile_range(asgi_fixture):
+    async def run():
+        await asgi_fixture.post("/binaryfile", form={"path": "./dir1", "name": "bf", "information": "0123456789"})
+        response = await asgi_fixture.get("/binaryfile?path=./dir1/bf", headers={"Range": "bytes=2-5"})
+
+        assert response.status_code == 206
+        assert await response.get_data() == b"2345"
+
+    asyncio.run(run())
+
+
+def test_tree_and_batch(asgi_fixture):
+    async def run():
+        response = await asgi_fixture.post("/batch", json=[
+            {"op": "mklog", "path": "./dir1/dir11", "name": "lf"},
+            {"op": "delete", "path": "./dir3"},
+        ])
+
+        assert response.status_code == 200
+
+        response = await asgi_fixture.get("/tree?format=jsonl&type=logfile")
+
+        assert [json.loads(line) for line in (await response.get_data()).splitlines()] == [{"depth": 3, "name": "lf", "type": "logfile"}]
+
+        response = await asgi_fixture.get("/search?pattern=dir*")
+
+        assert (await response.get_json())["results"] == ["~/dir1", "~/dir1/dir11", "~/dir2"]
+
+    asyncio.run(run())
+
+
+def test_import_export(asgi_fixture):
+    async def run():
+        await asgi_fixture.post("/binaryfile", form={"path": "./dir1", "name": "bf", "information": "payload"})
+
+        response = await asgi_fixture.get("/export?path=./dir1")
+        archive = await response.get_data()
+
+        with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+            assert tar.getnames() == ["dir1", "dir1/dir11", "dir1/bf"]
+
+        response = await asgi_fixture.post("/import?path=./dir2", data=archive)
+
+        assert (await response.get_json()) == {"status": "ok", "path": "~/dir2/dir1", "nodes": 3, "size": 7}
+
+        response = await asgi_fixture.post("/import?path=./dir3&name=copy&progress=1", data=archive)
+        events = [json.loads(line) for line in (await response.get_data()).decode().splitlines()]
+
+        assert events == [{"files": 1, "size": 7}, {"status": "ok", "path": "~/dir3/copy", "nodes": 4, "size": 7}]
+
+        response = await asgi_fixture.post("/import?path=./dir2", data=archive)
+
+        assert response.status_code == 400
+
+    asyncio.run(run())